@@ -0,0 +1,98 @@
+import argparse
+import ipaddress
+import random
+import sys
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib import ip_math
+
+
+def _inputs(count: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    v4_ranges = []
+    v6_ranges = []
+    for _ in range(count):
+        first = rng.getrandbits(32)
+        v4_ranges.append((first, min(first + rng.getrandbits(rng.randint(0, 16)), 2**32 - 1)))
+        first = rng.getrandbits(64) << 64
+        v6_ranges.append((first, first + rng.getrandbits(rng.randint(0, 64))))
+    return {
+        "v4_ranges": v4_ranges,
+        "v6_ranges": v6_ranges,
+        "v4_text": [ip_math.format_ipv4(first) for first, _ in v4_ranges],
+        "v6_text": [ip_math.format_ipv6(first) for first, _ in v6_ranges],
+    }
+
+
+# name -> (ip_math function, ipaddress function), both called with every input
+CASES = {
+    "parse_ipv4": (
+        "v4_text",
+        lambda text: ip_math.parse_ipv4(text),
+        lambda text: int(ipaddress.IPv4Address(text)),
+    ),
+    "parse_ipv6": (
+        "v6_text",
+        lambda text: ip_math.parse_ipv6(text),
+        lambda text: int(ipaddress.IPv6Address(text)),
+    ),
+    "format_ipv4": (
+        "v4_ranges",
+        lambda bounds: ip_math.format_ipv4(bounds[0]),
+        lambda bounds: str(ipaddress.IPv4Address(bounds[0])),
+    ),
+    "format_ipv6": (
+        "v6_ranges",
+        lambda bounds: ip_math.format_ipv6(bounds[0]),
+        lambda bounds: str(ipaddress.IPv6Address(bounds[0])),
+    ),
+    "format_ipv6_exploded": (
+        "v6_ranges",
+        lambda bounds: ip_math.format_ipv6_exploded(bounds[0]),
+        lambda bounds: ipaddress.IPv6Address(bounds[0]).exploded,
+    ),
+    "cidr_cover_v4": (
+        "v4_ranges",
+        lambda bounds: ip_math.cidr_cover(bounds[0], bounds[1], ip_math.IPV4_BITS),
+        lambda bounds: list(ipaddress.summarize_address_range(ipaddress.IPv4Address(bounds[0]), ipaddress.IPv4Address(bounds[1]))),
+    ),
+    "cidr_cover_v6": (
+        "v6_ranges",
+        lambda bounds: ip_math.cidr_cover(bounds[0], bounds[1], ip_math.IPV6_BITS),
+        lambda bounds: list(ipaddress.summarize_address_range(ipaddress.IPv6Address(bounds[0]), ipaddress.IPv6Address(bounds[1]))),
+    ),
+}
+
+
+def _time(function, values) -> float:
+    start = time.perf_counter()
+    for value in values:
+        function(value)
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Compare lib.ip_math with the equivalent ipaddress calls")
+    arg_parser.add_argument("--count", type=int, default=200_000, help="Inputs per case")
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Runs per case, the fastest one is kept")
+    args = arg_parser.parse_args()
+
+    inputs = _inputs(args.count, args.seed)
+    print(f"{'case':>22} {'ip_math ns/op':>14} {'ipaddress ns/op':>16} {'speedup':>8}")
+    for name, (input_name, fast, reference) in CASES.items():
+        values = inputs[input_name]
+        fast_seconds = min(_time(fast, values) for _ in range(args.repeat))
+        reference_seconds = min(_time(reference, values) for _ in range(args.repeat))
+        print(
+            f"{name:>22} {fast_seconds / len(values) * 1e9:>14.0f} {reference_seconds / len(values) * 1e9:>16.0f} "
+            f"{reference_seconds / fast_seconds:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import sys
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.ripe_parser import PARSER_ATTRIBUTES
+from lib.rpsl_reader import read_rpsl_objects
+
+
+def legacy_objects(file_path):
+    """The per-line strip/startswith/split loop RIPE_PARSER.parse_file used before the streaming reader."""
+    with open(file_path, 'r', -1, "latin-1") as file:
+        block = {}
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("inetnum:") or line.startswith("inet6num:"):
+                if block:
+                    yield block
+                    block = {}
+            if line and line.find(":") >= 0:
+                key, value = line.split(":", 1)
+                if key == "inet6num":
+                    block["inetnum"] = value.strip()
+                    block["ipVersion"] = 6
+                    continue
+                elif key == "inetnum":
+                    block["inetnum"] = value.strip()
+                    block["ipVersion"] = 4
+                    continue
+                if key in block:
+                    if key == "descr":
+                        block[key.strip()] += "\n" + value.strip()
+                else:
+                    block[key.strip()] = value.strip()
+        if block:
+            yield block
+
+
+def measure(name, objects, lines):
+    start = time.perf_counter()
+    count = sum(1 for _ in objects)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {count} objects in {elapsed:.2f}s, {lines / elapsed:,.0f} lines/sec")
+    return elapsed
+
+
+if __name__ == "__main__":
+    file_path = sys.argv[1] if len(sys.argv) > 1 else str(path_root / "db/ripe.db.inetnum")
+    with open(file_path, "rb") as file:
+        lines = sum(chunk.count(b"\n") for chunk in iter(lambda: file.read(1 << 24), b""))
+
+    legacy = measure("legacy", legacy_objects(file_path), lines)
+    streaming = measure("streaming", read_rpsl_objects(file_path, PARSER_ATTRIBUTES), lines)
+    print(f"speedup: {legacy / streaming:.1f}x")
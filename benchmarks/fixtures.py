@@ -0,0 +1,243 @@
+import ipaddress
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.mmdb_builder import write_mmdb
+
+# Bump when the generated content changes, cached fixtures are then regenerated
+FIXTURES_VERSION = 2
+
+COUNTRIES = ("IT", "DE", "FR", "NL", "GB", "ES", "PL", "SE", "US", "BR", "CN", "JP", "ZA")
+MAINTAINERS = ("RIPE-NCC-HM-MNT", "APNIC-HM", "LACNIC-MNT", "AFRINIC-HM-MNT") + tuple(f"MNT-ORG{i}" for i in range(200))
+
+# First and last usable IPv4 addresses (1.0.0.0 - 223.255.255.255) and the IPv6 base of the allocations
+_V4_FIRST = 1 << 24
+_V4_END = 224 << 24
+_V6_BASE = 0x2A00 << 112
+
+
+def _v4(value: int) -> str:
+    return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+def _v6_network(value: int, prefix_len: int) -> str:
+    # The allocations are aligned on at most 64 bits, the lower groups are zero
+    groups = [(value >> shift) & 0xFFFF for shift in (112, 96, 80, 64)]
+    while groups and groups[-1] == 0:
+        groups.pop()
+    return f"{':'.join(f'{group:x}' for group in groups)}::/{prefix_len}"
+
+
+def _v6_range(value: int, prefix_len: int) -> str:
+    last = value + (1 << (128 - prefix_len)) - 1
+    return f"{ipaddress.IPv6Address(value)} - {ipaddress.IPv6Address(last)}"
+
+
+def _descr(rng: random.Random, index: int) -> list:
+    lines = [f"descr:          Customer network {index}"]
+    if rng.random() < 0.4:
+        lines.append(f"descr:          {rng.choice(('Datacenter', 'Broadband pool', 'Corporate LAN', 'Hosting'))} {rng.randrange(1000)}")
+        if rng.random() < 0.5:
+            lines.append(f"                {rng.choice(('Milano', 'Frankfurt', 'Amsterdam', 'Paris'))} continuation")
+        if rng.random() < 0.2:
+            lines.append("+               plus continuation")
+    return lines
+
+
+def _rpsl_object(rng: random.Random, key: str, value: str, index: int, status: str) -> str:
+    lines = [f"{key}:{' ' * max(1, 16 - len(key) - 1)}{value}", f"netname:        NET-{rng.randrange(50000)}"]
+    lines += _descr(rng, index)
+    roll = rng.random()
+    country = "EU # Country is really world wide" if roll < 0.01 else rng.choice(COUNTRIES)
+    lines.append(f"country:        {country}")
+    lines.append("admin-c:        XX1-RIPE")
+    lines.append("tech-c:         XX2-RIPE")
+    lines.append(f"status:         {status}")
+    lines.append(f"mnt-by:         {rng.choice(MAINTAINERS)}")
+    if rng.random() < 0.3:
+        lines.append(f"mnt-by:         {rng.choice(MAINTAINERS)}")
+    lines.append("created:        2020-01-01T00:00:00Z")
+    lines.append("source:         RIPE")
+    return "\n".join(lines) + "\n\n"
+
+
+def _parent_size(objects: int, space: int, largest: int) -> int:
+    # Parents hold 3.5 children on average, pick the largest size that leaves room for all of them
+    parents = max(1, int(objects / 4.5) + 1)
+    size = largest
+    while size > 256 and size * parents > space:
+        size >>= 1
+    return size
+
+
+def write_rpsl_v4(path: str, objects: int, rng: random.Random) -> int:
+    """IPv4 inetnum objects: allocations with nested assignments, some CIDR shorthand ones."""
+    parent_size = _parent_size(objects, _V4_END - _V4_FIRST, 1 << 16)
+    written = 0
+    address = _V4_FIRST
+    with open(path, "w", encoding="latin-1") as file:
+        file.write("% This is a synthetic RIPE Database dump\n% generated by benchmarks/fixtures.py\n\n")
+        while written < objects:
+            if address + parent_size > _V4_END:
+                address = _V4_FIRST + rng.randrange(256) * 256
+            file.write(_rpsl_object(rng, "inetnum", f"{_v4(address)} - {_v4(address + parent_size - 1)}", written, "ALLOCATED PA"))
+            written += 1
+            child_size = max(parent_size >> rng.randint(2, 4), 1)
+            slots = parent_size // child_size
+            for slot in sorted(rng.sample(range(slots), min(slots, rng.randint(1, 6)))):
+                if written >= objects:
+                    break
+                first = address + slot * child_size
+                if child_size == 256 and rng.random() < 0.1:
+                    value = f"{_v4(first).rsplit('.', 1)[0]}/24"
+                else:
+                    value = f"{_v4(first)} - {_v4(first + child_size - 1)}"
+                file.write(_rpsl_object(rng, "inetnum", value, written, "ASSIGNED PA"))
+                written += 1
+            address += parent_size
+    return written
+
+
+def write_rpsl_v6(path: str, objects: int, rng: random.Random) -> int:
+    """IPv6 inet6num objects: /32 allocations with nested /48 - /56 assignments."""
+    written = 0
+    parent = 0
+    with open(path, "w", encoding="latin-1") as file:
+        file.write("% This is a synthetic RIPE Database dump\n\n")
+        while written < objects:
+            base = _V6_BASE | (parent << 96)
+            parent += 1
+            file.write(_rpsl_object(rng, "inet6num", _v6_network(base, 32), written, "ALLOCATED-BY-RIR"))
+            written += 1
+            prefix_len = rng.choice((48, 56))
+            for slot in sorted(rng.sample(range(1 << 16), rng.randint(1, 6))):
+                if written >= objects:
+                    break
+                network = _v6_network(base | (slot << (128 - prefix_len)), prefix_len)
+                file.write(_rpsl_object(rng, "inet6num", network, written, "ASSIGNED"))
+                written += 1
+    return written
+
+
+def write_arin_bulk(path: str, objects: int, rng: random.Random) -> int:
+    """ARIN bulk whois NetHandle / V6NetHandle objects (the arin_db.txt format)."""
+    address = 3 << 24
+    with open(path, "w", encoding="latin-1") as file:
+        for index in range(objects):
+            lines = []
+            if rng.random() < 0.85:
+                size = 1 << rng.randint(8, 12)
+                address = (address + size - 1) // size * size
+                if address + size > _V4_END:
+                    address = 3 << 24
+                lines.append(f"NetHandle: NET-{_v4(address).replace('.', '-')}-1")
+                lines.append(f"NetRange: {_v4(address)} - {_v4(address + size - 1)}")
+                address += size
+            else:
+                base = (0x2600 << 112) | (index << 80)
+                lines.append(f"V6NetHandle: NET6-{index}-1")
+                lines.append(f"NetRange: {_v6_range(base, 48)}")
+            lines.append(f"OrgID: ORG-{rng.randrange(5000)}")
+            lines.append(f"NetName: ARIN-NET-{index}")
+            lines.append(f"NetType: {'Early Registrations, Maintained by ARIN' if rng.random() < 0.02 else 'Direct Allocation'}")
+            lines.append(f"Country: {rng.choice(('US', 'CA'))}")
+            for line in range(rng.randint(0, 3)):
+                lines.append(f"Comment: Synthetic comment line {line}")
+            lines.append("RegDate: 2001-01-01")
+            lines.append("Updated: 2020-01-01")
+            lines.append("Source: ARIN")
+            file.write("\n".join(lines) + "\n\n")
+    return objects
+
+
+def write_transfers_json(path: str, transfers: int, rng: random.Random) -> int:
+    """
+    transfers_latest.json with zero padded IPv4 start addresses, some IPv6 sets and
+    some transfers without nets, returns the number of nets.
+    """
+    nets = 0
+    address = 12 << 24
+    with open(path, "w") as file:
+        file.write('{"transfers": [\n')
+        for index in range(transfers):
+            transfer = {"description": f"Transfer {index}", "transfer_date": "2020-01-01"}
+            if index % 50 != 49:
+                transfer["recipient_organization"] = {"name": f"ORG-{rng.randrange(2000)}", "country_code": rng.choice(("US", "CA"))}
+                transfer_set = []
+                for _ in range(rng.randint(1, 3)):
+                    transfer_set.append({
+                        "start_address": ".".join(f"{int(octet):03d}" for octet in _v4(address).split(".")),
+                        "end_address": _v4(address + 255),
+                    })
+                    address += 256
+                    nets += 1
+                transfer["ip4nets"] = {"transfer_set": transfer_set}
+                if index % 9 == 0:
+                    base = (0x2620 << 112) | (index << 80)
+                    first, last = _v6_range(base, 48).split(" - ")
+                    transfer["ip6nets"] = {"transfer_set": [{"start_address": first, "end_address": last}]}
+                    nets += 1
+            file.write(("  " if index == 0 else ", ") + json.dumps(transfer) + "\n")
+        file.write("]}\n")
+    return nets
+
+
+def write_geolite(directory: str, rng: random.Random):
+    """Fake GeoLite2 ASN and City databases covering the whole address space with /8 (IPv4) and /16 (IPv6) networks."""
+    os.makedirs(directory, exist_ok=True)
+    asn_ranges = []
+    city_ranges = []
+    cities = [
+        {"city": {"names": {"en": f"City {i}"}}, "country": {"iso_code": country, "names": {"en": f"Country {country}"}}}
+        for i, country in enumerate(COUNTRIES * 3)
+    ]
+    # IPv4 in ::/96 then IPv6
+    for first, size in [((octet << 24), 1 << 24) for octet in range(1, 224)] + [((group << 112), 1 << 112) for group in range(0x2000, 0x2C00, 4)]:
+        asn_number = rng.randrange(1, 400000)
+        asn_ranges.append((first, first + size - 1, {"autonomous_system_number": asn_number, "autonomous_system_organization": f"AS-ORG-{asn_number}"}))
+        city_ranges.append((first, first + size - 1, rng.choice(cities)))
+    write_mmdb(os.path.join(directory, "GeoLite2-ASN.mmdb"), asn_ranges, database_type="GeoLite2-ASN")
+    write_mmdb(os.path.join(directory, "GeoLite2-City.mmdb"), city_ranges, database_type="GeoLite2-City")
+
+
+def generate_fixtures(directory: str, objects: int, v6_ratio: float = 0.2, seed: int = 42) -> dict:
+    """
+    Writes deterministic synthetic dumps for `objects` RPSL objects in `directory`
+    (db/ layout: ripe.db.inetnum, ripe.db.inet6num, arin_db.txt,
+    transfers_latest.json and base_mmdb/), the ARIN bulk file has objects / 10
+    objects and the transfers file objects / 50 transfers. The files are written
+    as streams, memory doesn't grow with `objects`.
+
+    A manifest.json with the parameters and object counts is written last, the
+    fixtures are reused as long as it matches the requested parameters.
+    """
+    manifest_path = os.path.join(directory, "manifest.json")
+    parameters = {"version": FIXTURES_VERSION, "objects": objects, "v6_ratio": v6_ratio, "seed": seed}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest["parameters"] == parameters:
+            return manifest
+
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    v6_objects = int(objects * v6_ratio)
+    counts = {
+        "ripe.db.inetnum": write_rpsl_v4(os.path.join(directory, "ripe.db.inetnum"), objects - v6_objects, random.Random(seed)),
+        "ripe.db.inet6num": write_rpsl_v6(os.path.join(directory, "ripe.db.inet6num"), v6_objects, random.Random(seed + 1)),
+        "arin_db.txt": write_arin_bulk(os.path.join(directory, "arin_db.txt"), max(objects // 10, 1), random.Random(seed + 2)),
+        "transfers_latest.json": write_transfers_json(os.path.join(directory, "transfers_latest.json"), max(objects // 50, 1), random.Random(seed + 3)),
+    }
+    write_geolite(os.path.join(directory, "base_mmdb"), random.Random(seed + 4))
+
+    manifest = {"parameters": parameters, "objects": counts}
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
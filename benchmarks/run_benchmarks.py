@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import platform
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from benchmarks.fixtures import generate_fixtures
+
+DEFAULT_FIXTURES = str(path_root / "benchmarks" / "data")
+
+
+def _count_blocks(parse, *args, **kwargs) -> int:
+    count = 0
+
+    def on_block(block):
+        nonlocal count
+        count += 1
+
+    parse(*args, on_block, **kwargs)
+    return count
+
+
+def _parsed_blocks(fixtures: str) -> list:
+    from lib.ripe_parser import RIPE_PARSER
+
+    blocks = []
+    for name in ("ripe.db.inetnum", "ripe.db.inet6num"):
+        RIPE_PARSER.parse_file(os.path.join(fixtures, name), blocks.append)
+    return blocks
+
+
+def bench_rpsl_reader(fixtures: str, workdir: str):
+    from lib.ripe_parser import PARSER_ATTRIBUTES
+    from lib.rpsl_reader import read_rpsl_objects
+
+    start = time.perf_counter()
+    count = sum(1 for _ in read_rpsl_objects(os.path.join(fixtures, "ripe.db.inetnum"), PARSER_ATTRIBUTES))
+    return count, time.perf_counter() - start
+
+
+def bench_parse_file(fixtures: str, workdir: str):
+    from lib.ripe_parser import RIPE_PARSER
+
+    start = time.perf_counter()
+    count = sum(_count_blocks(RIPE_PARSER.parse_file, os.path.join(fixtures, name)) for name in ("ripe.db.inetnum", "ripe.db.inet6num"))
+    return count, time.perf_counter() - start
+
+
+def bench_parse_arin_file(fixtures: str, workdir: str):
+    from lib.ripe_parser import RIPE_PARSER
+
+    start = time.perf_counter()
+    count = _count_blocks(RIPE_PARSER.parse_arin_file, os.path.join(fixtures, "arin_db.txt"))
+    return count, time.perf_counter() - start
+
+
+def bench_parse_transfer_json_file(fixtures: str, workdir: str):
+    from lib.ripe_parser import RIPE_PARSER
+
+    start = time.perf_counter()
+    count = _count_blocks(RIPE_PARSER.parse_transfer_json_file, os.path.join(fixtures, "transfers_latest.json"))
+    return count, time.perf_counter() - start
+
+
+def bench_insert_data(fixtures: str, workdir: str):
+    """SQLiteHandler.insert_data of the parsed RIPE blocks, the parsing isn't timed."""
+    from lib.db import SQLiteHandler
+
+    blocks = _parsed_blocks(fixtures)
+    db_handler = SQLiteHandler(os.path.join(workdir, "insert_data.db"))
+    db_handler.create_table()
+    start = time.perf_counter()
+    db_handler.insert_data(blocks)
+    return len(blocks), time.perf_counter() - start
+
+
+def _bench_generate_mmdb(fixtures: str, workdir: str, options: list):
+    """scripts/generate_mmdb.py on a database of the parsed RIPE blocks, the import isn't timed."""
+    from lib.db import SQLiteHandler
+
+    # generate_mmdb.py resolves its paths ("../geolocation_db.db") from its own
+    # location, it runs from a copy of the repository layout made of links
+    os.symlink(path_root / "lib", os.path.join(workdir, "lib"))
+    os.makedirs(os.path.join(workdir, "scripts"))
+    os.symlink(path_root / "scripts" / "generate_mmdb.py", os.path.join(workdir, "scripts", "generate_mmdb.py"))
+    os.makedirs(os.path.join(workdir, "db"))
+    os.symlink(os.path.join(fixtures, "base_mmdb"), os.path.join(workdir, "db", "base_mmdb"))
+    os.makedirs(os.path.join(workdir, "output"))
+
+    db_handler = SQLiteHandler(os.path.join(workdir, "geolocation_db.db"))
+    db_handler.create_table()
+    blocks = _parsed_blocks(fixtures)
+    with db_handler.bulk_writer() as writer:
+        writer.write_many(blocks)
+    db_handler.create_indexes()
+    del blocks
+
+    stats_path = os.path.join(workdir, "stats.json")
+    sys.argv = ["generate_mmdb.py", "--stats-json", stats_path, *options]
+    start = time.perf_counter()
+    runpy.run_path(os.path.join(workdir, "scripts", "generate_mmdb.py"), run_name="__main__")
+    elapsed = time.perf_counter() - start
+    with open(stats_path) as file:
+        return json.load(file)["counters"]["records_built"], elapsed
+
+
+def bench_generate_mmdb(fixtures: str, workdir: str):
+    return _bench_generate_mmdb(fixtures, workdir, [])
+
+
+def bench_generate_mmdb_native(fixtures: str, workdir: str):
+    return _bench_generate_mmdb(fixtures, workdir, ["--native"])
+
+
+CASES = {
+    "rpsl_reader": bench_rpsl_reader,
+    "parse_file": bench_parse_file,
+    "parse_arin_file": bench_parse_arin_file,
+    "parse_transfer_json_file": bench_parse_transfer_json_file,
+    "insert_data": bench_insert_data,
+    "generate_mmdb": bench_generate_mmdb,
+    "generate_mmdb_native": bench_generate_mmdb_native,
+}
+
+
+def run_case_in_subprocess(name: str, fixtures: str) -> dict:
+    """
+    Runs a case in a fresh interpreter so every case starts from the same state
+    and its peak RSS (ru_maxrss of that process, setup included) is its own.
+    """
+    with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as workdir:
+        process = subprocess.Popen(
+            [sys.executable, __file__, "--run-case", name, "--fixtures", fixtures, "--workdir", workdir],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        output = process.stdout.read()
+        process.stdout.close()
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"Benchmark {name} failed with exit code {process.returncode}, run it with --run-case {name} to see the error")
+    result = json.loads(output.decode().strip().splitlines()[-1])
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "objects": result["objects"],
+        "seconds": round(result["seconds"], 3),
+        "objects_per_sec": round(result["objects"] / result["seconds"], 1) if result["seconds"] > 0 else 0.0,
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns the regressions: throughput below or peak RSS above the baseline by more than `tolerance`."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline["results"].get(name)
+        if reference is None:
+            continue
+        if result["objects_per_sec"] < reference["objects_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['objects_per_sec']:,.0f} objects/s, baseline {reference['objects_per_sec']:,.0f}")
+        if result["peak_rss_mb"] > reference["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['peak_rss_mb']} MB peak RSS, baseline {reference['peak_rss_mb']} MB")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Benchmark the parsers, the SQLite import and the MMDB generation on synthetic dumps")
+    arg_parser.add_argument("--objects", type=int, default=1_000_000, help="RPSL objects of the synthetic dumps (the ARIN and transfers files are scaled from it)")
+    arg_parser.add_argument("--v6-ratio", type=float, default=0.2, help="Share of inet6num objects")
+    arg_parser.add_argument("--seed", type=int, default=42)
+    arg_parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="Directory of the generated dumps, reused while the parameters don't change")
+    arg_parser.add_argument("--cases", default=",".join(CASES), help=f"Comma separated cases, any of {','.join(CASES)}")
+    arg_parser.add_argument("--repeat", type=int, default=1, help="Runs per case, the fastest one is kept")
+    arg_parser.add_argument("--output", help="Write the results as JSON to this file")
+    arg_parser.add_argument("--save-baseline", metavar="PATH", help="Store the results as a baseline")
+    arg_parser.add_argument("--compare", metavar="PATH", help="Compare the results to a baseline, exits with 1 on regressions")
+    arg_parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown / RSS growth against the baseline")
+    arg_parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    arg_parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run_case:
+        objects, seconds = CASES[args.run_case](args.fixtures, args.workdir)
+        sys.stdout.flush()
+        print(json.dumps({"objects": objects, "seconds": seconds}))
+        return
+
+    cases = [name.strip() for name in args.cases.split(",") if name.strip()]
+    for name in cases:
+        if name not in CASES:
+            raise SystemExit(f"Unknown case {name}, use any of {','.join(CASES)}")
+
+    fixtures = os.path.abspath(args.fixtures)
+    start = time.perf_counter()
+    manifest = generate_fixtures(fixtures, args.objects, v6_ratio=args.v6_ratio, seed=args.seed)
+    print(f"Fixtures in {fixtures} ({time.perf_counter() - start:.1f}s): {manifest['objects']}")
+
+    results = {}
+    for name in cases:
+        runs = [run_case_in_subprocess(name, fixtures) for _ in range(max(args.repeat, 1))]
+        results[name] = max(runs, key=lambda run: run["objects_per_sec"])
+        result = results[name]
+        print(
+            f"{name:>26}: {result['objects']:>10} objects in {result['seconds']:>8.2f}s "
+            f"{result['objects_per_sec']:>12,.0f} objects/s {result['peak_rss_mb']:>8.1f} MB peak RSS"
+        )
+
+    report = {
+        "meta": {
+            **manifest["parameters"],
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as file:
+                json.dump(report, file, indent=2)
+            print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if baseline["meta"].get("objects") != args.objects:
+            print(f"Warning: the baseline was measured with {baseline['meta'].get('objects')} objects")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression against {args.compare} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
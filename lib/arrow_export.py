@@ -0,0 +1,244 @@
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional
+
+from lib.block_filter import BlockFilter
+from lib.db import FINGERPRINTS_TABLE, SQLiteHandler, is_normalized
+
+FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
+DEFAULT_BATCH_ROWS = 64 * 1024
+# Columns of the exported tables, ip_version is the table (ip_data_v4/ip_data_v6) instead of a column
+EXPORT_COLUMNS = (
+    "id", "first_ip", "last_ip", "first_ip_int", "last_ip_int", "subnet", "network_prefix",
+    "netname", "country", "descr", "mnt_by", "registry",
+)
+DICTIONARY_COLUMNS = ("netname", "country", "descr", "mnt_by", "registry")
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The Arrow/Parquet export requires the pyarrow package: pip install pyarrow")
+    return pyarrow
+
+
+def export_schema(ip_version: int):
+    """
+    Arrow schema of the ip_data_v4/ip_data_v6 tables: the ranges as uint32 (IPv4)
+    or 16 bytes big endian fixed size binary (IPv6, sorting bytewise sorts the
+    addresses like the SQLite BLOBs), the repeated strings dictionary encoded.
+    """
+    pa = _require_pyarrow()
+    ip_type = pa.uint32() if ip_version == 4 else pa.binary(16)
+    strings = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("first_ip", pa.string()),
+            ("last_ip", pa.string()),
+            ("first_ip_int", ip_type),
+            ("last_ip_int", ip_type),
+            ("subnet", pa.uint8()),
+            ("network_prefix", pa.string()),
+            *((column, strings) for column in DICTIONARY_COLUMNS),
+        ],
+        metadata={"ip_version": str(ip_version)},
+    )
+
+
+class DictionaryColumn:
+    """
+    Dictionary of a string column kept for the whole file: every batch references
+    the same growing dictionary, so the Arrow file only stores the new strings of
+    each batch (dictionary deltas) and the readers get a single dictionary.
+    """
+
+    def __init__(self, pa):
+        self.pa = pa
+        self.ids = {}
+        self.dictionary = pa.array([], pa.string())
+        self._pending = []
+
+    def encode(self, values: Iterable[Optional[str]]):
+        # The batch is dictionary encoded by Arrow, only its distinct strings are mapped in Python
+        batch = self.pa.array(values, self.pa.string()).dictionary_encode()
+        ids = self.ids
+        pending = self._pending
+        mapping = []
+        for value in batch.dictionary.to_pylist():
+            index = ids.get(value)
+            if index is None:
+                index = ids[value] = len(ids)
+                pending.append(value)
+            mapping.append(index)
+        if pending:
+            self.dictionary = self.pa.concat_arrays([self.dictionary, self.pa.array(pending, self.pa.string())])
+            self._pending = []
+        indices = self.pa.array(mapping, self.pa.int32()).take(batch.indices)
+        return self.pa.DictionaryArray.from_arrays(indices, self.dictionary)
+
+
+class ArrowTableWriter:
+    """Writes the rows of one IP version in record batches of `batch_rows` rows to a Parquet or Arrow IPC file."""
+
+    def __init__(self, path: str, ip_version: int, file_format: str = "parquet", batch_rows: int = DEFAULT_BATCH_ROWS, compression: Optional[str] = None):
+        self.pa = _require_pyarrow()
+        self.path = path
+        self.batch_rows = batch_rows
+        self.schema = export_schema(ip_version)
+        self.rows_written = 0
+        self.batches_written = 0
+        self._rows = []
+        self._dictionaries = {column: DictionaryColumn(self.pa) for column in DICTIONARY_COLUMNS}
+        self._part_path = path + ".part"
+        if file_format == "parquet":
+            self._writer = self.pa.parquet.ParquetWriter(self._part_path, self.schema, compression=compression or "zstd")
+        elif file_format == "arrow":
+            # Uncompressed by default so the file can be memory mapped and read without copies
+            options = self.pa.ipc.IpcWriteOptions(compression=None if compression == "none" else compression, emit_dictionary_deltas=True)
+            self._writer = self.pa.ipc.new_file(self._part_path, self.schema, options=options)
+        else:
+            raise ValueError(f"Unknown export format {file_format}, expected one of {', '.join(FORMATS)}")
+
+    def add(self, row: tuple):
+        """Buffers a row ordered as EXPORT_COLUMNS, a batch is written every batch_rows rows."""
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_rows:
+            self.flush()
+
+    def add_many(self, rows: List[tuple]):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        pa = self.pa
+        columns = list(zip(*self._rows))
+        self._rows = []
+        arrays = []
+        for (name, field_type), values in zip(((field.name, field.type) for field in self.schema), columns):
+            if name in self._dictionaries:
+                arrays.append(self._dictionaries[name].encode(values))
+            else:
+                arrays.append(pa.array(values, field_type))
+        self._writer.write_batch(pa.record_batch(arrays, schema=self.schema))
+        self.rows_written += len(columns[0])
+        self.batches_written += 1
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        os.replace(self._part_path, self.path)
+
+    def abort(self):
+        self._writer.close()
+        if os.path.exists(self._part_path):
+            os.remove(self._part_path)
+
+
+class ArrowExportWriter:
+    """
+    Columnar export of the formatted blocks for analytics (pandas, DuckDB,
+    Polars...): the IPv4 and IPv6 rows are written to `ip_data_v4` and
+    `ip_data_v6` files of `output_dir`, in record batches of `batch_rows` rows so
+    the memory use is bounded by the batch size and the distinct strings.
+
+    `file_format` "parquet" writes zstd compressed Parquet files, "arrow" writes
+    uncompressed Arrow IPC (Feather v2) files that can be memory mapped and read
+    without copies, only the dictionary deltas of the batches are concatenated by
+    the reader. Like SQLiteBulkWriter it can be fed straight from the parser
+    callbacks with write_many.
+    """
+
+    def __init__(self, output_dir: str, file_format: str = "parquet", batch_rows: int = DEFAULT_BATCH_ROWS, compression: Optional[str] = None):
+        if file_format not in FORMATS:
+            raise ValueError(f"Unknown export format {file_format}, expected one of {', '.join(FORMATS)}")
+        os.makedirs(output_dir, exist_ok=True)
+        self.paths = {version: os.path.join(output_dir, f"ip_data_v{version}{FORMATS[file_format]}") for version in (4, 6)}
+        self.tables = {}
+        try:
+            for version, path in self.paths.items():
+                self.tables[version] = ArrowTableWriter(path, version, file_format, batch_rows, compression)
+        except BaseException:
+            self.abort()
+            raise
+
+    def write_row(self, row: tuple, row_id: Optional[int] = None, registry: Optional[str] = None):
+        """Writes a row ordered as IP_DATA_COLUMNS (first_ip_int/last_ip_int as stored by schema version 2)."""
+        first_ip, last_ip, first_ip_int, last_ip_int, ip_version, subnet, network_prefix, netname, country, descr, mnt_by = row
+        self.tables[ip_version].add(
+            (row_id, first_ip, last_ip, first_ip_int, last_ip_int, subnet, network_prefix, netname, country, descr, mnt_by, registry)
+        )
+
+    def write_many(self, blocks, registry: str = None):
+        """Writes the formatted `blocks` (Block or dict), `registry` fills the registry column."""
+        for block in blocks:
+            self.write_row(SQLiteHandler.block_to_row(block), registry=registry)
+
+    def close(self) -> Dict[str, int]:
+        """Writes the last batches and moves the files in place, returns the rows written per file."""
+        for table in self.tables.values():
+            table.close()
+        return {os.path.basename(table.path): table.rows_written for table in self.tables.values()}
+
+    def abort(self):
+        """Discards the partial files."""
+        for table in self.tables.values():
+            table.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def export_sqlite(
+    db_name: str,
+    output_dir: str,
+    file_format: str = "parquet",
+    batch_rows: int = DEFAULT_BATCH_ROWS,
+    block_filter: Optional[BlockFilter] = None,
+    compression: Optional[str] = None,
+) -> Dict[str, int]:
+    """
+    Exports the ip_data table of `db_name` with ArrowExportWriter, sorted by
+    first_ip_int so the Parquet row group statistics can skip the groups of a range
+    query. The registry of a row comes from the incremental import fingerprints when
+    present. `block_filter` leaves out the rows it excludes (see BlockFilter.export_where).
+    Returns the rows written per file.
+    """
+    conn = sqlite3.connect(db_name)
+    where = block_filter.export_where(conn) if block_filter is not None else None
+    has_fingerprints = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FINGERPRINTS_TABLE,)).fetchone() is not None
+    # Selected in the EXPORT_COLUMNS order, the rows go to the batches as they are
+    columns = ", ".join(f"d.{column}" for column in EXPORT_COLUMNS[:-1])
+    query = (
+        f"SELECT {columns}, {'f.registry' if has_fingerprints else 'NULL'} FROM ip_data d"
+        # Scanning the table and sorting is faster than following idx_ip_version row by row
+        + ("" if is_normalized(conn) else " NOT INDEXED")
+        + (f" LEFT JOIN {FINGERPRINTS_TABLE} f ON f.ip_data_id = d.id" if has_fingerprints else "")
+        + " WHERE d.ip_version = ?"
+        + (f" AND ({where})" if where else "")
+        + " ORDER BY d.first_ip_int"
+    )
+    writer = ArrowExportWriter(output_dir, file_format, batch_rows, compression)
+    try:
+        for version in (4, 6):
+            cursor = conn.execute(query, (version,))
+            while rows := cursor.fetchmany(batch_rows):
+                writer.tables[version].add_many(rows)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        conn.close()
+    return writer.close()
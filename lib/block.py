@@ -0,0 +1,54 @@
+from typing import Callable, NamedTuple, Optional
+
+
+class Block(NamedTuple):
+    """
+    A formatted IP block, as emitted by the parsers. The first fields are in the
+    order of the ip_data columns (lib.db.IP_DATA_COLUMNS) so the writer consumes
+    them positionally, and a tuple is several times smaller than the dict blocks
+    of the previous versions (see to_dict and dict_callback).
+    """
+
+    first_ip: str
+    last_ip: str
+    first_ip_int: int
+    last_ip_int: int
+    ip_version: int
+    subnet: Optional[int]
+    network_prefix: Optional[str]
+    netname: str
+    country: str
+    descr: str
+    mnt_by: str
+    nettype: str = "Unknown"
+
+    def to_dict(self) -> dict:
+        """The block in the dict format of the previous versions ("mnt-by" key, network_prefix only for IPv6)."""
+        block = {
+            "first_ip": self.first_ip,
+            "last_ip": self.last_ip,
+            "first_ip_int": self.first_ip_int,
+            "last_ip_int": self.last_ip_int,
+            "subnet": self.subnet,
+            "netname": self.netname,
+            "country": self.country,
+            "descr": self.descr,
+            "mnt-by": self.mnt_by,
+            "ip_version": self.ip_version,
+            "nettype": self.nettype,
+        }
+        if self.ip_version == 6:
+            block["network_prefix"] = self.network_prefix
+        return block
+
+
+def dict_callback(cb: Callable[[dict], None]) -> Callable[[Block], None]:
+    """
+    Adapts a callback written for the dict blocks of the previous versions:
+    RIPE_PARSER.parse_file(path, dict_callback(cb)) calls `cb` with block.to_dict().
+    """
+
+    def on_block(block: Block):
+        cb(block.to_dict())
+
+    return on_block
@@ -0,0 +1,280 @@
+import json
+import re
+import sqlite3
+from bisect import bisect_right
+from typing import List, Optional
+
+from lib.block import Block
+from lib.db import get_metadata, set_metadata
+from lib.ip_math import bits_of, parse_network, range_prefix_length
+
+# The blocks excluded from the import and from the MMDB export. Every rule has a
+# "name" (reported in the hit counts) and one matcher:
+# - "equals": exact values of `field`
+# - "contains" / "startswith": substrings / prefixes of `field`, ASCII case
+#   insensitive like the SQL LIKE they replace
+# - "ranges": CIDR networks, blocks entirely inside one of them are excluded
+# - "min_prefix": blocks with a shorter prefix (larger than a /min_prefix) are excluded
+DEFAULT_FILTER_RULES = [
+    {"name": "whole-address-space", "min_prefix": 1},
+    {"name": "erx-netblocks", "field": "netname", "equals": ["ERX-NETBLOCK", "SBCIS-SBIS-6BLK"]},
+    {"name": "iana-special-purpose", "field": "netname", "equals": [
+        "SPECIAL-IPV4-LOCAL-ID-IANA-RESERVED",
+        "IANA-THIS-HOST-ON-THIS-NETWORK",
+        "SHARED-ADDRESS-SPACE-RFC6598-IANA-RESERVED",
+        "SPECIAL-IPV4-BENCHMARK-TESTING-IANA-RESERVED",
+        "LINKLOCAL-RFC3927-IANA-RESERVED",
+        "PRIVATE-ADDRESS-CBLK-RFC1918-IANA-RESERVED",
+        "SPECIAL-IPV4-REGISTRY-IANA-RESERVED",
+        "6TO4-RELAY-ANYCAST-IANA-RESERVED",
+        "DS-LITE-RFC-6333-11-IANA-RESERVED",
+    ]},
+    {"name": "early-registrations", "field": "descr", "contains": ["Early registration addresses"]},
+    {"name": "further-assigned", "field": "descr", "contains": ["These addresses have been further assigned to users"]},
+    {"name": "not-registered", "field": "descr", "startswith": ["This IP address range is not registered in the"]},
+    {"name": "worldwide-country", "field": "country", "contains": ["Country is really world wide", "Worldwide"]},
+    {"name": "early-registrations-nettype", "field": "nettype", "contains": ["Early Registrations"]},
+    # The networks of ipaddress is_private, the MMDB export skips them anyway
+    {"name": "reserved-ranges", "ranges": [
+        "0.0.0.0/8", "10.0.0.0/8", "127.0.0.0/8", "169.254.0.0/16", "172.16.0.0/12", "192.0.0.0/29",
+        "192.0.0.170/31", "192.0.2.0/24", "192.168.0.0/16", "198.18.0.0/15", "198.51.100.0/24",
+        "203.0.113.0/24", "240.0.0.0/4", "255.255.255.255/32",
+        "::/128", "::1/128", "::ffff:0:0/96", "100::/64", "2001::/23", "2001:db8::/32", "fc00::/7", "fe80::/10",
+    ]},
+]
+
+STRING_MATCHERS = ("equals", "contains", "startswith")
+MATCHERS = STRING_MATCHERS + ("ranges", "min_prefix")
+# Block fields stored in ip_data, the rules on the others (nettype) only apply at parse time
+SQL_COLUMNS = ("netname", "country", "descr", "mnt_by")
+
+METADATA_KEY = "block_filter"
+# Values of a field whose result is remembered, the memo is emptied when it's full
+MEMO_SIZE = 65536
+
+_FIRST_IP_INT = Block._fields.index("first_ip_int")
+_LAST_IP_INT = Block._fields.index("last_ip_int")
+_IP_VERSION = Block._fields.index("ip_version")
+_SUBNET = Block._fields.index("subnet")
+
+
+def _pattern(matcher: str, values: List[str]) -> str:
+    alternatives = "|".join(re.escape(value) for value in values)
+    return f"^(?:{alternatives})" if matcher == "startswith" else f"(?:{alternatives})"
+
+
+def _compile(patterns: List[str]):
+    # re.ASCII makes IGNORECASE fold only A-Z like LIKE does
+    return re.compile("|".join(patterns), re.IGNORECASE | re.ASCII)
+
+
+def _sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _sql_like(value: str, prefix: str = "", suffix: str = "") -> str:
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{_sql_string(prefix + escaped + suffix)} ESCAPE '\\'"
+
+
+def _sql_int(value: int, ip_version: int) -> str:
+    return str(value) if ip_version == 4 else f"X'{value:032x}'"
+
+
+class BlockFilter:
+    """
+    Excludes blocks with declarative rules (see DEFAULT_FILTER_RULES), compiled
+    once: the "equals" values become sets, the "contains"/"startswith" values of a
+    field a single regex, the "ranges" sorted merged intervals searched with
+    bisect. Most blocks match nothing and only pay for these combined checks; an
+    excluded block is attributed to the first rule (in configuration order) that
+    matches it.
+    The compiled filter is picklable so the import workers can apply it while
+    parsing, and `sql_where` gives the same rules as a WHERE clause for the
+    databases imported without it.
+    """
+
+    def __init__(self, rules: List[dict]):
+        self.rules = [dict(rule) for rule in rules]
+        self.names = []
+        # Per rule: (kind, field index, matcher)
+        self._rules = []
+        # Per field index: (set of the "equals" values, regex of the substrings and prefixes)
+        field_values = {}
+        field_patterns = {}
+        self._ranges = {4: [], 6: []}
+        # -1: no min_prefix rule, every prefix passes
+        self._min_prefix = -1
+
+        for rule in self.rules:
+            name = rule.get("name")
+            kinds = [kind for kind in MATCHERS if kind in rule]
+            if not name or len(kinds) != 1:
+                raise ValueError(f"A rule needs a name and one of {', '.join(MATCHERS)}: {rule}")
+            kind = kinds[0]
+            self.names.append(name)
+            if kind in STRING_MATCHERS:
+                field = rule.get("field")
+                if field not in Block._fields:
+                    raise ValueError(f"Rule {name}: unknown field {field}, use one of {', '.join(Block._fields)}")
+                values = rule[kind]
+                if isinstance(values, str) or not values:
+                    raise ValueError(f"Rule {name}: {kind} needs a list of values")
+                index = Block._fields.index(field)
+                if kind == "equals":
+                    matcher = frozenset(values)
+                    field_values.setdefault(index, set()).update(values)
+                else:
+                    pattern = _pattern(kind, values)
+                    matcher = _compile([pattern])
+                    field_patterns.setdefault(index, []).append(pattern)
+                self._rules.append((kind, index, matcher))
+            elif kind == "ranges":
+                ranges = {4: [], 6: []}
+                for network in rule["ranges"]:
+                    ip_version = 6 if ":" in network else 4
+                    first, last, _ = parse_network(network, ip_version)
+                    ranges[ip_version].append((first, last))
+                    self._ranges[ip_version].append((first, last))
+                self._rules.append((kind, None, {version: _merge(values) for version, values in ranges.items()}))
+            else:
+                self._min_prefix = max(self._min_prefix, int(rule["min_prefix"]))
+                self._rules.append((kind, None, int(rule["min_prefix"])))
+
+        self._ranges = {version: _merge(values) for version, values in self._ranges.items()}
+        # Per field: (index, values, regex or None, memo of the results by value). Netnames,
+        # countries and nettypes repeat a lot, the memo skips most regex searches
+        self._checks = [
+            (index, frozenset(field_values.get(index, ())),
+             _compile(field_patterns[index]) if index in field_patterns else None, {})
+            for index in sorted(set(field_values) | set(field_patterns))
+        ]
+
+    @classmethod
+    def from_json(cls, path: str) -> "BlockFilter":
+        """Rules of a JSON file, a list of rules or {"rules": [...]}."""
+        with open(path, encoding="utf-8") as file:
+            rules = json.load(file)
+        return cls(rules["rules"] if isinstance(rules, dict) else rules)
+
+    def canonical(self) -> str:
+        """The rules as compact JSON, stored with the imported rows (see record)."""
+        return json.dumps(self.rules, sort_keys=True, separators=(",", ":"))
+
+    def __getstate__(self):
+        return self.rules
+
+    def __setstate__(self, rules):
+        self.__init__(rules)
+
+    def exclude(self, block: Block) -> Optional[str]:
+        """The name of the rule excluding `block`, None when it's kept."""
+        for index, values, pattern, memo in self._checks:
+            value = block[index]
+            matched = memo.get(value)
+            if matched is None:
+                matched = value in values or (pattern is not None and bool(value) and pattern.search(value) is not None)
+                if len(memo) >= MEMO_SIZE:
+                    memo.clear()
+                memo[value] = matched
+            if matched:
+                return self._first_match(block)
+        subnet = block[_SUBNET]
+        if (subnet is None or subnet < self._min_prefix) and self._prefix(block) < self._min_prefix:
+            return self._first_match(block)
+        starts, ends = self._ranges[block[_IP_VERSION]]
+        if starts:
+            position = bisect_right(starts, block[_FIRST_IP_INT]) - 1
+            if position >= 0 and block[_LAST_IP_INT] <= ends[position]:
+                return self._first_match(block)
+        return None
+
+    @staticmethod
+    def _prefix(block: Block) -> int:
+        subnet = block[_SUBNET]
+        if subnet is None:
+            subnet = range_prefix_length(block[_FIRST_IP_INT], block[_LAST_IP_INT], bits_of(block[_IP_VERSION]))
+        # An empty range has no prefix, it's excluded like a NULL subnet by the SQL
+        return -1 if subnet is None else subnet
+
+    def _first_match(self, block: Block) -> str:
+        for name, (kind, index, matcher) in zip(self.names, self._rules):
+            if kind == "equals":
+                if block[index] in matcher:
+                    return name
+            elif kind == "contains" or kind == "startswith":
+                if block[index] and matcher.search(block[index]):
+                    return name
+            elif kind == "ranges":
+                ranges = matcher.get(block[_IP_VERSION])
+                if ranges and _contains(ranges, block[_FIRST_IP_INT], block[_LAST_IP_INT]):
+                    return name
+            elif self._prefix(block) < matcher:
+                return name
+        raise AssertionError("The combined checks and the rules disagree")
+
+    def sql_where(self, ranges: bool = True) -> str:
+        """
+        The rules as a WHERE clause on ip_data, the rules on fields that aren't
+        stored are left out. `ranges` compares first_ip_int/last_ip_int, only valid
+        from schema version 2.
+        """
+        conditions = []
+        for rule, (kind, index, matcher) in zip(self.rules, self._rules):
+            if kind in STRING_MATCHERS:
+                column = Block._fields[index]
+                if column not in SQL_COLUMNS:
+                    continue
+                if kind == "equals":
+                    values = ", ".join(_sql_string(value) for value in rule["equals"])
+                    conditions.append(f"COALESCE({column}, '') NOT IN ({values})")
+                for value in rule.get("contains", ()):
+                    conditions.append(f"COALESCE({column}, '') NOT LIKE {_sql_like(value, '%', '%')}")
+                for value in rule.get("startswith", ()):
+                    conditions.append(f"COALESCE({column}, '') NOT LIKE {_sql_like(value, suffix='%')}")
+            elif kind == "ranges":
+                if not ranges:
+                    continue
+                for ip_version, (starts, ends) in matcher.items():
+                    for first, last in zip(starts, ends):
+                        conditions.append(
+                            f"NOT (ip_version = {ip_version} AND first_ip_int >= {_sql_int(first, ip_version)}"
+                            f" AND last_ip_int <= {_sql_int(last, ip_version)})"
+                        )
+            else:
+                conditions.append(f"subnet >= {matcher}")
+        return "\n        AND ".join(conditions) or "1"
+
+    def export_where(self, conn: sqlite3.Connection) -> Optional[str]:
+        """None when the rows of `conn` were imported with these rules (see record_block_filter), else the WHERE clause applying them."""
+        if get_metadata(conn, METADATA_KEY) == self.canonical():
+            return None
+        # Schema version 1 stores first_ip_int/last_ip_int as TEXT
+        return self.sql_where(ranges=conn.execute("PRAGMA user_version").fetchone()[0] >= 2)
+
+
+def record_block_filter(db_name: str, block_filter: Optional[BlockFilter]):
+    """Stores the rules applied to the rows of `db_name` by the import, None when it wasn't filtered."""
+    conn = sqlite3.connect(db_name)
+    set_metadata(conn, METADATA_KEY, block_filter.canonical() if block_filter is not None else None)
+    conn.commit()
+    conn.close()
+
+
+def _merge(intervals: list) -> tuple:
+    merged = []
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return ([first for first, _ in merged], [last for _, last in merged])
+
+
+def _contains(ranges: tuple, first: int, last: int) -> bool:
+    starts, ends = ranges
+    position = bisect_right(starts, first) - 1
+    return position >= 0 and last <= ends[position]
+
+
+DEFAULT_BLOCK_FILTER = BlockFilter(DEFAULT_FILTER_RULES)
@@ -1,12 +1,34 @@
-import ipaddress
+from lib.ip_math import IPV4_BITS, parse_ipv4, range_prefix_length
 
 
 def netmask_from_first_last_ip(first_ip, last_ip):
-    first_ip = ipaddress.IPv4Address(first_ip)
-    last_ip = ipaddress.IPv4Address(last_ip)
-    
-    num_hosts = int(last_ip) - int(first_ip)
-    num_bits = num_hosts.bit_length()
-
-    netmask_bits = 32 - num_bits
-    return netmask_bits
\ No newline at end of file
+    """Prefix length of an IPv4 range, or of the largest network of its CIDR cover (see lib.ip_math)."""
+    first = parse_ipv4(first_ip)
+    last = parse_ipv4(last_ip)
+    if first is None or last is None:
+        raise ValueError(f"Invalid IPv4 range {first_ip} - {last_ip}")
+    return range_prefix_length(first, last, IPV4_BITS)
+
+
+def ip_int_to_db(value, ip_version):
+    """
+    Converts an integer IP (or its legacy TEXT form) to the value stored in the
+    first_ip_int/last_ip_int columns: INTEGER for IPv4 and a 16 bytes big endian
+    BLOB for IPv6, so that ORDER BY sorts every address numerically
+    (SQLite sorts INTEGER before BLOB and BLOBs with memcmp).
+    """
+    if value is None:
+        return None
+    value = int(value)
+    if ip_version == 6:
+        return value.to_bytes(16, "big")
+    return value
+
+
+def ip_int_from_db(value):
+    """Inverse of ip_int_to_db, it also accepts the TEXT values of schema version 1."""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return int.from_bytes(value, "big")
+    return int(value)
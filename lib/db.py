@@ -1,73 +1,419 @@
 import os
 import sqlite3
 import ipaddress
+from hashlib import blake2b
 
-from lib.common import netmask_from_first_last_ip
+from lib.block import Block
+from lib.common import ip_int_to_db, netmask_from_first_last_ip
+from lib.ip_math import bits_of, range_prefix_length
 
-class SQLiteHandler:
-    def __init__(self, db_name):
-        self.db_name = db_name
+# Version 2: first_ip_int/last_ip_int are INTEGER (IPv4) or 16 bytes BLOB (IPv6) instead of TEXT
+SCHEMA_VERSION = 2
 
-    def create_table(self):
-        conn = sqlite3.connect(self.db_name)
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS ip_data
+CREATE_IP_DATA_TABLE_QUERY = '''CREATE TABLE IF NOT EXISTS ip_data
                     (id INTEGER PRIMARY KEY,
                     first_ip TEXT,
                     last_ip TEXT,
-                    first_ip_int TEXT,
-                    last_ip_int TEXT,
+                    first_ip_int INTEGER,
+                    last_ip_int INTEGER,
                     ip_version INTEGER,
                     subnet INTEGER,
                     network_prefix TEXT,
                     netname TEXT,
                     country TEXT,
                     descr TEXT,
-                    mnt_by TEXT)''')
-        c.execute('''CREATE INDEX IF NOT EXISTS idx_first_ip_int ON ip_data (first_ip_int)''')
-        c.execute('''CREATE INDEX IF NOT EXISTS idx_last_ip_int ON ip_data (last_ip_int)''')
-        c.execute('''CREATE INDEX IF NOT EXISTS idx_ip_version ON ip_data (ip_version)''')
-        c.execute('''CREATE INDEX IF NOT EXISTS idx_network_prefix ON ip_data (network_prefix)''')
+                    mnt_by TEXT)'''
+
+IP_DATA_COLUMNS = (
+    "first_ip", "last_ip", "first_ip_int", "last_ip_int", "ip_version", "subnet",
+    "network_prefix", "netname", "country", "descr", "mnt_by",
+)
+INSERT_IP_DATA_QUERY = f"INSERT INTO ip_data ({', '.join(IP_DATA_COLUMNS)}) VALUES ({', '.join('?' * len(IP_DATA_COLUMNS))})"
+INSERT_IP_DATA_WITH_ID_QUERY = f"INSERT INTO ip_data (id, {', '.join(IP_DATA_COLUMNS)}) VALUES ({', '.join('?' * (len(IP_DATA_COLUMNS) + 1))})"
+
+# Side table used by the incremental import (lib.incremental_import): the registry
+# (import task name) a row comes from and a hash of its normalized values
+FINGERPRINTS_TABLE = "ip_data_fingerprints"
+CREATE_FINGERPRINTS_TABLE_QUERY = f'''CREATE TABLE IF NOT EXISTS {FINGERPRINTS_TABLE}
+                    (ip_data_id INTEGER PRIMARY KEY,
+                    registry TEXT,
+                    fingerprint INTEGER)'''
+INSERT_FINGERPRINT_QUERY = f"INSERT OR REPLACE INTO {FINGERPRINTS_TABLE} (ip_data_id, registry, fingerprint) VALUES (?, ?, ?)"
+
+# Key/value metadata of the import (e.g. the rules of lib.block_filter applied
+# while parsing), read by the exporters including generate_mmdb.go
+METADATA_TABLE = "import_metadata"
+
+
+# Normalized schema (SQLiteHandler.create_table(normalized=True)): the ranges are
+# stored in ip_data_ranges with integer ids in a lookup table per string column,
+# ip_data is a view joining the strings back so readers don't change, and its
+# INSTEAD OF triggers intern the strings of the rows written through it
+IP_RANGES_TABLE = "ip_data_ranges"
+STRING_TABLES = {"netname": "netnames", "country": "countries", "descr": "descriptions", "mnt_by": "maintainers"}
+CREATE_IP_RANGES_TABLE_QUERY = f'''CREATE TABLE IF NOT EXISTS {IP_RANGES_TABLE}
+                    (id INTEGER PRIMARY KEY,
+                    first_ip TEXT,
+                    last_ip TEXT,
+                    first_ip_int INTEGER,
+                    last_ip_int INTEGER,
+                    ip_version INTEGER,
+                    subnet INTEGER,
+                    network_prefix TEXT,
+                    netname_id INTEGER,
+                    country_id INTEGER,
+                    descr_id INTEGER,
+                    mnt_by_id INTEGER)'''
+RANGE_COLUMNS = IP_DATA_COLUMNS[:7] + tuple(f"{column}_id" for column in STRING_TABLES)
+INSERT_IP_RANGE_QUERY = f"INSERT INTO {IP_RANGES_TABLE} ({', '.join(RANGE_COLUMNS)}) VALUES ({', '.join('?' * len(RANGE_COLUMNS))})"
+INSERT_IP_RANGE_WITH_ID_QUERY = f"INSERT INTO {IP_RANGES_TABLE} (id, {', '.join(RANGE_COLUMNS)}) VALUES ({', '.join('?' * (len(RANGE_COLUMNS) + 1))})"
+
+
+def _normalized_schema_queries() -> list:
+    queries = [
+        f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)"
+        for table in STRING_TABLES.values()
+    ]
+    queries.append(CREATE_IP_RANGES_TABLE_QUERY)
+
+    columns = ", ".join(f"r.{column}" for column in IP_DATA_COLUMNS[:7])
+    strings = ", ".join(f"{table}.value AS {column}" for column, table in STRING_TABLES.items())
+    joins = " ".join(f"LEFT JOIN {table} ON {table}.id = r.{column}_id" for column, table in STRING_TABLES.items())
+    queries.append(f"CREATE VIEW IF NOT EXISTS ip_data AS SELECT r.id, {columns}, {strings} FROM {IP_RANGES_TABLE} r {joins}")
+
+    intern = " ".join(
+        f"INSERT OR IGNORE INTO {table} (value) SELECT NEW.{column} WHERE NEW.{column} IS NOT NULL;"
+        for column, table in STRING_TABLES.items()
+    )
+    values = [f"NEW.{column}" for column in IP_DATA_COLUMNS[:7]]
+    values += [f"(SELECT id FROM {table} WHERE value = NEW.{column})" for column, table in STRING_TABLES.items()]
+    queries.append(
+        f"CREATE TRIGGER IF NOT EXISTS ip_data_insert INSTEAD OF INSERT ON ip_data BEGIN {intern} "
+        f"INSERT INTO {IP_RANGES_TABLE} (id, {', '.join(RANGE_COLUMNS)}) VALUES (NEW.id, {', '.join(values)}); END"
+    )
+    assignments = ", ".join(f"{column} = {value}" for column, value in zip(RANGE_COLUMNS, values))
+    queries.append(
+        f"CREATE TRIGGER IF NOT EXISTS ip_data_update INSTEAD OF UPDATE ON ip_data BEGIN {intern} "
+        f"UPDATE {IP_RANGES_TABLE} SET {assignments} WHERE id = OLD.id; END"
+    )
+    queries.append(
+        f"CREATE TRIGGER IF NOT EXISTS ip_data_delete INSTEAD OF DELETE ON ip_data "
+        f"BEGIN DELETE FROM {IP_RANGES_TABLE} WHERE id = OLD.id; END"
+    )
+    return queries
+
+
+def is_normalized(conn: sqlite3.Connection) -> bool:
+    """True when ip_data is the view of the normalized schema."""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = 'ip_data'").fetchone() is not None
+
+
+class StringInterner:
+    """
+    Ids of the strings of a lookup table (id, value) of the normalized schema. The
+    table is loaded once, then every distinct string is hashed in memory and only
+    inserted on its first occurrence.
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor, table: str):
+        self.cursor = cursor
+        self.table = table
+        self.ids = dict(cursor.execute(f"SELECT value, id FROM {table}"))
+        self._next_id = max(self.ids.values(), default=0) + 1
+        self._pending = []
+
+    def intern(self, value):
+        if value is None:
+            return None
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = self.ids[value] = self._next_id
+            self._next_id += 1
+            self._pending.append((string_id, value))
+        return string_id
+
+    def flush(self):
+        """Inserts the strings seen for the first time since the last flush."""
+        if self._pending:
+            self.cursor.executemany(f"INSERT INTO {self.table} (id, value) VALUES (?, ?)", self._pending)
+            self._pending = []
+
+
+# Block fields the ip_data row is derived from
+FINGERPRINT_FIELDS = (
+    "first_ip", "last_ip", "first_ip_int", "last_ip_int", "ip_version", "subnet",
+    "network_prefix", "netname", "country", "descr", "mnt-by",
+)
+
+
+def block_fingerprint(registry: str, block) -> int:
+    """64 bits signed hash (fits a SQLite INTEGER) of the registry and the normalized fields of a formatted block."""
+    if type(block) is Block:
+        # FINGERPRINT_FIELDS are the first fields of a Block, same tuple as for the dict blocks
+        values = block[:len(FINGERPRINT_FIELDS)]
+    else:
+        values = tuple(block.get(field) for field in FINGERPRINT_FIELDS)
+    digest = blake2b(f"{registry}\x1f{values!r}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def set_metadata(conn: sqlite3.Connection, key: str, value: str):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {METADATA_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute(f"INSERT OR REPLACE INTO {METADATA_TABLE} (key, value) VALUES (?, ?)", (key, value))
+
+
+def get_metadata(conn: sqlite3.Connection, key: str):
+    """The value stored by set_metadata, None when missing."""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (METADATA_TABLE,)).fetchone():
+        return None
+    row = conn.execute(f"SELECT value FROM {METADATA_TABLE} WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+class SQLiteHandler:
+    def __init__(self, db_name):
+        self.db_name = db_name
+
+    def create_table(self, normalized: bool = False):
+        """
+        Creates the ip_data table without indexes, call create_indexes once the
+        bulk load is done so the inserts don't pay for the B-tree maintenance.
+        With `normalized` the strings go to lookup tables and ip_data is a view
+        (see IP_RANGES_TABLE).
+        """
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        if normalized:
+            for query in _normalized_schema_queries():
+                c.execute(query)
+        else:
+            c.execute(CREATE_IP_DATA_TABLE_QUERY)
+        c.execute(CREATE_FINGERPRINTS_TABLE_QUERY)
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
         conn.close()
 
+    def has_fingerprints(self) -> bool:
+        """True when the rows were imported with their fingerprints (see SQLiteBulkWriter.write_many)."""
+        if not os.path.exists(self.db_name):
+            return False
+        conn = sqlite3.connect(self.db_name)
+        found = False
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FINGERPRINTS_TABLE,)).fetchone():
+            found = conn.execute(f"SELECT 1 FROM {FINGERPRINTS_TABLE} LIMIT 1").fetchone() is not None
+        conn.close()
+        return found
 
-    def insert_data(self, data):
+    def create_indexes(self):
         conn = sqlite3.connect(self.db_name)
         c = conn.cursor()
-        for entry in data:
-            first_ip_int = entry.get('first_ip_int')
-            last_ip_int = entry.get('last_ip_int')
-            subnet = entry.get('subnet')
-            
-            if entry.get('ip_version') == 4:
-               subnet = netmask_from_first_last_ip(entry['first_ip'], entry['last_ip'])
-               #print(subnet)
-            
-            
-            
-
-            query = '''INSERT INTO ip_data 
-                    (first_ip, last_ip, ip_version, network_prefix,
-                        netname, country, descr, mnt_by'''
-            values = [entry['first_ip'], entry['last_ip'], entry['ip_version'],
-                    entry.get('network_prefix', None), entry.get('netname', None),
-                    entry['country'], entry.get('descr', None), entry.get('mnt-by', None)]
-
-            if first_ip_int is not None:
-                query += ', first_ip_int'
-                values.append(str(first_ip_int))
-            if last_ip_int is not None:
-                query += ', last_ip_int'
-                values.append(str(last_ip_int))
-                
-            if subnet is not None:
-                query += ', subnet'
-                values.append(subnet)
-
-            query += ') VALUES (?' + ', ?' * (len(values) - 1) + ')'
-
-            c.execute(query, values)
+        table = IP_RANGES_TABLE if is_normalized(conn) else "ip_data"
+        c.execute(f'''CREATE INDEX IF NOT EXISTS idx_first_ip_int ON {table} (first_ip_int)''')
+        c.execute(f'''CREATE INDEX IF NOT EXISTS idx_last_ip_int ON {table} (last_ip_int)''')
+        c.execute(f'''CREATE INDEX IF NOT EXISTS idx_ip_version ON {table} (ip_version, first_ip_int)''')
+        c.execute(f'''CREATE INDEX IF NOT EXISTS idx_network_prefix ON {table} (network_prefix)''')
+        conn.commit()
+        conn.close()
+
+    def schema_version(self) -> int:
+        conn = sqlite3.connect(self.db_name)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        has_table = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'ip_data'").fetchone() is not None
+        conn.close()
+        # Files written before the schema was versioned have user_version 0
+        return version if version or not has_table else 1
 
+    def migrate(self):
+        """
+        Converts an existing database to SCHEMA_VERSION in place: the TEXT
+        first_ip_int/last_ip_int values are rewritten as INTEGER (IPv4) or 16 bytes
+        BLOB (IPv6) and the indexes are rebuilt after the copy.
+        """
+        if self.schema_version() >= SCHEMA_VERSION:
+            return
+        conn = sqlite3.connect(self.db_name)
+        conn.create_function("ip_int_to_db", 2, ip_int_to_db, deterministic=True)
+        c = conn.cursor()
+        c.execute("ALTER TABLE ip_data RENAME TO ip_data_v1")
+        for index in ("idx_first_ip_int", "idx_last_ip_int", "idx_ip_version", "idx_network_prefix"):
+            c.execute(f"DROP INDEX IF EXISTS {index}")
+        c.execute(CREATE_IP_DATA_TABLE_QUERY)
+        c.execute('''INSERT INTO ip_data
+                    (id, first_ip, last_ip, first_ip_int, last_ip_int, ip_version, subnet,
+                    network_prefix, netname, country, descr, mnt_by)
+                    SELECT id, first_ip, last_ip,
+                    ip_int_to_db(first_ip_int, ip_version), ip_int_to_db(last_ip_int, ip_version),
+                    ip_version, subnet, network_prefix, netname, country, descr, mnt_by
+                    FROM ip_data_v1 ORDER BY id''')
+        c.execute("DROP TABLE ip_data_v1")
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
         conn.commit()
+        conn.execute("VACUUM")
         conn.close()
+        self.create_indexes()
+
+    @staticmethod
+    def block_to_row(entry) -> tuple:
+        """Converts a formatted block (a Block, or a dict of the previous versions) in a row ordered as IP_DATA_COLUMNS."""
+        if type(entry) is Block:
+            first_ip, last_ip, first_ip_int, last_ip_int, ip_version, subnet, network_prefix, netname, country, descr, mnt_by, _ = entry
+            if subnet is None:
+                subnet = range_prefix_length(first_ip_int, last_ip_int, bits_of(ip_version))
+            return (
+                first_ip,
+                last_ip,
+                ip_int_to_db(first_ip_int, ip_version),
+                ip_int_to_db(last_ip_int, ip_version),
+                ip_version,
+                subnet,
+                network_prefix,
+                netname,
+                country,
+                descr,
+                mnt_by,
+            )
+
+        first_ip_int = entry.get('first_ip_int')
+        last_ip_int = entry.get('last_ip_int')
+        subnet = entry.get('subnet')
+
+        if subnet is None:
+            if first_ip_int is not None and last_ip_int is not None:
+                subnet = range_prefix_length(int(first_ip_int), int(last_ip_int), bits_of(entry['ip_version']))
+            elif entry.get('ip_version') == 4:
+                subnet = netmask_from_first_last_ip(entry['first_ip'], entry['last_ip'])
+
+        return (
+            entry['first_ip'],
+            entry['last_ip'],
+            ip_int_to_db(first_ip_int, entry['ip_version']),
+            ip_int_to_db(last_ip_int, entry['ip_version']),
+            entry['ip_version'],
+            subnet,
+            entry.get('network_prefix', None),
+            entry.get('netname', None),
+            entry['country'],
+            entry.get('descr', None),
+            entry.get('mnt-by', None),
+        )
+
+    def insert_data(self, data):
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        c.executemany(INSERT_IP_DATA_QUERY, [SQLiteHandler.block_to_row(entry) for entry in data])
+        conn.commit()
+        conn.close()
+
+    def bulk_writer(self, **options) -> "SQLiteBulkWriter":
+        """Opens a SQLiteBulkWriter on this database, see SQLiteBulkWriter for the options."""
+        return SQLiteBulkWriter(self.db_name, **options)
+
+
+class SQLiteBulkWriter:
+    """
+    Streaming writer for large imports: it keeps a single connection open, inserts
+    the blocks with executemany and commits every `commit_rows` rows or
+    `commit_bytes` bytes of text, whichever comes first.
+
+    The default pragmas trade durability for speed (no rollback journal, no fsync,
+    exclusive lock), a crash in the middle of an import leaves a corrupted file that
+    must be rebuilt from scratch. Use journal_mode="WAL" and synchronous="NORMAL"
+    to write into a database that is being read at the same time.
+
+    On a normalized database (create_table(normalized=True)) the strings are
+    interned with a StringInterner per lookup table and the rows are written to
+    ip_data_ranges directly instead of going through the triggers of the view.
+    """
+
+    def __init__(
+        self,
+        db_name: str,
+        journal_mode: str = "OFF",
+        synchronous: str = "OFF",
+        cache_size_mb: int = 512,
+        exclusive: bool = True,
+        commit_rows: int = 200000,
+        commit_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.db_name = db_name
+        self.commit_rows = commit_rows
+        self.commit_bytes = commit_bytes
+        self.rows_written = 0
+        self._next_id = None
+        self._pending_rows = 0
+        self._pending_bytes = 0
+
+        self.conn = sqlite3.connect(db_name)
+        self.conn.execute(f"PRAGMA journal_mode = {journal_mode}").fetchall()
+        self.conn.execute(f"PRAGMA synchronous = {synchronous}")
+        self.conn.execute(f"PRAGMA cache_size = {-cache_size_mb * 1024}")
+        if exclusive:
+            self.conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        self.cursor = self.conn.cursor()
+        self.interners = None
+        self._table = "ip_data"
+        if is_normalized(self.conn):
+            self.interners = [StringInterner(self.cursor, table) for table in STRING_TABLES.values()]
+            self._table = IP_RANGES_TABLE
+
+    def _normalize(self, rows: list) -> list:
+        """Replaces the strings of IP_DATA_COLUMNS rows with their ids, giving RANGE_COLUMNS rows."""
+        interns = [interner.intern for interner in self.interners]
+        rows = [row[:7] + tuple(intern(value) for intern, value in zip(interns, row[7:])) for row in rows]
+        for interner in self.interners:
+            interner.flush()
+        return rows
+
+    def write(self, block):
+        self.write_many((block,))
+
+    def write_many(self, blocks, registry: str = None):
+        """
+        Inserts the formatted `blocks`. When `registry` is given the rows are also
+        fingerprinted in the ip_data_fingerprints table, which the incremental import
+        diffs against on the next run.
+        """
+        # Read twice (rows and fingerprints), a generator would leave the fingerprints empty
+        blocks = list(blocks)
+        rows = [SQLiteHandler.block_to_row(block) for block in blocks]
+        # Counted before _normalize replaces the strings with their ids
+        text_bytes = sum(len(value) for row in rows for value in row if isinstance(value, str))
+        if self.interners is not None:
+            rows = self._normalize(rows)
+            insert_query, insert_with_id_query = INSERT_IP_RANGE_QUERY, INSERT_IP_RANGE_WITH_ID_QUERY
+        else:
+            insert_query, insert_with_id_query = INSERT_IP_DATA_QUERY, INSERT_IP_DATA_WITH_ID_QUERY
+        if registry is None:
+            self.cursor.executemany(insert_query, rows)
+            self._next_id = None
+        else:
+            if self._next_id is None:
+                self._next_id = self.cursor.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {self._table}").fetchone()[0]
+            first_id = self._next_id
+            self._next_id += len(rows)
+            self.cursor.executemany(insert_with_id_query, [(first_id + i, *row) for i, row in enumerate(rows)])
+            self.cursor.executemany(
+                INSERT_FINGERPRINT_QUERY,
+                [(first_id + i, registry, block_fingerprint(registry, block)) for i, block in enumerate(blocks)],
+            )
+        self.rows_written += len(rows)
+        self._pending_rows += len(rows)
+        self._pending_bytes += text_bytes
+        if self._pending_rows >= self.commit_rows or self._pending_bytes >= self.commit_bytes:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self._pending_rows = 0
+        self._pending_bytes = 0
+
+    def close(self):
+        self.commit()
+        self.cursor.close()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,274 @@
+import asyncio
+import email.utils
+import hashlib
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+import zlib
+from typing import Collection, Dict, List, NamedTuple, Optional, Tuple, Union
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TIMEOUT = 60
+CHUNK_SIZE = 1024 * 1024
+# Validators and checksums of the previous downloads by URL, kept in the destination folder
+STATE_FILE = ".download_state.json"
+USER_AGENT = "global-geo-ip-database-generator"
+
+
+class Source(NamedTuple):
+    """A file to download, `file_name` is its name in the destination folder."""
+
+    name: str
+    url: str
+    file_name: str
+
+
+REGISTRY_SOURCES = [
+    Source("RIPE", "https://ftp.ripe.net/ripe/dbase/split/ripe.db.inetnum.gz", "ripe.db.inetnum.gz"),
+    Source("RIPE IPv6", "https://ftp.ripe.net/ripe/dbase/split/ripe.db.inet6num.gz", "ripe.db.inet6num.gz"),
+    Source("APNIC", "https://ftp.apnic.net/apnic/whois/apnic.db.inetnum.gz", "apnic.db.inetnum.gz"),
+    Source("APNIC IPv6", "https://ftp.apnic.net/apnic/whois/apnic.db.inet6num.gz", "apnic.db.inet6num.gz"),
+    Source("AFRINIC", "https://ftp.afrinic.net/dbase/afrinic.db.gz", "afrinic.db.gz"),
+    Source("LACNIC", "https://ftp.lacnic.net/lacnic/dbase/lacnic.db.gz", "lacnic.db.gz"),
+    Source("ARIN", "https://ftp.arin.net/pub/rr/arin.db.gz", "arin.db.gz"),
+    Source("ARIN transfers", "https://ftp.arin.net/pub/stats/arin/transfers/transfers_latest.json", "transfers_latest.json"),
+]
+
+GEOLITE_SOURCES = [
+    Source("GeoLite2 ASN", "https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-ASN.mmdb", "GeoLite2-ASN.mmdb"),
+    Source("GeoLite2 Country", "https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-Country.mmdb", "GeoLite2-Country.mmdb"),
+    Source("GeoLite2 City", "https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-City.mmdb", "GeoLite2-City.mmdb"),
+]
+
+
+class DownloadResult(NamedTuple):
+    """
+    `status` is "downloaded", "not_modified" (the server answered 304),
+    "unchanged" (same checksum as the previous download, the file is kept) or
+    "failed". `path` is the file to read, the previous one when the download was
+    skipped or failed, None if there is none.
+    """
+
+    source: Source
+    path: Optional[str]
+    status: str
+    size: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def fresh(self) -> bool:
+        return self.status == "downloaded"
+
+
+class _GunzipStream:
+    """Decompresses a gzip stream (possibly made of several members) as the data arrives."""
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    def decompress(self, data: bytes) -> bytes:
+        output = []
+        while data:
+            output.append(self._decompressor.decompress(data))
+            data = self._decompressor.unused_data
+            if data:
+                self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        return b"".join(output)
+
+    def flush(self) -> bytes:
+        if not self._decompressor.eof:
+            raise ValueError("Truncated gzip stream")
+        return self._decompressor.flush()
+
+
+def _output_name(source: Source, decompress: bool) -> str:
+    if decompress and source.file_name.endswith(".gz"):
+        return source.file_name[:-3]
+    return source.file_name
+
+
+def _existing_path(source: Source, destination: str, previous: Optional[dict]) -> Optional[str]:
+    """The file of the previous download, or a compressed/decompressed variant left by an older run."""
+    names = [previous["file"]] if previous and previous.get("url") == source.url else []
+    names += [_output_name(source, False), _output_name(source, True)]
+    for name in names:
+        path = os.path.join(destination, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _gunzip_file(path: str, target: str):
+    """Decompresses the downloaded `path` to `target` and removes it, the file keeps its date."""
+    gunzip = _GunzipStream()
+    try:
+        with open(path, "rb") as source, open(target + ".part", "wb") as file:
+            while chunk := source.read(CHUNK_SIZE):
+                file.write(gunzip.decompress(chunk))
+            file.write(gunzip.flush())
+    except BaseException:
+        os.remove(target + ".part")
+        raise
+    os.replace(target + ".part", target)
+    status = os.stat(path)
+    os.utime(target, (status.st_atime, status.st_mtime))
+    os.remove(path)
+
+
+def _fetch(source: Source, destination: str, previous: Optional[dict], force: bool, decompress: bool, timeout: float) -> Tuple[DownloadResult, Optional[dict]]:
+    """Blocking conditional download of `source`, returns the result and the new state entry."""
+    start = time.perf_counter()
+    existing = _existing_path(source, destination, previous)
+    if previous and previous.get("url") != source.url:
+        previous = None
+    target = os.path.join(destination, _output_name(source, decompress))
+    # The validators are the ones of the URL: a file in the other form (compressed or not)
+    # is kept too, a .gz one is decompressed here when the decompressed file is requested
+    gunzip_existing = existing is not None and existing == target + ".gz"
+    conditional = existing is not None and not force
+    request = urllib.request.Request(source.url, headers={"User-Agent": USER_AGENT})
+    if conditional:
+        if previous and previous.get("etag"):
+            request.add_header("If-None-Match", previous["etag"])
+        last_modified = previous.get("last_modified") if previous else None
+        request.add_header("If-Modified-Since", last_modified or email.utils.formatdate(os.path.getmtime(existing), usegmt=True))
+
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as error:
+        if error.code == 304 and conditional:
+            if gunzip_existing:
+                _gunzip_file(existing, target)
+                existing = target
+            entry = dict(previous, file=os.path.basename(existing)) if previous else None
+            return DownloadResult(source, existing, "not_modified", 0, time.perf_counter() - start), entry
+        raise
+
+    part = target + ".part"
+    sha256 = hashlib.sha256()
+    size = 0
+    gunzip = _GunzipStream() if os.path.basename(target) != source.file_name else None
+    try:
+        with response, open(part, "wb") as file:
+            # The checksum is the one of the data sent by the server, the file may be decompressed
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                sha256.update(chunk)
+                file.write(gunzip.decompress(chunk) if gunzip else chunk)
+            if gunzip:
+                file.write(gunzip.flush())
+    except BaseException:
+        os.remove(part)
+        raise
+
+    entry = {
+        "url": source.url,
+        "file": os.path.basename(target),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": sha256.hexdigest(),
+        "size": size,
+    }
+    unchanged = conditional and previous is not None and previous.get("sha256") == entry["sha256"]
+    if unchanged and not gunzip_existing:
+        os.remove(part)
+        entry["file"] = os.path.basename(existing)
+        return DownloadResult(source, existing, "unchanged", size, time.perf_counter() - start), entry
+
+    os.replace(part, target)
+    if entry["last_modified"]:
+        # Like wget, the file gets the date of the server so If-Modified-Since works without the state file
+        try:
+            modified = email.utils.parsedate_to_datetime(entry["last_modified"]).timestamp()
+            os.utime(target, (modified, modified))
+        except (TypeError, ValueError):
+            pass
+    if existing and existing != target:
+        # The importer prefers the decompressed file, don't leave an outdated variant behind
+        os.remove(existing)
+    return DownloadResult(source, target, "unchanged" if unchanged else "downloaded", size, time.perf_counter() - start), entry
+
+
+def load_state(destination: str) -> Dict[str, dict]:
+    path = os.path.join(destination, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _save_state(destination: str, state: Dict[str, dict]):
+    path = os.path.join(destination, STATE_FILE)
+    with open(path + ".tmp", "w") as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+async def download_sources_async(
+    sources: List[Source],
+    destination: str,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    force: bool = False,
+    decompress: Union[bool, Collection[str]] = False,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> List[DownloadResult]:
+    """
+    Downloads the `sources` in `destination`, at most `concurrency` at a time.
+    Files downloaded before are requested with If-None-Match/If-Modified-Since
+    and kept when the server answers 304 or sends the same data (sha256) again,
+    unless `force`. With `decompress` the .gz files are decompressed while they
+    are received, it can also be the `file_name`s of the sources to decompress
+    (e.g. only the dump split in shards by the importer). Switching between the
+    two forms doesn't download the file again: a kept .gz file is decompressed
+    locally, a decompressed one is kept as it is. The results are in the order of `sources`.
+    """
+    os.makedirs(destination, exist_ok=True)
+    state = load_state(destination)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def download(source: Source) -> DownloadResult:
+        async with semaphore:
+            print(f"Downloading {source.name} from {source.url}")
+            start = time.perf_counter()
+            # Keyed by URL, older state files used the file name
+            previous = state.get(source.url)
+            if previous is None and state.get(source.file_name, {}).get("url") == source.url:
+                previous = state.pop(source.file_name)
+            try:
+                # urllib is blocking, every transfer runs in a thread of the default executor
+                gunzip = decompress if isinstance(decompress, bool) else source.file_name in decompress
+                result, entry = await asyncio.to_thread(_fetch, source, destination, previous, force, gunzip, timeout)
+            except Exception as error:
+                result = DownloadResult(
+                    source, _existing_path(source, destination, previous), "failed", 0, time.perf_counter() - start, str(error)
+                )
+                entry = previous
+            if entry is not None:
+                state[source.url] = entry
+            print(describe(result))
+            return result
+
+    try:
+        return list(await asyncio.gather(*(download(source) for source in sources)))
+    finally:
+        _save_state(destination, state)
+
+
+def download_sources(sources: List[Source], destination: str, **kwargs) -> List[DownloadResult]:
+    """Blocking wrapper of download_sources_async."""
+    return asyncio.run(download_sources_async(sources, destination, **kwargs))
+
+
+def describe(result: DownloadResult) -> str:
+    if result.status == "failed":
+        return f"{result.source.name}: failed ({result.error}), using {result.path or 'nothing'}"
+    if result.status == "downloaded":
+        rate = result.size / (1024 * 1024) / result.seconds if result.seconds > 0 else 0
+        return f"{result.source.name}: downloaded {result.size / (1024 * 1024):.1f} MB in {result.seconds:.1f}s ({rate:.1f} MB/s) to {result.path}"
+    return f"{result.source.name}: {result.status.replace('_', ' ')}, keeping {result.path}"
@@ -0,0 +1,113 @@
+import bz2
+import gzip
+import io
+import os
+import queue
+import threading
+
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".zst")
+DEFAULT_READ_AHEAD = 8 * 1024 * 1024
+
+
+def is_compressed(file_path: str) -> bool:
+    return file_path.endswith(COMPRESSED_SUFFIXES)
+
+
+def resolve_dump_path(file_path: str) -> str:
+    """
+    Returns `file_path` if it exists, otherwise its first compressed variant
+    (`.gz`, `.bz2`, `.zst`) found on disk, otherwise `file_path` unchanged.
+    """
+    if os.path.exists(file_path):
+        return file_path
+    for suffix in COMPRESSED_SUFFIXES:
+        if os.path.exists(file_path + suffix):
+            return file_path + suffix
+    return file_path
+
+
+def _open_decompressor(file_path: str):
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    if file_path.endswith(".bz2"):
+        return bz2.open(file_path, "rb")
+    if file_path.endswith(".zst"):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading {file_path} requires the zstandard package: pip install zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, "rb"), closefd=True)
+    return open(file_path, "rb")
+
+
+class ThreadedReader(io.RawIOBase):
+    """
+    Reads `source` in a background thread and hands the data over through a
+    bounded queue, so decompression (zlib/bz2/zstd release the GIL) overlaps with
+    the parsing done by the consumer.
+    """
+
+    def __init__(self, source, chunk_size: int = DEFAULT_READ_AHEAD, max_chunks: int = 4):
+        self.source = source
+        self.chunk_size = chunk_size
+        self._chunks = queue.Queue(maxsize=max_chunks)
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name="dump-reader", daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            while not self._closing.is_set():
+                chunk = self.source.read(self.chunk_size)
+                self._chunks.put(chunk)
+                if not chunk:
+                    return
+        except Exception as error:
+            self._chunks.put(error)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            if self._eof:
+                return 0
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self._eof = True
+                return 0
+            self._buffer = memoryview(chunk)
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._closing.set()
+            # Unblock the producer if it is waiting on a full queue
+            while self._thread.is_alive():
+                try:
+                    self._chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.source.close()
+        super().close()
+
+
+def open_dump(file_path: str, threaded: bool = True) -> io.BufferedReader:
+    """
+    Opens a registry dump for binary reading, `.gz`, `.bz2` and `.zst` files are
+    decompressed on the fly (in a background thread when `threaded`).
+    Plain files are returned as regular seekable files.
+    """
+    if not is_compressed(file_path):
+        return open(file_path, "rb")
+    source = _open_decompressor(file_path)
+    if not threaded:
+        return source
+    return io.BufferedReader(ThreadedReader(source), buffer_size=DEFAULT_READ_AHEAD)
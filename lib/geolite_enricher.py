@@ -0,0 +1,114 @@
+import os
+from typing import Callable, Dict, Optional, Tuple
+
+# Projected record fragments are tuples of (key, value) items in MMDB record order
+Fragment = Tuple[Tuple[str, object], ...]
+
+
+def project_asn(asn_record: Optional[dict]) -> Fragment:
+    items = []
+    if asn_record:
+        if "autonomous_system_number" in asn_record:
+            items.append(("asn_number", asn_record["autonomous_system_number"]))
+        if "autonomous_system_organization" in asn_record:
+            items.append(("asn_name", asn_record["autonomous_system_organization"]))
+    return tuple(items)
+
+
+def project_city(city_record: Optional[dict]) -> Fragment:
+    items = []
+    if city_record:
+        if "city" in city_record and "names" in city_record["city"] and "en" in city_record["city"]["names"]:
+            items.append(("city_name", city_record["city"]["names"]["en"]))
+        if "country" in city_record:
+            if "names" in city_record["country"] and "en" in city_record["country"]["names"]:
+                items.append(("country_name", city_record["country"]["names"]["en"]))
+            if "iso_code" in city_record["country"]:
+                items.append(("iso_code", city_record["country"]["iso_code"]))
+    return tuple(items)
+
+
+class NetworkCache:
+    """
+    Caches the projected fragment of a maxminddb reader per MaxMind network:
+    `get_with_prefix_len` tells which network an address belongs to, every other
+    address of that network is answered without reading the database again.
+    The last network is checked first, sorted input mostly hits it.
+    Fragments are interned so identical data is a single shared tuple.
+    """
+
+    def __init__(self, reader, project: Callable[[Optional[dict]], Fragment], max_networks: int = 1_000_000):
+        self.reader = reader
+        self.project = project
+        self.max_networks = max_networks
+        self.networks: Dict[Tuple[int, int, int], Fragment] = {}
+        self.fragments: Dict[Fragment, Fragment] = {}
+        self.hits = 0
+        self.misses = 0
+        # Prefix lengths of the cached networks per IP version, longest first
+        self._prefix_lens = {4: [], 6: []}
+        # (version, first, last, fragment) of the last network
+        self._last = (0, 1, 0, ())
+
+    def get(self, ip) -> Fragment:
+        version = ip.version
+        value = int(ip)
+        last_version, first, last, fragment = self._last
+        if version == last_version and first <= value <= last:
+            self.hits += 1
+            return fragment
+
+        host_bits = 32 if version == 4 else 128
+        fragment = None
+        for prefix_len in self._prefix_lens[version]:
+            network = value >> (host_bits - prefix_len) << (host_bits - prefix_len)
+            fragment = self.networks.get((version, network, prefix_len))
+            if fragment is not None:
+                break
+
+        if fragment is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            record, prefix_len = self.reader.get_with_prefix_len(ip)
+            fragment = self.project(record)
+            fragment = self.fragments.setdefault(fragment, fragment)
+            network = value >> (host_bits - prefix_len) << (host_bits - prefix_len)
+            if len(self.networks) >= self.max_networks:
+                self.networks.clear()
+            self.networks[(version, network, prefix_len)] = fragment
+            if prefix_len not in self._prefix_lens[version]:
+                self._prefix_lens[version] = sorted(self._prefix_lens[version] + [prefix_len], reverse=True)
+
+        self._last = (version, network, network + (1 << (host_bits - prefix_len)) - 1, fragment)
+        return fragment
+
+
+class GeoLiteEnricher:
+    """
+    GeoLite2 ASN and City enrichment for the MMDB build, backed by one
+    NetworkCache per database. `stats()` reports the cache hit rates.
+    """
+
+    def __init__(self, asn_db, city_db, max_networks: int = 1_000_000):
+        self.asn = NetworkCache(asn_db, project_asn, max_networks)
+        self.city = NetworkCache(city_db, project_city, max_networks)
+
+    def lookup(self, ip) -> Tuple[Fragment, Fragment]:
+        """Returns the (asn, city) fragments of an ipaddress address."""
+        return self.asn.get(ip), self.city.get(ip)
+
+    def stats(self) -> dict:
+        """Hit rates of both caches, "pid" tells the stats of different worker processes apart."""
+        stats = {"pid": os.getpid()}
+        for name, cache in (("asn", self.asn), ("city", self.city)):
+            lookups = cache.hits + cache.misses
+            stats[name] = {
+                "lookups": lookups,
+                "hits": cache.hits,
+                "reader_calls": cache.misses,
+                "hit_rate": cache.hits / lookups if lookups else 0.0,
+                "networks": len(cache.networks),
+                "fragments": len(cache.fragments),
+            }
+        return stats
@@ -0,0 +1,115 @@
+import sqlite3
+from typing import Dict, List, Tuple
+
+from lib.db import (
+    FINGERPRINTS_TABLE,
+    INSERT_FINGERPRINT_QUERY,
+    INSERT_IP_DATA_WITH_ID_QUERY,
+    IP_DATA_COLUMNS,
+    SQLiteHandler,
+    block_fingerprint,
+)
+
+UPDATE_IP_DATA_QUERY = f"UPDATE ip_data SET {', '.join(f'{column} = ?' for column in IP_DATA_COLUMNS)} WHERE id = ?"
+
+
+class IncrementalImporter:
+    """
+    Applies a new version of the registry dumps to a database imported with
+    fingerprints (SQLiteBulkWriter.write_many with a registry).
+
+    The fingerprints of the current rows are loaded in memory, every new block
+    whose fingerprint (registry + normalized fields) is already known is unchanged
+    and is neither converted nor written. On `apply` the remaining new blocks are
+    matched with the remaining old rows on (registry, ip_version, first_ip_int,
+    last_ip_int): matches are UPDATEs that keep the row id, the other new blocks
+    are INSERTs and the other old rows are DELETEs. Duplicated keys are diffed as
+    multisets.
+    """
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.conn = sqlite3.connect(db_name)
+        self.unchanged = 0
+        # fingerprint -> id, or list of ids for the (rare) identical rows
+        self._known: Dict[int, object] = {}
+        self._new_rows: List[Tuple[str, int, tuple]] = []
+        for ip_data_id, fingerprint in self.conn.execute(f"SELECT ip_data_id, fingerprint FROM {FINGERPRINTS_TABLE}"):
+            known = self._known.get(fingerprint)
+            if known is None:
+                self._known[fingerprint] = ip_data_id
+            elif isinstance(known, list):
+                known.append(ip_data_id)
+            else:
+                self._known[fingerprint] = [known, ip_data_id]
+
+    def add_blocks(self, registry: str, blocks):
+        """Diffs formatted blocks of `registry` (the import task name) against the stored fingerprints."""
+        known = self._known
+        for block in blocks:
+            fingerprint = block_fingerprint(registry, block)
+            ids = known.get(fingerprint)
+            if ids is None:
+                self._new_rows.append((registry, fingerprint, SQLiteHandler.block_to_row(block)))
+            elif isinstance(ids, list):
+                ids.pop()
+                if not ids:
+                    del known[fingerprint]
+                self.unchanged += 1
+            else:
+                del known[fingerprint]
+                self.unchanged += 1
+
+    def _removed_rows_by_key(self) -> Dict[tuple, List[int]]:
+        removed_ids = []
+        for ids in self._known.values():
+            if isinstance(ids, list):
+                removed_ids.extend(ids)
+            else:
+                removed_ids.append(ids)
+
+        removed = {}
+        for start in range(0, len(removed_ids), 500):
+            chunk = removed_ids[start:start + 500]
+            cursor = self.conn.execute(
+                f'''SELECT d.id, f.registry, d.ip_version, d.first_ip_int, d.last_ip_int
+                   FROM ip_data d JOIN {FINGERPRINTS_TABLE} f ON f.ip_data_id = d.id
+                   WHERE d.id IN ({', '.join('?' * len(chunk))})''',
+                chunk,
+            )
+            for ip_data_id, *key in cursor:
+                removed.setdefault(tuple(key), []).append(ip_data_id)
+        return removed
+
+    def apply(self) -> dict:
+        """Writes the changes in a single transaction and returns the added/changed/removed/unchanged counts."""
+        removed = self._removed_rows_by_key()
+        inserts = []
+        updates = []
+        for registry, fingerprint, row in self._new_rows:
+            ids = removed.get((registry, row[4], row[2], row[3]))
+            if ids:
+                updates.append((ids.pop(), registry, fingerprint, row))
+            else:
+                inserts.append((registry, fingerprint, row))
+        deletes = [(ip_data_id,) for ids in removed.values() for ip_data_id in ids]
+
+        c = self.conn.cursor()
+        c.executemany("DELETE FROM ip_data WHERE id = ?", deletes)
+        c.executemany(f"DELETE FROM {FINGERPRINTS_TABLE} WHERE ip_data_id = ?", deletes)
+        c.executemany(UPDATE_IP_DATA_QUERY, [(*row, ip_data_id) for ip_data_id, _, _, row in updates])
+        c.executemany(INSERT_FINGERPRINT_QUERY, [(ip_data_id, registry, fingerprint) for ip_data_id, registry, fingerprint, _ in updates])
+        next_id = c.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM ip_data").fetchone()[0]
+        c.executemany(INSERT_IP_DATA_WITH_ID_QUERY, [(next_id + i, *row) for i, (_, _, row) in enumerate(inserts)])
+        c.executemany(
+            INSERT_FINGERPRINT_QUERY,
+            [(next_id + i, registry, fingerprint) for i, (registry, fingerprint, _) in enumerate(inserts)],
+        )
+        self.conn.commit()
+
+        self._known = {}
+        self._new_rows = []
+        return {"added": len(inserts), "changed": len(updates), "removed": len(deletes), "unchanged": self.unchanged}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,192 @@
+import cProfile
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional
+
+
+class PipelineStats:
+    """
+    Lightweight counters and cumulative stage timers for the import and MMDB
+    pipelines.
+
+    Timers are exclusive: when stages are nested (the parser calling back into
+    the filter and the insert) the time of the inner stage is only counted in the
+    inner stage, so the timers add up to the time spent in timed code.
+    Stage names can be qualified with ":" (e.g. "parse:ripe-inetnum").
+
+    Worker processes keep their own instance and send `snapshot()` to the main
+    process, which adds it with `merge`. `progress()` prints a rate line at most
+    every `report_interval` seconds (never when it's 0), `summary()` is the JSON
+    serializable result. The stages in `profile_stages` (full or unqualified name)
+    are run under cProfile, `dump_profiles` writes one .prof file per stage;
+    profiling only covers the process owning the instance.
+    """
+
+    def __init__(
+        self,
+        report_interval: float = 0,
+        profile_stages: Iterable[str] = (),
+        log: Callable[[str], None] = print,
+    ):
+        self.counters: Dict[str, int] = {}
+        self.timers: Dict[str, float] = {}
+        self.report_interval = report_interval
+        self.profile_stages = set(profile_stages)
+        self.log = log
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._last_counters: Dict[str, int] = {}
+        # [stage, start, time of the nested stages]
+        self._stack = []
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._profiling = None
+
+    def add(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, stage: str):
+        profile = self._start_profile(stage)
+        frame = [stage, time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - frame[1]
+            self._stack.pop()
+            self.timers[stage] = self.timers.get(stage, 0.0) + elapsed - frame[2]
+            if self._stack:
+                self._stack[-1][2] += elapsed
+            if profile is not None:
+                profile.disable()
+                self._profiling = None
+
+    def _start_profile(self, stage: str) -> Optional[cProfile.Profile]:
+        # A single profiler can be active at a time, nested profiled stages stay in the outer profile
+        if self._profiling is not None or not (
+            stage in self.profile_stages or stage.split(":", 1)[0] in self.profile_stages
+        ):
+            return None
+        profile = self._profiles.setdefault(stage, cProfile.Profile())
+        profile.enable()
+        self._profiling = stage
+        return profile
+
+    def snapshot(self) -> dict:
+        return {"counters": dict(self.counters), "timers": dict(self.timers)}
+
+    def merge(self, snapshot: dict):
+        """Adds the counters and timers of another instance's snapshot (e.g. of a worker process)."""
+        for name, value in snapshot["counters"].items():
+            self.add(name, value)
+        for stage, value in snapshot["timers"].items():
+            self.timers[stage] = self.timers.get(stage, 0.0) + value
+
+    def progress(self, force: bool = False):
+        """Logs the counters with their rate since the previous line, every `report_interval` seconds."""
+        if not self.report_interval and not force:
+            return
+        now = time.monotonic()
+        interval = now - self._last_report
+        if not force and interval < self.report_interval:
+            return
+        parts = []
+        for name, value in sorted(self.counters.items()):
+            if ":" in name:
+                continue
+            rate = (value - self._last_counters.get(name, 0)) / interval if interval > 0 else 0.0
+            parts.append(f"{name}={value} ({rate:.0f}/s)")
+        self.log(f"[{now - self.started:.1f}s] {' '.join(parts)}")
+        self._last_report = now
+        self._last_counters = dict(self.counters)
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "elapsed": round(elapsed, 3),
+            "counters": dict(sorted(self.counters.items())),
+            "timers": {stage: round(value, 3) for stage, value in sorted(self.timers.items())},
+            "rates": {
+                name: round(value / elapsed, 1) if elapsed > 0 else 0.0
+                for name, value in sorted(self.counters.items())
+                if ":" not in name
+            },
+        }
+
+    def write_summary(self, path: str):
+        """Writes the summary as JSON to `path`, - for stdout."""
+        data = json.dumps(self.summary(), indent=2)
+        if path == "-":
+            print(data)
+            return
+        with open(path, "w") as file:
+            file.write(data + "\n")
+
+    def dump_profiles(self, directory: str) -> list:
+        """Writes the cProfile stats of every profiled stage to `directory`/<stage>.prof, returns the paths."""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for stage, profile in self._profiles.items():
+            path = os.path.join(directory, stage.replace(":", "_").replace("/", "_") + ".prof")
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+
+class LatencyHistogram:
+    """
+    Request latencies counted in fixed buckets (upper bounds in seconds, roughly
+    log spaced), so recording is a bisect and an increment whatever the traffic.
+    Quantiles are the upper bound of the bucket holding them (the max for the
+    last, unbounded bucket).
+    """
+
+    BUCKETS = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+        0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    )
+
+    def __init__(self, buckets: Iterable[float] = BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for position, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return self.bounds[position] if position < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self) -> dict:
+        """JSON serializable counts, "buckets" are cumulative like the Prometheus "le" buckets."""
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.bounds + (None,), self.counts):
+            cumulative += count
+            buckets["+Inf" if bound is None else f"{bound:g}"] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "max": round(self.max, 6),
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": buckets,
+        }
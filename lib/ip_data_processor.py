@@ -1,23 +1,48 @@
 import os
-from typing import Callable
-from lib.ripe_parser import RIPE_PARSER
+from typing import Callable, List, Optional
 
-def explore_folder(folder_path, cb:Callable[[dict],None]):
-    
-    chunk_groups = sorted(os.listdir(folder_path))
-    for dir_name in chunk_groups:
-        sub_folder_path = os.path.join(folder_path, dir_name)
-        if os.path.isdir(sub_folder_path):
-            for root, dirs, files in os.walk(sub_folder_path):
-                for file in sorted(files):
-                    if file.endswith(".db"):
-                        file_path = os.path.join(root, file)
-                        print(f"Processing file {file_path}")
-                        
+from lib.block import Block
+from lib.block_filter import BlockFilter
+from lib.instrumentation import PipelineStats
+from lib.parallel_importer import ImportTask, run_import_tasks, shard_tasks
+from lib.shard_splitter import DEFAULT_SHARD_SIZE, split_file
 
-                        
-                        RIPE_PARSER.parse_file(file_path,cb)
-                        
 
+def list_dump_files(path: str) -> List[str]:
+    """`path` itself when it is a file, otherwise the ".db" files below it in sorted order."""
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith(".db"))
+    return files
 
-        
+
+def explore_folder(
+    folder_path,
+    cb: Callable[[Block], None],
+    workers: int = 1,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    stats: Optional[PipelineStats] = None,
+    block_filter: Optional[BlockFilter] = None,
+):
+    """
+    Parses the RPSL dumps of `folder_path` (a dump file, or a folder walked for
+    ".db" files like the old db/chunks) and calls `cb` with every formatted block.
+    Every file is split in shards of about `shard_size` bytes on object boundaries
+    (lib.shard_splitter, nothing is copied) and the shards are parsed by `workers`
+    processes. `cb` is always called from the calling process; with several
+    workers the blocks of different shards are interleaved. The blocks excluded
+    by `block_filter` are dropped by the workers.
+    """
+    tasks: List[ImportTask] = []
+    for file_path in list_dump_files(folder_path):
+        print(f"Processing file {file_path}")
+        tasks.extend(shard_tasks(os.path.basename(file_path), file_path, split_file(file_path, shard_size=shard_size)))
+
+    def on_blocks(task: ImportTask, blocks: List[Block]):
+        for block in blocks:
+            cb(block)
+
+    run_import_tasks(tasks, on_blocks, workers=workers, stats=stats, block_filter=block_filter)
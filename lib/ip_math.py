@@ -0,0 +1,171 @@
+import ipaddress
+import re
+from typing import List, Optional, Tuple
+
+IPV4_BITS = 32
+IPV6_BITS = 128
+
+_IPV6_EXPLODED = re.compile(r"[0-9A-Fa-f]{4}(?::[0-9A-Fa-f]{4}){7}\Z")
+_IPV6_CHARACTERS = re.compile(r"[0-9A-Fa-f:]+\Z")
+
+
+def bits_of(ip_version: int) -> int:
+    return IPV6_BITS if ip_version == 6 else IPV4_BITS
+
+
+def parse_ipv4(address: str, short: bool = False) -> Optional[int]:
+    """
+    Integer value of a dotted IPv4 address, None if invalid. Octets may be zero
+    padded ("012.000.001.000"). With `short` the abbreviated RIPE form is accepted,
+    the missing trailing octets are zero ("5.183.80" is 5.183.80.0).
+    """
+    parts = address.split(".")
+    if len(parts) != 4 and not (short and 0 < len(parts) < 4):
+        return None
+    value = 0
+    for part in parts:
+        if not part.isdigit() or len(part) > 3 or not part.isascii():
+            return None
+        octet = int(part)
+        if octet > 255:
+            return None
+        value = (value << 8) | octet
+    return value << (8 * (4 - len(parts)))
+
+
+def format_ipv4(value: int) -> str:
+    return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+def parse_ipv6(address: str) -> Optional[int]:
+    """Integer value of an IPv6 address (compressed or not, with an optional trailing dotted IPv4), None if invalid."""
+    if _IPV6_EXPLODED.match(address):
+        return int(address.replace(":", ""), 16)
+    if not _IPV6_CHARACTERS.match(address):
+        # Only the last group may be a dotted IPv4 address
+        head, colon, ipv4_text = address.rpartition(":")
+        ipv4 = parse_ipv4(ipv4_text) if colon else None
+        if ipv4 is None or not _IPV6_CHARACTERS.match(head + colon):
+            return None
+        address = f"{head}:{ipv4 >> 16:x}:{ipv4 & 0xFFFF:x}"
+    head, double_colon, tail = address.partition("::")
+    if double_colon:
+        if "::" in tail:
+            return None
+        head_parts = head.split(":") if head else []
+        tail_parts = tail.split(":") if tail else []
+        missing = 8 - len(head_parts) - len(tail_parts)
+        if missing < 1:
+            return None
+    else:
+        head_parts = head.split(":")
+        tail_parts = []
+        if len(head_parts) != 8:
+            return None
+        missing = 0
+    value = 0
+    for hextet in head_parts:
+        if not hextet or len(hextet) > 4:
+            return None
+        value = (value << 16) | int(hextet, 16)
+    value <<= 16 * missing
+    for hextet in tail_parts:
+        if not hextet or len(hextet) > 4:
+            return None
+        value = (value << 16) | int(hextet, 16)
+    return value
+
+
+def format_ipv6_exploded(value: int) -> str:
+    digits = f"{value:032x}"
+    return ":".join(digits[i:i + 4] for i in range(0, 32, 4))
+
+
+def format_ipv6(value: int) -> str:
+    """Compressed form, the same text as str(ipaddress.IPv6Address(value))."""
+    if value >> 32 == 0xFFFF:
+        # IPv4 mapped addresses are written differently by the Python versions
+        return str(ipaddress.IPv6Address(value))
+    hextets = [f"{(value >> shift) & 0xFFFF:x}" for shift in range(112, -1, -16)]
+    best_start, best_length = -1, 0
+    start = -1
+    for index, hextet in enumerate(hextets + ["end"]):
+        if hextet == "0":
+            if start < 0:
+                start = index
+        elif start >= 0:
+            if index - start > best_length:
+                best_start, best_length = start, index - start
+            start = -1
+    if best_length > 1:
+        hextets[best_start:best_start + best_length] = [""]
+        if best_start == 0:
+            hextets.insert(0, "")
+        if best_start + best_length == 8:
+            hextets.append("")
+    return ":".join(hextets)
+
+
+def parse_address(address: str) -> Optional[Tuple[int, int]]:
+    """(ip_version, value) of an IPv4 or IPv6 address, None if invalid."""
+    if ":" in address:
+        value = parse_ipv6(address)
+        return None if value is None else (6, value)
+    value = parse_ipv4(address)
+    return None if value is None else (4, value)
+
+
+def parse_network(network: str, ip_version: int) -> Tuple[int, int, int]:
+    """
+    (first, last, prefix_len) of a "address/prefix_len" network, IPv4 addresses
+    may be abbreviated ("5.183.80/22"). Host bits are cleared like
+    ipaddress.ip_network(strict=False) does. Raises ValueError if invalid.
+    """
+    address, _, prefix = network.partition("/")
+    bits = bits_of(ip_version)
+    value = parse_ipv6(address) if ip_version == 6 else parse_ipv4(address, short=True)
+    if value is None or not prefix.isdigit() or int(prefix) > bits:
+        raise ValueError(f"Invalid IPv{ip_version} network {network!r}")
+    prefix_len = int(prefix)
+    host_mask = (1 << (bits - prefix_len)) - 1
+    first = value & ~host_mask
+    return first, first | host_mask, prefix_len
+
+
+def prefix_length(first: int, last: int, bits: int) -> Optional[int]:
+    """Prefix length of the range when it is exactly one network, None otherwise."""
+    size = last - first + 1
+    if size <= 0 or size & (size - 1) or first & (size - 1):
+        return None
+    return bits + 1 - size.bit_length()
+
+
+def cidr_cover(first: int, last: int, bits: int) -> List[Tuple[int, int]]:
+    """
+    The smallest list of (network, prefix_len) that covers exactly first..last,
+    in address order (like ipaddress.summarize_address_range).
+    """
+    networks = []
+    while first <= last:
+        # The largest block aligned on `first` that doesn't go past `last`
+        size = 1 << ((last - first + 1).bit_length() - 1)
+        if first:
+            size = min(size, first & -first)
+        networks.append((first, bits + 1 - size.bit_length()))
+        first += size
+    return networks
+
+
+def range_prefix_length(first: int, last: int, bits: int) -> Optional[int]:
+    """
+    The `subnet` of a range: its prefix length when it is one network, otherwise
+    the one of the first network of its CIDR cover, so "first_ip/subnet" is always
+    a network of the range. None for an empty range.
+    """
+    if first > last:
+        return None
+    # The first network of cidr_cover: the largest block aligned on `first` that doesn't go past `last`
+    size = 1 << ((last - first + 1).bit_length() - 1)
+    if first:
+        size = min(size, first & -first)
+    return bits + 1 - size.bit_length()
@@ -0,0 +1,102 @@
+import io
+import json
+import re
+from typing import Iterator
+
+from lib.dump_io import open_dump
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARACTERS = re.compile(r"[0-9eE.+-]*")
+
+
+class _Buffer:
+    """Text read from `file` in chunks, the consumed prefix is dropped as the position moves."""
+
+    def __init__(self, file, chunk_size: int):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.text = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Reads one more chunk, False at the end of the file."""
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        if self.position > self.chunk_size:
+            self.text = self.text[self.position:]
+            self.position = 0
+        self.text += chunk
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            self.position = _WHITESPACE.match(self.text, self.position).end()
+            if self.position < len(self.text) or not self.fill():
+                return
+
+    def expect(self, characters: str) -> str:
+        self.skip_whitespace()
+        if self.position >= len(self.text) or self.text[self.position] not in characters:
+            found = self.text[self.position:self.position + 20] or "end of file"
+            raise ValueError(f"Expected one of {characters!r} at {found!r}")
+        self.position += 1
+        return self.text[self.position - 1]
+
+    def decode(self, decoder: json.JSONDecoder):
+        """Decodes the next JSON value, reading more chunks until it's complete."""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.position)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number is only complete once a character that can't continue it
+            # was read ("1" of "1.5" decodes on its own), other values end with
+            # a delimiter or a keyword
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if _NUMBER_CHARACTERS.match(self.text, end).end() == len(self.text) and self.fill():
+                    continue
+            self.position = end
+            return value
+
+
+def iter_json_array(file_path: str, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator:
+    """
+    Yields the elements of the array `key` of the top level JSON object of
+    `file_path` one at a time: only the current element is held in memory, along
+    with a buffer of about `chunk_size` characters. The other top level values are
+    decoded and ignored. Compressed files are read with lib.dump_io.open_dump.
+    """
+    decoder = json.JSONDecoder()
+    with io.TextIOWrapper(open_dump(file_path), encoding="utf-8") as file:
+        buffer = _Buffer(file, chunk_size)
+        buffer.expect("{")
+        buffer.skip_whitespace()
+        if buffer.text.startswith("}", buffer.position):
+            return
+        while True:
+            name = buffer.decode(decoder)
+            buffer.expect(":")
+            if name != key:
+                buffer.decode(decoder)
+            else:
+                buffer.expect("[")
+                buffer.skip_whitespace()
+                if buffer.text.startswith("]", buffer.position):
+                    buffer.position += 1
+                else:
+                    while True:
+                        yield buffer.decode(decoder)
+                        if buffer.expect(",]") == "]":
+                            break
+            if buffer.expect(",}") == "}":
+                return
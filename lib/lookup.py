@@ -0,0 +1,252 @@
+import os
+import socket
+import sqlite3
+from array import array
+from bisect import bisect_right
+from typing import Optional
+
+import numpy as np
+
+from lib.common import ip_int_from_db
+from lib.range_flattener import FLAT_TABLE, most_specific_intervals
+
+_inet_pton = socket.inet_pton
+_AF_INET = socket.AF_INET
+_AF_INET6 = socket.AF_INET6
+
+RECORD_FIELDS = ("id", "first_ip", "last_ip", "ip_version", "subnet", "netname", "country", "descr", "mnt_by")
+STRING_FIELDS = ("netname", "country", "descr", "mnt_by")
+
+
+class IPLookup:
+    """
+    In-memory lookup over the ranges of the ip_data table.
+
+    The ranges are flattened once at load time in non-overlapping intervals that
+    point to their most specific (smallest) enclosing range, so every lookup is a
+    single binary search. IPv4 bounds are uint32 arrays, IPv6 bounds are 16 bytes
+    big endian keys (numpy "S16", compared like memcmp).
+    """
+
+    def __init__(self, records: list, v4_intervals: list, v6_intervals: list):
+        self.records = records
+
+        self.v4_starts = array("I", (first for first, _, _ in v4_intervals))
+        self.v4_ends = array("I", (last for _, last, _ in v4_intervals))
+        self.v4_records = array("i", (record for _, _, record in v4_intervals))
+
+        self.v6_starts = np.array([first.to_bytes(16, "big") for first, _, _ in v6_intervals], dtype="S16")
+        self.v6_ends = np.array([last.to_bytes(16, "big") for _, last, _ in v6_intervals], dtype="S16")
+        self.v6_records = np.array([record for _, _, record in v6_intervals], dtype=np.int32)
+
+        # Zero copy numpy views used by lookup_many
+        self._v4_starts_np = np.frombuffer(self.v4_starts, dtype=np.uint32)
+        self._v4_ends_np = np.frombuffer(self.v4_ends, dtype=np.uint32)
+        self._v4_records_np = np.frombuffer(self.v4_records, dtype=np.int32)
+        self._string_columns = None
+
+    @classmethod
+    def from_sqlite(cls, db_name: str, flat_table: bool = False) -> "IPLookup":
+        """
+        Loads the ranges of `db_name`. With `flat_table` the intervals precomputed by
+        the flattening stage (lib.range_flattener.build_flat_table) are loaded as they
+        are instead of flattening every ip_data row at startup; they only cover the
+        rows selected when the table was built and adjacent intervals with the same
+        attributes point to the first of their owners.
+        """
+        # sqlite3.connect would create an empty database instead of failing
+        if not os.path.isfile(db_name):
+            raise FileNotFoundError(f"No database at {db_name}")
+        conn = sqlite3.connect(db_name)
+        if flat_table:
+            ip_lookup = cls._from_flat_table(conn)
+            conn.close()
+            return ip_lookup
+
+        cursor = conn.execute(
+            '''SELECT id, first_ip, last_ip, ip_version, subnet, netname, country, descr, mnt_by,
+               first_ip_int, last_ip_int FROM ip_data ORDER BY id'''
+        )
+        records = []
+        v4_ranges = []
+        v6_ranges = []
+        for row in cursor:
+            first_ip_int = ip_int_from_db(row[9])
+            last_ip_int = ip_int_from_db(row[10])
+            if first_ip_int is None or last_ip_int is None:
+                continue
+            if row[3] == 6:
+                v6_ranges.append((first_ip_int, last_ip_int, len(records)))
+            else:
+                v4_ranges.append((first_ip_int, last_ip_int, len(records)))
+            records.append(row[:9])
+        conn.close()
+        return cls(records, most_specific_intervals(v4_ranges), most_specific_intervals(v6_ranges))
+
+    @classmethod
+    def _from_flat_table(cls, conn: sqlite3.Connection) -> "IPLookup":
+        records = []
+        record_indexes = {}
+        intervals = {4: [], 6: []}
+        cursor = conn.execute(
+            f'''SELECT d.id, d.first_ip, d.last_ip, d.ip_version, d.subnet, d.netname, d.country, d.descr, d.mnt_by,
+               f.first_ip_int, f.last_ip_int, f.ip_version FROM {FLAT_TABLE} f JOIN ip_data d ON d.id = f.ip_data_id
+               ORDER BY f.ip_version, f.first_ip_int'''
+        )
+        for row in cursor:
+            record_index = record_indexes.get(row[0])
+            if record_index is None:
+                record_index = record_indexes[row[0]] = len(records)
+                records.append(row[:9])
+            intervals[row[11]].append((ip_int_from_db(row[9]), ip_int_from_db(row[10]), record_index))
+        return cls(records, intervals[4], intervals[6])
+
+    def lookup_index(self, ip: str) -> int:
+        """Returns the index in self.records of the most specific range containing `ip`, or -1."""
+        if ":" not in ip:
+            try:
+                value = int.from_bytes(_inet_pton(_AF_INET, ip), "big")
+            except OSError:
+                raise ValueError(f"Invalid IP address: {ip}")
+            position = bisect_right(self.v4_starts, value) - 1
+            if position >= 0 and self.v4_ends[position] >= value:
+                return self.v4_records[position]
+            return -1
+
+        try:
+            key = _inet_pton(_AF_INET6, ip)
+        except OSError:
+            raise ValueError(f"Invalid IP address: {ip}")
+        position = int(np.searchsorted(self.v6_starts, key, side="right")) - 1
+        # numpy drops the trailing NUL bytes of S16 items, pad the end back before comparing
+        if position >= 0 and self.v6_ends[position].ljust(16, b"\x00") >= key:
+            return int(self.v6_records[position])
+        return -1
+
+    def lookup(self, ip: str) -> Optional[dict]:
+        """
+        Returns the ip_data row (as a dict with RECORD_FIELDS keys) of the most
+        specific range containing `ip`, None if no range contains it.
+        """
+        index = self.lookup_index(ip)
+        if index < 0:
+            return None
+        return dict(zip(RECORD_FIELDS, self.records[index]))
+
+    def string_columns(self):
+        """
+        Dictionary encoded view of the records: returns (columns, strings) where
+        columns[field][record_index] is the index in `strings` of that field value.
+        Built on first use and shared by every batch result.
+        """
+        if self._string_columns is None:
+            strings = []
+            string_ids = {}
+            columns = {}
+            for field in STRING_FIELDS:
+                position = RECORD_FIELDS.index(field)
+                codes = np.empty(len(self.records), dtype=np.int32)
+                for index, record in enumerate(self.records):
+                    value = record[position] or ""
+                    code = string_ids.get(value)
+                    if code is None:
+                        code = string_ids[value] = len(strings)
+                        strings.append(value)
+                    codes[index] = code
+                columns[field] = codes
+            # The extra last entries make index -1 (not found) decode to "" and id -1
+            decode_table = np.array(strings + [""], dtype=object)
+            ids = np.array([record[0] for record in self.records] + [-1], dtype=np.int64)
+            self._string_columns = (columns, strings, decode_table, ids)
+        return self._string_columns[:2]
+
+    def _resolve(self, values, starts, ends, records):
+        if len(starts) == 0:
+            return np.full(len(values), -1, dtype=np.int32)
+        positions = np.searchsorted(starts, values, side="right") - 1
+        clipped = np.clip(positions, 0, None)
+        hit = (positions >= 0) & (ends[clipped] >= values)
+        return np.where(hit, records[clipped], -1).astype(np.int32)
+
+    def lookup_many(self, ips) -> "BatchLookupResult":
+        """
+        Resolves many addresses in one vectorized pass.
+
+        `ips` can be an iterable of IPv4/IPv6 strings, a numpy integer array of IPv4
+        addresses or a numpy "S16" array of packed IPv6 addresses. Invalid addresses
+        (including integers outside 0..2**32-1) and addresses outside every range
+        resolve to record index -1.
+        """
+        if isinstance(ips, np.ndarray) and ips.dtype.kind in "ui":
+            invalid = None
+            if ips.dtype.kind == "i" or ips.dtype.itemsize > 4:
+                # astype would wrap the negative and the larger values around to valid addresses
+                invalid = (ips < 0) | (ips > 0xFFFFFFFF)
+                if invalid.any():
+                    ips = np.where(invalid, 0, ips)
+                else:
+                    invalid = None
+            indexes = self._resolve(ips.astype(np.uint32), self._v4_starts_np, self._v4_ends_np, self._v4_records_np)
+            if invalid is not None:
+                indexes[invalid] = -1
+            return BatchLookupResult(self, indexes)
+        if isinstance(ips, np.ndarray) and ips.dtype.kind == "S":
+            indexes = self._resolve(ips.astype("S16"), self.v6_starts, self.v6_ends, self.v6_records)
+            return BatchLookupResult(self, indexes)
+
+        v4_positions = []
+        v4_packed = []
+        v6_positions = []
+        v6_packed = []
+        count = 0
+        for position, ip in enumerate(ips):
+            count += 1
+            try:
+                if ":" in ip:
+                    v6_packed.append(_inet_pton(_AF_INET6, ip))
+                    v6_positions.append(position)
+                else:
+                    v4_packed.append(_inet_pton(_AF_INET, ip))
+                    v4_positions.append(position)
+            except (OSError, TypeError):
+                continue
+
+        indexes = np.full(count, -1, dtype=np.int32)
+        if v4_positions:
+            values = np.frombuffer(b"".join(v4_packed), dtype=">u4").astype(np.uint32)
+            indexes[v4_positions] = self._resolve(values, self._v4_starts_np, self._v4_ends_np, self._v4_records_np)
+        if v6_positions:
+            keys = np.frombuffer(b"".join(v6_packed), dtype="S16")
+            indexes[v6_positions] = self._resolve(keys, self.v6_starts, self.v6_ends, self.v6_records)
+        return BatchLookupResult(self, indexes)
+
+
+class BatchLookupResult:
+    """
+    Columnar result of IPLookup.lookup_many: `record_indexes` holds one record
+    index per input address (-1 when not found), string fields are returned as
+    codes into the shared `strings` table.
+    """
+
+    def __init__(self, ip_lookup: IPLookup, record_indexes: np.ndarray):
+        self.record_indexes = record_indexes
+        self._columns, self.strings = ip_lookup.string_columns()
+        _, _, self._decode_table, self._ids = ip_lookup._string_columns
+
+    def __len__(self):
+        return len(self.record_indexes)
+
+    def codes(self, field: str) -> np.ndarray:
+        """Index in `strings` of `field` for every address, -1 when not found."""
+        column = self._columns[field]
+        if len(column) == 0:
+            return np.full(len(self.record_indexes), -1, dtype=np.int32)
+        return np.where(self.record_indexes >= 0, column[self.record_indexes], -1)
+
+    def values(self, field: str) -> np.ndarray:
+        """Object array with the decoded `field` values, "" when not found."""
+        return self._decode_table[self.codes(field)]
+
+    def ids(self) -> np.ndarray:
+        """ip_data.id of every address, -1 when not found."""
+        return self._ids[self.record_indexes]
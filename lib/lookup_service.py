@@ -0,0 +1,349 @@
+import asyncio
+import json
+import os
+import signal
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import unquote
+
+from lib.instrumentation import LatencyHistogram
+from lib.lookup import RECORD_FIELDS, IPLookup
+
+DEFAULT_CACHE_SIZE = 100_000
+DEFAULT_MAX_BATCH = 10_000
+DEFAULT_MAX_BODY = 8 * 1024 * 1024
+MAX_HEADERS = 100
+
+_MISSING = object()
+_REASONS = {
+    100: "Continue", 200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    411: "Length Required", 413: "Payload Too Large", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used key, `maxsize` 0 disables it."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if not self.maxsize:
+            return
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def summary(self) -> dict:
+        return {"size": len(self.data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, close: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.close = close
+
+
+class LookupService:
+    """
+    Answers IP lookups over HTTP from an IPLookup loaded once in memory:
+
+    - GET /ip/{addr}: the record of the most specific range containing addr
+      (RECORD_FIELDS keys), 404 when no range contains it, 400 if it's invalid.
+    - POST /lookup: a JSON list of addresses (or {"ips": [...]}) gives
+      {"results": [...]} with a record or null for every address, in order.
+    - GET /health and GET /metrics: the loaded database, the cache counters and
+      a latency histogram per route.
+
+    Results are kept in a LRU cache of `cache_size` addresses. `reload()` loads
+    the database again in a thread while the requests are still answered from the
+    current one, then swaps the lookup and a new empty cache in a single step:
+    every request is answered by one generation, connections are never closed.
+    `watch()` reloads when the file is replaced and SIGHUP reloads on demand.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        flat_table: bool = False,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_body: int = DEFAULT_MAX_BODY,
+    ):
+        self.db_path = db_path
+        self.flat_table = flat_table
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self.max_body = max_body
+        # (lookup, cache), replaced as a whole by reload
+        self.state = None
+        self.generation = 0
+        self.loaded_at = None
+        self.load_seconds = None
+        self.reload_errors = 0
+        self.last_error = None
+        self.requests = {}
+        self.latency = {}
+        # Signature of the last file loaded or tried, a broken file isn't tried again until it changes
+        self._signature = None
+        self._reload_lock = asyncio.Lock()
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.db_path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _load_lookup(self) -> IPLookup:
+        # sqlite3.connect would create an empty database
+        if not os.path.isfile(self.db_path):
+            raise FileNotFoundError(f"No database at {self.db_path}")
+        ip_lookup = IPLookup.from_sqlite(self.db_path, flat_table=self.flat_table)
+        # Built here rather than by the first batch request
+        ip_lookup.string_columns()
+        return ip_lookup
+
+    def load(self):
+        """Loads the database synchronously, used at startup before serving."""
+        signature = self._file_signature()
+        start = time.monotonic()
+        ip_lookup = self._load_lookup()
+        self._swap(ip_lookup, signature, time.monotonic() - start)
+
+    async def reload(self) -> bool:
+        """Loads the database again without blocking the requests, False (and the current data kept) on failure."""
+        async with self._reload_lock:
+            signature = self._file_signature()
+            start = time.monotonic()
+            try:
+                ip_lookup = await asyncio.to_thread(self._load_lookup)
+            except Exception as error:
+                self._signature = signature
+                self.reload_errors += 1
+                self.last_error = f"{type(error).__name__}: {error}"
+                print(f"Reload of {self.db_path} failed, still serving generation {self.generation}: {self.last_error}")
+                return False
+            self._swap(ip_lookup, signature, time.monotonic() - start)
+            print(f"Reloaded {self.db_path}: {len(ip_lookup.records)} ranges in {self.load_seconds:.2f}s, generation {self.generation}")
+            return True
+
+    def _swap(self, ip_lookup: IPLookup, signature, seconds: float):
+        self.state = (ip_lookup, LRUCache(self.cache_size))
+        self._signature = signature
+        self.generation += 1
+        self.loaded_at = time.time()
+        self.load_seconds = seconds
+
+    async def watch(self, interval: float):
+        """Reloads when the database file changes, once it stayed the same for `interval` seconds."""
+        previous = self._file_signature()
+        while True:
+            await asyncio.sleep(interval)
+            signature = self._file_signature()
+            if signature is not None and signature == previous and signature != self._signature:
+                await self.reload()
+            previous = signature
+
+    def lookup(self, ip: str) -> Optional[dict]:
+        ip_lookup, cache = self.state
+        record = cache.get(ip)
+        if record is _MISSING:
+            record = ip_lookup.lookup(ip)
+            cache.put(ip, record)
+        return record
+
+    def lookup_batch(self, ips: list) -> list:
+        """Records (or None) of `ips`, the cache misses are resolved with a single IPLookup.lookup_many."""
+        ip_lookup, cache = self.state
+        results = [cache.get(ip) for ip in ips]
+        missing = [position for position, record in enumerate(results) if record is _MISSING]
+        if missing:
+            indexes = ip_lookup.lookup_many([ips[position] for position in missing]).record_indexes
+            for position, index in zip(missing, indexes.tolist()):
+                record = dict(zip(RECORD_FIELDS, ip_lookup.records[index])) if index >= 0 else None
+                results[position] = record
+                cache.put(ips[position], record)
+        return results
+
+    def metrics(self) -> dict:
+        ip_lookup, cache = self.state
+        return {
+            "db_path": self.db_path,
+            "generation": self.generation,
+            "loaded_at": self.loaded_at,
+            "load_seconds": round(self.load_seconds, 3),
+            "ranges": len(ip_lookup.records),
+            "reload_errors": self.reload_errors,
+            "last_error": self.last_error,
+            "cache": cache.summary(),
+            "requests": dict(sorted(self.requests.items())),
+            "latency": {route: histogram.summary() for route, histogram in sorted(self.latency.items())},
+        }
+
+    def handle(self, method: str, target: str, body: bytes):
+        """Returns (route, status, payload) for a request."""
+        path = target.split("?", 1)[0]
+        if path.startswith("/ip/"):
+            if method != "GET":
+                raise HTTPError(405, "Use GET")
+            ip = unquote(path[4:])
+            try:
+                record = self.lookup(ip)
+            except ValueError:
+                return "GET /ip", 400, {"ip": ip, "error": "invalid address"}
+            if record is None:
+                return "GET /ip", 404, {"ip": ip, "error": "not found"}
+            return "GET /ip", 200, record
+        if path == "/lookup":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            try:
+                ips = json.loads(body)
+            except ValueError:
+                raise HTTPError(400, "The body is not valid JSON")
+            if isinstance(ips, dict):
+                ips = ips.get("ips")
+            if not isinstance(ips, list) or not all(isinstance(ip, str) for ip in ips):
+                raise HTTPError(400, 'Send a list of addresses or {"ips": [...]}')
+            if len(ips) > self.max_batch:
+                raise HTTPError(413, f"At most {self.max_batch} addresses per request")
+            return "POST /lookup", 200, {"results": self.lookup_batch(ips)}
+        if path == "/health" and method == "GET":
+            return "GET /health", 200, {"status": "ok", "generation": self.generation, "ranges": len(self.state[0].records)}
+        if path == "/metrics" and method == "GET":
+            return "GET /metrics", 200, self.metrics()
+        raise HTTPError(404, "Unknown path")
+
+    async def _read_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "Malformed request line", close=True)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n"):
+                break
+            if not line or len(headers) >= MAX_HEADERS:
+                raise HTTPError(431 if line else 400, "Malformed headers", close=True)
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        if "transfer-encoding" in headers:
+            raise HTTPError(411, "Send the body with a Content-Length", close=True)
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length", close=True)
+        if length > self.max_body:
+            raise HTTPError(413, f"The body is larger than {self.max_body} bytes", close=True)
+        if length and headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+        body = await reader.readexactly(length) if length else b""
+        return method, target, body, keep_alive
+
+    @staticmethod
+    def _write_response(writer: asyncio.StreamWriter, status: int, payload, keep_alive: bool):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+        )
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                keep_alive = False
+                route = "other"
+                start = None
+                try:
+                    request = await self._read_request(reader, writer)
+                    if request is None:
+                        break
+                    start = time.perf_counter()
+                    method, target, body, keep_alive = request
+                    try:
+                        route, status, payload = self.handle(method, target, body)
+                    except HTTPError:
+                        raise
+                    except Exception as error:
+                        print(f"Error answering {method} {target}: {type(error).__name__}: {error}")
+                        status, payload = 500, {"error": "internal error"}
+                except HTTPError as error:
+                    keep_alive = keep_alive and not error.close
+                    status, payload = error.status, {"error": str(error)}
+                except (ValueError, asyncio.LimitOverrunError):
+                    # Lines longer than the StreamReader limit
+                    status, payload = 431, {"error": "Request line or header too long"}
+                if start is None:
+                    start = time.perf_counter()
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                self.requests[route] = self.requests.get(route, 0) + 1
+                histogram = self.latency.get(route)
+                if histogram is None:
+                    histogram = self.latency[route] = LatencyHistogram()
+                histogram.observe(time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> asyncio.AbstractServer:
+        """Loads the database if needed and starts listening, returns the asyncio server."""
+        if self.state is None:
+            await asyncio.to_thread(self.load)
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8080, watch_interval: float = 0):
+        server = await self.start(host, port)
+        print(f"Serving {len(self.state[0].records)} ranges of {self.db_path} on {', '.join(str(s.getsockname()[:2]) for s in server.sockets)}")
+        loop = asyncio.get_running_loop()
+        tasks = set()
+
+        def start_task(coroutine):
+            task = loop.create_task(coroutine)
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        try:
+            loop.add_signal_handler(signal.SIGHUP, lambda: start_task(self.reload()))
+        except (NotImplementedError, AttributeError):
+            # No SIGHUP on Windows
+            pass
+        if watch_interval:
+            start_task(self.watch(watch_interval))
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,379 @@
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from hashlib import blake2b
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+
+METADATA_MAGIC = b"\xab\xcd\xefMaxMind.com"
+
+# Data section type ids (MaxMind DB format 2.0)
+_UTF8_STRING = 2
+_DOUBLE = 3
+_BYTES = 4
+_UINT16 = 5
+_UINT32 = 6
+_MAP = 7
+_INT32 = 8
+_UINT64 = 9
+_UINT128 = 10
+_ARRAY = 11
+_BOOLEAN = 14
+
+# Search tree values before the node ids are known: node ids are >= 0
+_EMPTY = -1
+
+
+def _data_value(offset: int) -> int:
+    return -2 - offset
+
+
+class DataSection:
+    """
+    Data section of an MMDB file, spooled to a temporary file.
+
+    Records are deduplicated by a hash of their content, every distinct record is
+    encoded once and identical records share its offset. Strings (map keys and
+    values) are written once and referenced with pointers afterwards.
+    Integers use the smallest unsigned type that fits (uint16/32/64/128), negative
+    ones int32, like mmdb_writer's "auto" int type.
+    """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.size = 0
+        self.records = 0
+        self._offsets = {}
+        self._strings = {}
+        self._last = (None, None)
+
+    def add(self, record) -> int:
+        """Returns the offset of `record` in the data section, encoding it if it's new."""
+        self.records += 1
+        if record is self._last[0]:
+            return self._last[1]
+        digest = blake2b(repr(record).encode(), digest_size=16).digest()
+        offset = self._offsets.get(digest)
+        if offset is None:
+            out = bytearray()
+            _encode(record, out, self._strings, self.size)
+            offset = self._offsets[digest] = self.size
+            self.file.write(out)
+            self.size += len(out)
+        self._last = (record, offset)
+        return offset
+
+    @property
+    def unique_records(self) -> int:
+        return len(self._offsets)
+
+    def close(self):
+        self.file.close()
+
+
+def _encode(value, out: bytearray, strings: Optional[dict] = None, base: int = 0):
+    """
+    Appends the encoding of `value` to `out`. When `strings` is given, strings found
+    in it are written as pointers and new strings are added to it with their offset
+    (`base` is the offset of `out` in the data section).
+    """
+    value_type = type(value)
+    if value_type is str:
+        if strings is not None:
+            pointer = strings.get(value)
+            if pointer is not None:
+                _write_pointer(out, pointer)
+                return
+            # A pointer takes at least 2 bytes, shorter strings are always inlined
+            if len(value) > 2:
+                strings[value] = base + len(out)
+        data = value.encode("utf-8")
+        _write_header(out, _UTF8_STRING, len(data))
+        out += data
+    elif value_type is dict:
+        _write_header(out, _MAP, len(value))
+        for key, item in value.items():
+            _encode(key, out, strings, base)
+            _encode(item, out, strings, base)
+    elif value_type is bool:
+        _write_header(out, _BOOLEAN, 1 if value else 0)
+    elif value_type is int:
+        if value < 0:
+            _write_header(out, _INT32, 4)
+            out += struct.pack(">i", value)
+        else:
+            if value > 0xFFFFFFFFFFFFFFFF:
+                type_id = _UINT128
+            elif value > 0xFFFFFFFF:
+                type_id = _UINT64
+            elif value > 0xFFFF:
+                type_id = _UINT32
+            else:
+                type_id = _UINT16
+            _write_uint(out, type_id, value)
+    elif value_type is float:
+        _write_header(out, _DOUBLE, 8)
+        out += struct.pack(">d", value)
+    elif value_type is bytes:
+        _write_header(out, _BYTES, len(value))
+        out += value
+    elif value_type in (list, tuple):
+        _write_header(out, _ARRAY, len(value))
+        for item in value:
+            _encode(item, out, strings, base)
+    else:
+        raise TypeError(f"Can't encode {value_type.__name__} values in an MMDB data section")
+
+
+def _write_uint(out: bytearray, type_id: int, value: int):
+    data = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    _write_header(out, type_id, len(data))
+    out += data
+
+
+def _write_header(out: bytearray, type_id: int, size: int):
+    if size < 29:
+        size_bits, extra = size, b""
+    elif size < 285:
+        size_bits, extra = 29, bytes((size - 29,))
+    elif size < 65821:
+        size_bits, extra = 30, (size - 285).to_bytes(2, "big")
+    else:
+        size_bits, extra = 31, (size - 65821).to_bytes(3, "big")
+    if type_id <= 7:
+        out.append((type_id << 5) | size_bits)
+    else:
+        out.append(size_bits)
+        out.append(type_id - 7)
+    out += extra
+
+
+def _write_pointer(out: bytearray, pointer: int):
+    if pointer < 2048:
+        out.append(0x20 | (pointer >> 8))
+        out.append(pointer & 0xFF)
+    elif pointer < 526336:
+        pointer -= 2048
+        out.append(0x28 | (pointer >> 16))
+        out += (pointer & 0xFFFF).to_bytes(2, "big")
+    elif pointer < 134744064:
+        pointer -= 526336
+        out.append(0x30 | (pointer >> 24))
+        out += (pointer & 0xFFFFFF).to_bytes(3, "big")
+    else:
+        out.append(0x38)
+        out += pointer.to_bytes(4, "big")
+
+
+def _encode_metadata(metadata: dict) -> bytes:
+    # The metadata fields have fixed types in the specification
+    fixed_types = {
+        "node_count": _UINT32,
+        "record_size": _UINT16,
+        "ip_version": _UINT16,
+        "binary_format_major_version": _UINT16,
+        "binary_format_minor_version": _UINT16,
+        "build_epoch": _UINT64,
+    }
+    out = bytearray()
+    _write_header(out, _MAP, len(metadata))
+    for key, value in metadata.items():
+        _encode(key, out)
+        if key in fixed_types:
+            _write_uint(out, fixed_types[key], value)
+        else:
+            _encode(value, out)
+    return bytes(out)
+
+
+class SearchTreeBuilder:
+    """
+    Builds the MMDB binary search tree from sorted, non overlapping
+    (first, last, data_offset) ranges in a single pass.
+
+    Subtrees are built depth first: a subtree entirely inside the current range
+    becomes a data record, a subtree before the next range an empty record, the
+    others are split in two. Nodes whose children are the same record are
+    collapsed into that record. Nodes are stored in two int64 arrays (left/right)
+    in post order, the root being the last node.
+    """
+
+    def __init__(self, bit_length: int):
+        self.bit_length = bit_length
+        self.left = array("q")
+        self.right = array("q")
+        self._ranges: Iterator[Tuple[int, int, int]] = iter(())
+        self._current = None
+
+    def build(self, ranges: Iterable[Tuple[int, int, int]]) -> int:
+        """Builds the tree, returns the number of nodes."""
+        self._ranges = iter(ranges)
+        self._current = None
+        self._advance(-1)
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, self.bit_length + 100))
+        try:
+            root = self._build(0, self.bit_length)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+        if self._current is not None:
+            raise ValueError(f"Range {self._current[:2]} is outside of the {self.bit_length} bits address space")
+        if root < 0:
+            # Every search starts from node 0, the tree needs at least one node
+            self.left.append(root)
+            self.right.append(root)
+        return len(self.left)
+
+    def _advance(self, previous_last: int):
+        for first, last, data_offset in self._ranges:
+            if first > last:
+                continue
+            if first <= previous_last:
+                raise ValueError(f"Ranges must be sorted and non overlapping, got {first} after {previous_last}")
+            self._current = (first, last, _data_value(data_offset))
+            return
+        self._current = None
+
+    def _build(self, base: int, bits: int) -> int:
+        current = self._current
+        end = base + (1 << bits) - 1
+        if current is None or current[0] > end:
+            return _EMPTY
+        if current[0] <= base and current[1] >= end:
+            if current[1] == end:
+                self._advance(end)
+            return current[2]
+
+        half = 1 << (bits - 1)
+        left = self._build(base, bits - 1)
+        right = self._build(base + half, bits - 1)
+        if left == right and left < 0:
+            return left
+        self.left.append(left)
+        self.right.append(right)
+        return len(self.left) - 1
+
+
+def _record_size(max_value: int) -> int:
+    for record_size in (24, 28, 32):
+        if max_value < (1 << record_size):
+            return record_size
+    raise ValueError("The database is too large for 32 bits records")
+
+
+def _node_bytes(left: np.ndarray, right: np.ndarray, record_size: int) -> bytes:
+    count = len(left)
+    if record_size == 32:
+        return np.stack([left, right], axis=1).astype(">u4").tobytes()
+    nodes = np.empty((count, record_size // 4), dtype=np.uint8)
+    if record_size == 24:
+        for i, shift in enumerate((16, 8, 0)):
+            nodes[:, i] = (left >> shift) & 0xFF
+            nodes[:, 3 + i] = (right >> shift) & 0xFF
+    else:
+        for i, shift in enumerate((16, 8, 0)):
+            nodes[:, i] = (left >> shift) & 0xFF
+            nodes[:, 4 + i] = (right >> shift) & 0xFF
+        nodes[:, 3] = ((left >> 20) & 0xF0) | ((right >> 24) & 0x0F)
+    return nodes.tobytes()
+
+
+class MMDBTreeWriter:
+    """
+    MaxMind DB writer for sorted, non overlapping ranges.
+
+    Records are added first with `add_record` (deduplicated in a DataSection),
+    then `write` builds the search tree from (first, last, record_handle) ranges
+    and streams the file to disk. With ip_version 6 the IPv4 ranges must be given
+    in ::/96 (their integer value), like mmdb_writer's ipv4_compatible option.
+    """
+
+    def __init__(
+        self,
+        ip_version: int = 6,
+        database_type: str = "GeoIP",
+        languages: Optional[list] = None,
+        description: Optional[dict] = None,
+    ):
+        self.ip_version = ip_version
+        self.database_type = database_type
+        self.languages = languages or []
+        self.description = description or {}
+        self.data = DataSection()
+
+    def add_record(self, record) -> int:
+        """Adds a record to the data section and returns its handle for `write`."""
+        return self.data.add(record)
+
+    def write(self, path: str, ranges: Iterable[Tuple[int, int, int]], nodes_per_chunk: int = 1 << 20) -> dict:
+        builder = SearchTreeBuilder(128 if self.ip_version == 6 else 32)
+        node_count = builder.build(ranges)
+        record_size = _record_size(node_count + 16 + self.data.size)
+
+        # Node ids are reversed so the root (last in post order) is node 0
+        left = np.frombuffer(builder.left, dtype=np.int64)
+        right = np.frombuffer(builder.right, dtype=np.int64)
+        with open(path, "wb") as file:
+            for stop in range(node_count, 0, -nodes_per_chunk):
+                start = max(stop - nodes_per_chunk, 0)
+                file.write(
+                    _node_bytes(
+                        self._resolve(left[start:stop][::-1], node_count),
+                        self._resolve(right[start:stop][::-1], node_count),
+                        record_size,
+                    )
+                )
+            file.write(b"\x00" * 16)
+            self.data.file.seek(0)
+            shutil.copyfileobj(self.data.file, file)
+            file.write(METADATA_MAGIC)
+            file.write(
+                _encode_metadata(
+                    {
+                        "node_count": node_count,
+                        "record_size": record_size,
+                        "ip_version": self.ip_version,
+                        "database_type": self.database_type,
+                        "languages": self.languages,
+                        "binary_format_major_version": 2,
+                        "binary_format_minor_version": 0,
+                        "build_epoch": int(time.time()),
+                        "description": self.description,
+                    }
+                )
+            )
+        return {
+            "nodes": node_count,
+            "record_size": record_size,
+            "records": self.data.records,
+            "unique_records": self.data.unique_records,
+            "data_size": self.data.size,
+        }
+
+    @staticmethod
+    def _resolve(values: np.ndarray, node_count: int) -> np.ndarray:
+        # node id -> reversed id, empty -> node_count, data -> node_count + 16 + offset
+        return np.where(
+            values >= 0,
+            node_count - 1 - values,
+            np.where(values == _EMPTY, node_count, node_count + 16 + (-2 - values)),
+        ).astype(np.uint64)
+
+    def close(self):
+        self.data.close()
+
+
+def write_mmdb(path: str, ranges: Iterable[Tuple[int, int, object]], **options) -> dict:
+    """
+    Writes the sorted, non overlapping (first, last, record) `ranges` to an MMDB
+    file, see MMDBTreeWriter for the options. Returns the build stats.
+    """
+    writer = MMDBTreeWriter(**options)
+    try:
+        return writer.write(path, ((first, last, writer.add_record(record)) for first, last, record in ranges))
+    finally:
+        writer.close()
@@ -0,0 +1,185 @@
+import multiprocessing
+import os
+import queue as queue_module
+import traceback
+from typing import Callable, List, Optional
+
+from lib.block import Block
+from lib.block_filter import BlockFilter
+from lib.instrumentation import PipelineStats
+from lib.ripe_parser import RIPE_PARSER
+from lib.shard_splitter import Shard, split_file
+
+
+class ImportTask:
+    """
+    A unit of parsing work: one registry file, or one byte range of it.
+    `parser` is the name of the RIPE_PARSER method used to read `file_path`.
+    """
+
+    def __init__(self, name: str, parser: str, file_path: str, kwargs: Optional[dict] = None):
+        self.name = name
+        self.parser = parser
+        self.file_path = file_path
+        self.kwargs = kwargs or {}
+
+    def run(self, cb: Callable[[Block], None]):
+        getattr(RIPE_PARSER, self.parser)(self.file_path, cb, **self.kwargs)
+
+    def size(self) -> int:
+        """Bytes of the file (on disk, compressed or not) read by the task."""
+        if "start" in self.kwargs or "end" in self.kwargs:
+            return self.kwargs.get("end", os.path.getsize(self.file_path)) - self.kwargs.get("start", 0)
+        return os.path.getsize(self.file_path)
+
+    def __repr__(self):
+        return f"ImportTask({self.name!r}, {self.parser!r}, {self.file_path!r}, {self.kwargs!r})"
+
+
+def shard_task(task: ImportTask, shards: int) -> List[ImportTask]:
+    """
+    Splits a `parse_file` task in byte range tasks (see lib.shard_splitter), other
+    parsers and compressed files (which can't be seeked) are kept whole.
+    """
+    if shards <= 1 or task.parser != "parse_file":
+        return [task]
+    return shard_tasks(task.name, task.file_path, split_file(task.file_path, shards), task.kwargs)
+
+
+def shard_tasks(name: str, file_path: str, shards: List[Shard], kwargs: Optional[dict] = None) -> List[ImportTask]:
+    """`parse_file` tasks of the shards of a file, they share the `name` of the file."""
+    return [ImportTask(name, "parse_file", file_path, {**(kwargs or {}), **shard.parse_kwargs()}) for shard in shards]
+
+
+def filtered_callback(cb: Callable[[Block], None], block_filter: Optional[BlockFilter], stats: PipelineStats) -> Callable[[Block], None]:
+    """`cb` called with the blocks kept by `block_filter`, the excluded ones are counted in "blocks_filtered:<rule>"."""
+    if block_filter is None:
+        return cb
+    exclude = block_filter.exclude
+
+    def on_block(block):
+        rule = exclude(block)
+        if rule is None:
+            cb(block)
+        else:
+            stats.add("blocks_filtered")
+            stats.add(f"blocks_filtered:{rule}")
+
+    return on_block
+
+
+# Seconds between the checks of the workers while no batch arrives
+WORKER_POLL_INTERVAL = 1.0
+
+_queue = None
+
+
+def _init_worker(queue):
+    global _queue
+    _queue = queue
+
+
+def _run_task(index: int, task: ImportTask, batch_size: int, block_filter: Optional[BlockFilter]):
+    batch = []
+    stats = PipelineStats()
+
+    def on_block(block):
+        nonlocal batch
+        batch.append(block)
+        if len(batch) >= batch_size:
+            with stats.timer("queue_wait"):
+                _queue.put(("blocks", index, batch))
+            batch = []
+
+    try:
+        with stats.timer(f"parse:{task.name}"):
+            task.run(filtered_callback(on_block, block_filter, stats))
+        stats.add("bytes_read", task.size())
+        if batch:
+            _queue.put(("blocks", index, batch))
+        _queue.put(("done", index, stats.snapshot()))
+    except Exception:
+        _queue.put(("error", index, traceback.format_exc()))
+
+
+def run_import_tasks(
+    tasks: List[ImportTask],
+    on_blocks: Callable[[ImportTask, List[Block]], None],
+    workers: int = 1,
+    batch_size: int = 5000,
+    stats: Optional[PipelineStats] = None,
+    block_filter: Optional[BlockFilter] = None,
+):
+    """
+    Runs the parsing tasks and hands the formatted blocks to `on_blocks` in batches
+    of at most `batch_size`, always from the calling process, so a single SQLite
+    writer can consume them.
+    With `workers` > 1 every task is parsed in its own worker process; batches of
+    different tasks are then interleaved in completion order. A task that raises,
+    or a worker that dies, stops the import with a RuntimeError.
+    The blocks excluded by `block_filter` are dropped while parsing (in the
+    workers), they never reach `on_blocks`.
+    `stats` gets the "parse:<task name>" timers (the time spent in `on_blocks`
+    excluded, summed over the workers), "bytes_read", "blocks_parsed" (the blocks
+    handed to `on_blocks`) and "blocks_filtered" / "blocks_filtered:<rule>" counters.
+    """
+    stats = stats if stats is not None else PipelineStats()
+    if workers <= 1:
+        for task in tasks:
+            batch = []
+
+            def on_block(block):
+                nonlocal batch
+                batch.append(block)
+                if len(batch) >= batch_size:
+                    stats.add("blocks_parsed", len(batch))
+                    on_blocks(task, batch)
+                    batch = []
+
+            with stats.timer(f"parse:{task.name}"):
+                task.run(filtered_callback(on_block, block_filter, stats))
+                if batch:
+                    stats.add("blocks_parsed", len(batch))
+                    on_blocks(task, batch)
+            stats.add("bytes_read", task.size())
+        return
+
+    queue = multiprocessing.Queue(maxsize=workers * 4)
+    children = {process.pid for process in multiprocessing.active_children()}
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(queue,)) as pool:
+        # The pool never replaces a worker unless it died (killed by the OOM killer, crashed...)
+        worker_pids = {process.pid for process in multiprocessing.active_children()} - children
+        results = [pool.apply_async(_run_task, (index, task, batch_size, block_filter)) for index, task in enumerate(tasks)]
+        pending = len(tasks)
+        while pending:
+            try:
+                kind, index, payload = queue.get(timeout=WORKER_POLL_INTERVAL)
+            except queue_module.Empty:
+                _check_workers(pool, tasks, results, worker_pids)
+                continue
+            if kind == "blocks":
+                stats.add("blocks_parsed", len(payload))
+                on_blocks(tasks[index], payload)
+            elif kind == "done":
+                stats.merge(payload)
+                pending -= 1
+            else:
+                pool.terminate()
+                raise RuntimeError(f"Import task {tasks[index]} failed:\n{payload}")
+
+
+def _check_workers(pool, tasks: List[ImportTask], results: list, worker_pids: set):
+    """Raises when a task failed outside of _run_task (arguments that can't be pickled...) or a worker died."""
+    for index, result in enumerate(results):
+        if result.ready() and not result.successful():
+            pool.terminate()
+            try:
+                result.get()
+            except Exception as error:
+                raise RuntimeError(f"Import task {tasks[index]} failed: {error!r}") from error
+    alive = {process.pid for process in multiprocessing.active_children()}
+    dead = worker_pids - alive
+    if dead:
+        pool.terminate()
+        unfinished = [task for task, result in zip(tasks, results) if not result.ready()]
+        raise RuntimeError(f"Import worker process(es) {sorted(dead)} exited unexpectedly, unfinished task(s): {unfinished}")
@@ -0,0 +1,114 @@
+import heapq
+import sqlite3
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from lib.block_filter import DEFAULT_BLOCK_FILTER, BlockFilter
+from lib.common import ip_int_from_db, ip_int_to_db
+
+FLAT_TABLE = "ip_ranges_flat"
+
+
+def most_specific_intervals(ranges: Iterable[Tuple[int, int, int]], by_size: bool = True) -> List[Tuple[int, int, int]]:
+    """
+    Flattens possibly nested/overlapping (first, last, record_index) ranges into
+    sorted non-overlapping intervals, every address points to the smallest range
+    that contains it. When two ranges have the same size the highest record index
+    (the row inserted last) wins. Adjacent intervals with the same owner are merged.
+    Without `by_size` the highest record index always wins, which is the result of
+    inserting the ranges in record index order in a tree (like mmdb_writer does).
+    """
+    ranges = sorted(r for r in ranges if r[0] <= r[1])
+    intervals = []
+    heap = []
+    i = 0
+    count = len(ranges)
+    position = ranges[0][0] if ranges else 0
+    while i < count or heap:
+        while i < count and ranges[i][0] <= position:
+            first, last, record_index = ranges[i]
+            heapq.heappush(heap, (last - first if by_size else 0, -record_index, last))
+            i += 1
+        while heap and heap[0][2] < position:
+            heapq.heappop(heap)
+        if not heap:
+            if i >= count:
+                break
+            position = ranges[i][0]
+            continue
+
+        _, negative_index, end = heap[0]
+        if i < count and ranges[i][0] - 1 < end:
+            end = ranges[i][0] - 1
+        if intervals and intervals[-1][2] == -negative_index and intervals[-1][1] == position - 1:
+            intervals[-1] = (intervals[-1][0], end, -negative_index)
+        else:
+            intervals.append((position, end, -negative_index))
+        position = end + 1
+    return intervals
+
+
+def merge_identical(intervals: List[Tuple[int, int, int]], key: Callable[[int], object]) -> List[Tuple[int, int, int]]:
+    """
+    Merges adjacent intervals whose owners have the same `key(record_index)`,
+    the merged interval keeps the owner of its first part.
+    """
+    merged = []
+    previous_key = None
+    for first, last, record_index in intervals:
+        record_key = key(record_index)
+        if merged and merged[-1][1] == first - 1 and record_key == previous_key:
+            merged[-1] = (merged[-1][0], last, merged[-1][2])
+        else:
+            merged.append((first, last, record_index))
+            previous_key = record_key
+    return merged
+
+
+def build_flat_table(db_name: str, block_filter: Optional[BlockFilter] = DEFAULT_BLOCK_FILTER) -> dict:
+    """
+    Flattening stage: sweeps the ip_data ranges once and writes the non-overlapping
+    most specific intervals to the ip_ranges_flat table, adjacent intervals with the
+    same netname/country/descr/mnt_by are merged. The rows excluded by
+    `block_filter` are left out, in SQL unless the import already dropped them
+    (see BlockFilter.export_where), None keeps every row.
+    Returns the number of source rows and of written intervals per IP version.
+    """
+    conn = sqlite3.connect(db_name)
+    where = block_filter.export_where(conn) if block_filter is not None else None
+    query = "SELECT id, ip_version, first_ip_int, last_ip_int, netname, country, descr, mnt_by FROM ip_data"
+    if where:
+        query += f" WHERE {where}"
+
+    ids = []
+    attributes = []
+    ranges = {4: [], 6: []}
+    for row in conn.execute(query + " ORDER BY id"):
+        first_ip_int = ip_int_from_db(row[2])
+        last_ip_int = ip_int_from_db(row[3])
+        if first_ip_int is None or last_ip_int is None or row[1] not in ranges:
+            continue
+        ranges[row[1]].append((first_ip_int, last_ip_int, len(ids)))
+        ids.append(row[0])
+        attributes.append(row[4:])
+
+    stats = {"rows": len(ids)}
+    conn.execute(f"DROP TABLE IF EXISTS {FLAT_TABLE}")
+    conn.execute(f'''CREATE TABLE {FLAT_TABLE}
+                    (ip_version INTEGER,
+                    first_ip_int INTEGER,
+                    last_ip_int INTEGER,
+                    ip_data_id INTEGER)''')
+    for ip_version, version_ranges in ranges.items():
+        intervals = merge_identical(most_specific_intervals(version_ranges), attributes.__getitem__)
+        conn.executemany(
+            f"INSERT INTO {FLAT_TABLE} (ip_version, first_ip_int, last_ip_int, ip_data_id) VALUES (?, ?, ?, ?)",
+            (
+                (ip_version, ip_int_to_db(first, ip_version), ip_int_to_db(last, ip_version), ids[record_index])
+                for first, last, record_index in intervals
+            ),
+        )
+        stats[f"v{ip_version}_intervals"] = len(intervals)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{FLAT_TABLE}_first_ip_int ON {FLAT_TABLE} (ip_version, first_ip_int)")
+    conn.commit()
+    conn.close()
+    return stats
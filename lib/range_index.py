@@ -0,0 +1,252 @@
+import mmap
+import socket
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from typing import Optional
+
+import numpy as np
+
+from lib.lookup import RECORD_FIELDS, IPLookup
+
+_inet_pton = socket.inet_pton
+_AF_INET = socket.AF_INET
+_AF_INET6 = socket.AF_INET6
+
+MAGIC = b"IPRANGE\x00"
+FORMAT_VERSION = 1
+# magic, format version, record size, v4 count, v6 count, record count, string table size
+HEADER = struct.Struct("<8sIIQQQQ")
+# ip_data id, then the string table offsets of netname, country, descr, mnt_by
+RECORD = struct.Struct("<IIIII")
+INDEX_FIELDS = ("id", "netname", "country", "descr", "mnt_by")
+NO_STRING = 0xFFFFFFFF
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _layout(v4_count: int, v6_count: int, record_count: int, strings_size: int) -> dict:
+    """Byte offset of every section, each one starts on an 8 bytes boundary."""
+    sizes = (
+        ("v4_starts", 4 * v4_count),
+        ("v4_ends", 4 * v4_count),
+        ("v4_records", 4 * v4_count),
+        ("v6_starts", 16 * v6_count),
+        ("v6_ends", 16 * v6_count),
+        ("v6_records", 4 * v6_count),
+        ("records", RECORD.size * record_count),
+        ("strings", strings_size),
+    )
+    offsets = {}
+    position = _align(HEADER.size)
+    for name, size in sizes:
+        offsets[name] = position
+        position = _align(position + size)
+    offsets["end"] = position
+    return offsets
+
+
+def write_range_index(path: str, ip_lookup: IPLookup) -> dict:
+    """
+    Writes the flattened intervals of `ip_lookup` as a binary range index:
+
+    - header (HEADER), then sections aligned on 8 bytes, all little endian
+    - IPv4 interval starts, ends (u32) and record offsets (u32)
+    - IPv6 interval starts, ends (u128 as two u64, high half first) and record offsets (u32)
+    - records (RECORD: ip_data id and 4 string offsets, NO_STRING for NULL)
+    - string table: u32 length + UTF-8 bytes, every distinct string stored once
+
+    Record offsets are byte offsets in the records section. Returns the section counts.
+    """
+    used = sorted(set(ip_lookup.v4_records) | set(int(index) for index in ip_lookup.v6_records))
+    record_positions = {record_index: position for position, record_index in enumerate(used)}
+
+    strings = bytearray()
+    string_offsets = {}
+    records = bytearray()
+    field_positions = [RECORD_FIELDS.index(field) for field in INDEX_FIELDS[1:]]
+    for record_index in used:
+        record = ip_lookup.records[record_index]
+        offsets = []
+        for position in field_positions:
+            value = record[position]
+            if value is None:
+                offsets.append(NO_STRING)
+                continue
+            offset = string_offsets.get(value)
+            if offset is None:
+                data = str(value).encode("utf-8")
+                offset = string_offsets[value] = len(strings)
+                strings += struct.pack("<I", len(data)) + data
+            offsets.append(offset)
+        records += RECORD.pack(record[0], *offsets)
+
+    v4_count = len(ip_lookup.v4_starts)
+    v6_count = len(ip_lookup.v6_starts)
+    layout = _layout(v4_count, v6_count, len(used), len(strings))
+
+    def record_offsets(indexes) -> bytes:
+        return np.array([record_positions[int(index)] * RECORD.size for index in indexes], dtype="<u4").tobytes()
+
+    def v6_bounds(keys: np.ndarray) -> bytes:
+        # 16 bytes big endian keys -> (high, low) little endian u64 pairs
+        return np.frombuffer(keys.tobytes(), dtype=">u8").astype("<u8").tobytes()
+
+    sections = {
+        "v4_starts": np.frombuffer(ip_lookup.v4_starts, dtype=np.uint32).astype("<u4").tobytes(),
+        "v4_ends": np.frombuffer(ip_lookup.v4_ends, dtype=np.uint32).astype("<u4").tobytes(),
+        "v4_records": record_offsets(ip_lookup.v4_records),
+        "v6_starts": v6_bounds(ip_lookup.v6_starts),
+        "v6_ends": v6_bounds(ip_lookup.v6_ends),
+        "v6_records": record_offsets(ip_lookup.v6_records),
+        "records": bytes(records),
+        "strings": bytes(strings),
+    }
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, RECORD.size, v4_count, v6_count, len(used), len(strings)))
+        for name, data in sections.items():
+            file.write(b"\x00" * (layout[name] - file.tell()))
+            file.write(data)
+        file.write(b"\x00" * (layout["end"] - file.tell()))
+    return {"v4_intervals": v4_count, "v6_intervals": v6_count, "records": len(used), "strings": len(string_offsets)}
+
+
+class RangeIndex:
+    """
+    Reader of a file written by write_range_index. The file is memory mapped and
+    searched in place (memoryview casts + bisect), opening it only reads the
+    header, and processes opening the same file share its pages.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, v4_count, v6_count, record_count, strings_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} range index")
+        self.v4_count = v4_count
+        self.v6_count = v6_count
+        self.record_count = record_count
+        self._layout = layout = _layout(v4_count, v6_count, record_count, strings_size)
+        self._view = memoryview(self._mmap)
+
+        def section(name: str, size: int, fmt: str):
+            view = self._view[layout[name]:layout[name] + size]
+            if sys.byteorder == "little":
+                return view.cast(fmt)
+            # The arrays are little endian, big endian hosts get a swapped copy
+            return array(fmt, np.frombuffer(view, dtype="<u4" if fmt == "I" else "<u8").astype(fmt).tobytes())
+
+        self.v4_starts = section("v4_starts", 4 * v4_count, "I")
+        self.v4_ends = section("v4_ends", 4 * v4_count, "I")
+        self.v4_records = section("v4_records", 4 * v4_count, "I")
+        self.v6_starts = section("v6_starts", 16 * v6_count, "Q")
+        self.v6_ends = section("v6_ends", 16 * v6_count, "Q")
+        self.v6_records = section("v6_records", 4 * v6_count, "I")
+        self._records_offset = layout["records"]
+        self._strings_offset = layout["strings"]
+
+    def _v6_position(self, high: int, low: int) -> int:
+        """Index of the last interval starting at or before (high, low), -1 if none."""
+        starts = self.v6_starts
+        lo, hi = 0, self.v6_count
+        while lo < hi:
+            middle = (lo + hi) // 2
+            start_high = starts[2 * middle]
+            if start_high < high or (start_high == high and starts[2 * middle + 1] <= low):
+                lo = middle + 1
+            else:
+                hi = middle
+        return lo - 1
+
+    def lookup_offset(self, ip: str) -> int:
+        """Offset of the record of the interval containing `ip` in the records section, -1 if none."""
+        if ":" not in ip:
+            try:
+                value = int.from_bytes(_inet_pton(_AF_INET, ip), "big")
+            except OSError:
+                raise ValueError(f"Invalid IP address: {ip}")
+            position = bisect_right(self.v4_starts, value) - 1
+            if position >= 0 and self.v4_ends[position] >= value:
+                return self.v4_records[position]
+            return -1
+
+        try:
+            high, low = struct.unpack(">QQ", _inet_pton(_AF_INET6, ip))
+        except OSError:
+            raise ValueError(f"Invalid IP address: {ip}")
+        position = self._v6_position(high, low)
+        if position >= 0:
+            end_high = self.v6_ends[2 * position]
+            if end_high > high or (end_high == high and self.v6_ends[2 * position + 1] >= low):
+                return self.v6_records[position]
+        return -1
+
+    def _string(self, offset: int) -> Optional[str]:
+        if offset == NO_STRING:
+            return None
+        position = self._strings_offset + offset
+        (size,) = struct.unpack_from("<I", self._mmap, position)
+        return str(self._view[position + 4:position + 4 + size], "utf-8")
+
+    def record(self, offset: int) -> dict:
+        """Decodes the record at `offset` (see lookup_offset) as a dict with INDEX_FIELDS keys."""
+        ip_data_id, *string_offsets = RECORD.unpack_from(self._mmap, self._records_offset + offset)
+        return {"id": ip_data_id, **{field: self._string(string_offset) for field, string_offset in zip(INDEX_FIELDS[1:], string_offsets)}}
+
+    def lookup(self, ip: str) -> Optional[dict]:
+        """Returns the record of the most specific range containing `ip`, None if no range contains it."""
+        offset = self.lookup_offset(ip)
+        if offset < 0:
+            return None
+        return self.record(offset)
+
+    def lookup_many_v4(self, values: np.ndarray) -> np.ndarray:
+        """
+        Vectorized lookup of IPv4 addresses given as integers, returns the record
+        offsets (-1 when not found, and for the integers outside 0..2**32-1).
+        """
+        layout = self._layout
+        starts = np.frombuffer(self._mmap, dtype="<u4", count=self.v4_count, offset=layout["v4_starts"])
+        ends = np.frombuffer(self._mmap, dtype="<u4", count=self.v4_count, offset=layout["v4_ends"])
+        records = np.frombuffer(self._mmap, dtype="<u4", count=self.v4_count, offset=layout["v4_records"])
+        values = np.asarray(values)
+        invalid = None
+        if values.dtype.kind != "u" or values.dtype.itemsize > 4:
+            # Converting to uint32 would wrap the negative and the larger values around to valid addresses
+            invalid = (values < 0) | (values > 0xFFFFFFFF)
+            if invalid.any():
+                values = np.where(invalid, 0, values)
+            else:
+                invalid = None
+        values = values.astype(np.uint32)
+        if self.v4_count == 0:
+            return np.full(len(values), -1, dtype=np.int64)
+        positions = np.searchsorted(starts, values, side="right") - 1
+        clipped = np.clip(positions, 0, None)
+        hit = (positions >= 0) & (ends[clipped] >= values)
+        if invalid is not None:
+            hit &= ~invalid
+        return np.where(hit, records[clipped].astype(np.int64), -1)
+
+    def close(self):
+        for name in ("v4_starts", "v4_ends", "v4_records", "v6_starts", "v6_ends", "v6_records"):
+            view = getattr(self, name)
+            if isinstance(view, memoryview):
+                view.release()
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def build_range_index(db_name: str, path: str, flat_table: bool = False) -> dict:
+    """Loads `db_name` with IPLookup.from_sqlite and writes its range index to `path`."""
+    return write_range_index(path, IPLookup.from_sqlite(db_name, flat_table=flat_table))
@@ -0,0 +1,300 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+from itertools import groupby
+from operator import itemgetter
+from typing import Iterator, List, Tuple
+
+from lib.common import ip_int_from_db, ip_int_to_db
+from lib.db import FINGERPRINTS_TABLE, INSERT_FINGERPRINT_QUERY, METADATA_TABLE, is_normalized, set_metadata
+from lib.range_flattener import FLAT_TABLE, build_flat_table
+
+CHANGESET_FORMAT = "geolocation-changeset"
+CHANGESET_VERSION = 1
+# Columns of an ip_data row besides its range (ip_version, first_ip_int, last_ip_int)
+ROW_COLUMNS = ("first_ip", "last_ip", "subnet", "network_prefix", "netname", "country", "descr", "mnt_by")
+
+FIND_ROW_QUERY = (
+    "SELECT id FROM ip_data WHERE ip_version = ? AND first_ip_int = ? AND last_ip_int = ? AND "
+    + " AND ".join(f"{column} IS ?" for column in ROW_COLUMNS)
+    + " LIMIT 1"
+)
+UPDATE_ROW_QUERY = f"UPDATE ip_data SET {', '.join(f'{column} = ?' for column in ROW_COLUMNS)} WHERE id = ?"
+INSERT_ROW_QUERY = (
+    f"INSERT INTO ip_data (id, ip_version, first_ip_int, last_ip_int, {', '.join(ROW_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * (len(ROW_COLUMNS) + 4))})"
+)
+
+# Rows read by read_groups: registry, fingerprint, ip_version, first_ip_int, last_ip_int, *ROW_COLUMNS
+RANGE_KEY = itemgetter(2, 3, 4)
+VALUES_START = 5
+
+# (range key, [row, ...]) of the rows sharing a range
+Group = Tuple[tuple, List[tuple]]
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def _connect(db_name: str) -> sqlite3.Connection:
+    if not os.path.isfile(db_name):
+        raise FileNotFoundError(f"No database at {db_name}")
+    conn = sqlite3.connect(db_name)
+    if conn.execute("PRAGMA user_version").fetchone()[0] < 2:
+        conn.close()
+        # TEXT integers don't sort numerically, the merge-join needs the ranges in order
+        raise ValueError(f"{db_name} uses schema version 1, convert it with scripts/migrate_db.py first")
+    return conn
+
+
+def read_groups(conn: sqlite3.Connection, digest=None) -> Iterator[Group]:
+    """
+    Streams the ip_data rows sorted by (ip_version, first_ip_int, last_ip_int),
+    the rows of a range are grouped and sorted so every release reads the same
+    sequence whatever the row ids. `digest` (a hashlib object) is updated with it.
+    """
+    # Scanning the table and sorting it (SQLite spills the sort to temporary files)
+    # is about twice as fast as following idx_ip_version with a table lookup per row
+    source = "ip_data d" if is_normalized(conn) else "ip_data d NOT INDEXED"
+    if _has_table(conn, FINGERPRINTS_TABLE):
+        source += f" LEFT JOIN {FINGERPRINTS_TABLE} f ON f.ip_data_id = d.id"
+        fingerprints = "f.registry, f.fingerprint"
+    else:
+        fingerprints = "NULL, NULL"
+    cursor = conn.execute(
+        f"SELECT {fingerprints}, d.ip_version, d.first_ip_int, d.last_ip_int, {', '.join(f'd.{column}' for column in ROW_COLUMNS)} "
+        f"FROM {source} ORDER BY d.ip_version, d.first_ip_int, d.last_ip_int"
+    )
+    for key, rows in groupby(cursor, RANGE_KEY):
+        group = list(rows)
+        if len(group) > 1:
+            # repr orders None and str values alike
+            group.sort(key=_row_repr)
+        if digest is not None:
+            digest.update("\n".join(map(_row_repr, group)).encode())
+        yield key, group
+
+
+def _row_repr(row: tuple) -> str:
+    return repr(row[2:])
+
+
+def database_digest(conn: sqlite3.Connection) -> str:
+    """sha256 of the ranges and values of ip_data, independent of the row ids and of the schema (normalized or not)."""
+    digest = hashlib.sha256()
+    for _ in read_groups(conn, digest):
+        pass
+    return digest.hexdigest()
+
+
+def _operation(op: str, key: tuple, row: tuple, **extra) -> dict:
+    operation = {
+        "op": op,
+        "ip_version": key[0],
+        "first_ip_int": ip_int_from_db(key[1]),
+        "last_ip_int": ip_int_from_db(key[2]),
+        "row": dict(zip(ROW_COLUMNS, row[VALUES_START:])),
+        **extra,
+    }
+    if op != "-" and row[0] is not None:
+        operation["registry"] = row[0]
+        operation["fingerprint"] = row[1]
+    return operation
+
+
+def _diff_group(key: tuple, old_rows: list, new_rows: list, counts: dict, fields: dict):
+    if len(old_rows) == len(new_rows) and all(old[VALUES_START:] == new[VALUES_START:] for old, new in zip(old_rows, new_rows)):
+        counts["unchanged"] += len(new_rows)
+        return
+    remaining = list(old_rows)
+    added = []
+    for row in new_rows:
+        for position, old_row in enumerate(remaining):
+            if old_row[VALUES_START:] == row[VALUES_START:]:
+                del remaining[position]
+                counts["unchanged"] += 1
+                break
+        else:
+            added.append(row)
+    # Rows left on both sides are reassignments of the range, the others added/removed
+    for old_row, row in zip(remaining, added):
+        changed = {column: old for column, old, new in zip(ROW_COLUMNS, old_row[VALUES_START:], row[VALUES_START:]) if old != new}
+        for column in changed:
+            fields[column] = fields.get(column, 0) + 1
+        counts["reassigned"] += 1
+        yield _operation("~", key, row, old=changed)
+    for old_row in remaining[len(added):]:
+        counts["removed"] += 1
+        yield _operation("-", key, old_row)
+    for row in added[len(remaining):]:
+        counts["added"] += 1
+        yield _operation("+", key, row)
+
+
+def diff_operations(old_conn: sqlite3.Connection, new_conn: sqlite3.Connection, counts: dict, fields: dict, old_digest=None, new_digest=None):
+    """Merge-joins the sorted ranges of both databases, yields the operations turning old into new."""
+    old_groups = read_groups(old_conn, old_digest)
+    new_groups = read_groups(new_conn, new_digest)
+    old = next(old_groups, None)
+    new = next(new_groups, None)
+    while old is not None and new is not None:
+        if old[0] == new[0]:
+            yield from _diff_group(new[0], old[1], new[1], counts, fields)
+            old = next(old_groups, None)
+            new = next(new_groups, None)
+        elif old[0] < new[0]:
+            for row in old[1]:
+                counts["removed"] += 1
+                yield _operation("-", old[0], row)
+            old = next(old_groups, None)
+        else:
+            for row in new[1]:
+                counts["added"] += 1
+                yield _operation("+", new[0], row)
+            new = next(new_groups, None)
+    # The ranges past the end of the other release
+    while old is not None:
+        for row in old[1]:
+            counts["removed"] += 1
+            yield _operation("-", old[0], row)
+        old = next(old_groups, None)
+    while new is not None:
+        for row in new[1]:
+            counts["added"] += 1
+            yield _operation("+", new[0], row)
+        new = next(new_groups, None)
+
+
+def _metadata(conn: sqlite3.Connection) -> dict:
+    if not _has_table(conn, METADATA_TABLE):
+        return {}
+    return dict(conn.execute(f"SELECT key, value FROM {METADATA_TABLE}"))
+
+
+def diff_databases(old_db: str, new_db: str, output_path: str) -> dict:
+    """
+    Writes the changeset turning the `old_db` release into `new_db` to
+    `output_path`, gzip compressed JSON lines:
+
+    - a header with the format and the import metadata of the new release
+    - one operation per changed row: "+" (added), "-" (removed) or "~" (same
+      range, other values: "row" has the new values, "old" the previous values
+      of the changed columns), with the range as first_ip_int/last_ip_int
+    - a footer with the counts and the digests of both releases (database_digest)
+
+    Both tables are read once, sorted by range, so the memory use doesn't depend
+    on their size. Returns the footer.
+    """
+    old_conn = _connect(old_db)
+    new_conn = _connect(new_db)
+    counts = {"added": 0, "removed": 0, "reassigned": 0, "unchanged": 0}
+    fields = {}
+    old_digest = hashlib.sha256()
+    new_digest = hashlib.sha256()
+    part_path = output_path + ".part"
+    with gzip.open(part_path, "wt", encoding="utf-8") as file:
+        header = {"format": CHANGESET_FORMAT, "version": CHANGESET_VERSION, "metadata": _metadata(new_conn)}
+        file.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for operation in diff_operations(old_conn, new_conn, counts, fields, old_digest, new_digest):
+            file.write(json.dumps(operation, ensure_ascii=False, separators=(",", ":")) + "\n")
+        footer = {
+            "op": "end",
+            "counts": counts,
+            "changed_columns": dict(sorted(fields.items())),
+            "old_digest": old_digest.hexdigest(),
+            "new_digest": new_digest.hexdigest(),
+        }
+        file.write(json.dumps(footer) + "\n")
+    old_conn.close()
+    new_conn.close()
+    os.replace(part_path, output_path)
+    return footer
+
+
+def read_changeset(path: str) -> Iterator[dict]:
+    """The header, the operations and the footer of a changeset, one at a time."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            yield json.loads(line)
+
+
+def _envelope(path: str) -> Tuple[dict, dict]:
+    header = footer = None
+    for line in read_changeset(path):
+        if header is None:
+            header = line
+        footer = line
+    if not header or header.get("format") != CHANGESET_FORMAT or header.get("version") != CHANGESET_VERSION:
+        raise ValueError(f"{path} is not a changeset of version {CHANGESET_VERSION}")
+    if footer.get("op") != "end":
+        raise ValueError(f"{path} is truncated")
+    return header, footer
+
+
+def apply_changeset(db_name: str, changeset_path: str, verify: bool = True) -> dict:
+    """
+    Patches `db_name` in place with a changeset of diff_databases, in a single
+    transaction. With `verify` the database must be the old release of the
+    changeset and the result is checked against the new one (a full read of the
+    table before and after). Any mismatch or missing row rolls everything back
+    with a ValueError. The fingerprints of the incremental import and the import
+    metadata follow the new release, ip_ranges_flat is built again if present.
+    Returns the counts of the changeset.
+    """
+    header, footer = _envelope(changeset_path)
+    conn = _connect(db_name)
+    try:
+        if verify and database_digest(conn) != footer["old_digest"]:
+            raise ValueError(f"{db_name} is not the release this changeset applies to")
+        has_fingerprints = _has_table(conn, FINGERPRINTS_TABLE)
+        next_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM ip_data").fetchone()[0]
+        c = conn.cursor()
+        for operation in read_changeset(changeset_path):
+            op = operation.get("op")
+            if op not in ("+", "-", "~"):
+                continue
+            ip_version = operation["ip_version"]
+            key = (ip_version, ip_int_to_db(operation["first_ip_int"], ip_version), ip_int_to_db(operation["last_ip_int"], ip_version))
+            row = operation["row"]
+            values = [row[column] for column in ROW_COLUMNS]
+            if op == "+":
+                row_id = next_id
+                next_id += 1
+                c.execute(INSERT_ROW_QUERY, (row_id, *key, *values))
+            else:
+                old = {**row, **operation.get("old", {})}
+                found = c.execute(FIND_ROW_QUERY, (*key, *(old[column] for column in ROW_COLUMNS))).fetchone()
+                if found is None:
+                    raise ValueError(f"The changeset doesn't apply to {db_name}, row not found: {operation}")
+                row_id = found[0]
+                if op == "-":
+                    c.execute("DELETE FROM ip_data WHERE id = ?", (row_id,))
+                    if has_fingerprints:
+                        c.execute(f"DELETE FROM {FINGERPRINTS_TABLE} WHERE ip_data_id = ?", (row_id,))
+                    continue
+                c.execute(UPDATE_ROW_QUERY, (*values, row_id))
+            if has_fingerprints and "registry" in operation:
+                c.execute(INSERT_FINGERPRINT_QUERY, (row_id, operation["registry"], operation["fingerprint"]))
+        for name, value in header["metadata"].items():
+            set_metadata(conn, name, value)
+        if verify and database_digest(conn) != footer["new_digest"]:
+            raise ValueError(f"{db_name} doesn't match the new release after applying the changeset")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if _flat_table_exists(db_name):
+        build_flat_table(db_name)
+    return footer["counts"]
+
+
+def _flat_table_exists(db_name: str) -> bool:
+    conn = sqlite3.connect(db_name)
+    found = _has_table(conn, FLAT_TABLE)
+    conn.close()
+    return found
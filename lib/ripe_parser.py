@@ -1,7 +1,24 @@
-import ipaddress
-import json
-import re
-from typing import Callable
+import io
+from typing import Callable, Optional
+
+from lib.block import Block
+from lib.dump_io import open_dump
+from lib.ip_math import (
+    IPV4_BITS,
+    IPV6_BITS,
+    format_ipv4,
+    format_ipv6,
+    format_ipv6_exploded,
+    parse_ipv4,
+    parse_ipv6,
+    parse_network,
+    range_prefix_length,
+)
+from lib.json_stream import iter_json_array
+from lib.rpsl_reader import read_rpsl_objects
+
+# Attributes of the RPSL objects used by format_block ("nettype" only exists in the ARIN bulk format, see parse_arin_file)
+PARSER_ATTRIBUTES = ("inetnum", "inet6num", "netname", "country", "descr", "mnt-by")
 
 
 class RIPE_PARSER:
@@ -12,124 +29,138 @@ class RIPE_PARSER:
     def get_ip_v6_first_and_last_ip(sub_net_or_range):
  
         if "/" in sub_net_or_range:  # Formato IP/Subnet
-            ip, subnet = sub_net_or_range.split("/", 1)
-            first_ip = ipaddress.IPv6Address(ip)
-            last_ip = first_ip + (2 ** (128 - int(subnet)) - 1)
+            first_ip, last_ip, subnet = parse_network(sub_net_or_range.strip(), 6)
         elif " - " in sub_net_or_range:  # Formato FirstIp - LastIp
             first_ip_str, last_ip_str = map(str.strip, sub_net_or_range.split("-", 1))
-            first_ip = ipaddress.IPv6Address(first_ip_str)
-            last_ip = ipaddress.IPv6Address(last_ip_str)
-            subnet = None  # Subnet non applicabile in questo formato
+            first_ip = parse_ipv6(first_ip_str)
+            last_ip = parse_ipv6(last_ip_str)
+            if first_ip is None or last_ip is None:
+                raise ValueError(f"Invalid IPv6 range {sub_net_or_range!r}")
+            # Prefix length of the range, or of the largest network of its CIDR cover
+            subnet = range_prefix_length(first_ip, last_ip, IPV6_BITS)
         else:
             raise ValueError("Formato non riconosciuto. Usa 'IP/Subnet' o 'FirstIp - LastIp'.")
 
         return (
-            first_ip.exploded,  # Primo indirizzo in forma completa
-            last_ip.exploded,   # Ultimo indirizzo in forma completa
-            str(first_ip),      # Primo indirizzo in forma compressa
-            int(first_ip),      # Primo indirizzo come intero
-            int(last_ip),       # Ultimo indirizzo come intero
-            subnet              # Subnet o None
+            format_ipv6_exploded(first_ip),  # Primo indirizzo in forma completa
+            format_ipv6_exploded(last_ip),   # Ultimo indirizzo in forma completa
+            format_ipv6(first_ip),           # Primo indirizzo in forma compressa
+            first_ip,                        # Primo indirizzo come intero
+            last_ip,                         # Ultimo indirizzo come intero
+            subnet                           # Subnet
         )
 
-    def format_block(block):
-        new_block = {}
-        if block.get("ipVersion",4) == 6:
-            first_ip,last_ip,prefex,first_ip_int,last_ip_int,subnet  = RIPE_PARSER.get_ip_v6_first_and_last_ip(block["inetnum"])
-            new_block["first_ip"] = first_ip
-            new_block["last_ip"] = last_ip
-            new_block["network_prefix"] = prefex
-            new_block["first_ip_int"] = first_ip_int
-            new_block["last_ip_int"] = last_ip_int
-            new_block["subnet"] = subnet
+    def get_ip_v4_first_and_last_ip(inetnum):
+        """(first_ip_int, last_ip_int, subnet) of a "first - last" range or of a network, abbreviated or not ("5.183.80/22")."""
+        if " - " in inetnum:
+            first_ip_str, last_ip_str = map(str.strip, inetnum.split(" - ", 1))
+            first_ip = parse_ipv4(first_ip_str)
+            last_ip = parse_ipv4(last_ip_str)
+            if first_ip is None or last_ip is None:
+                raise ValueError(f"inetnum IS NOT STANDARD {inetnum}")
+            return first_ip, last_ip, range_prefix_length(first_ip, last_ip, IPV4_BITS)
+        if "/" in inetnum:
+            try:
+                return parse_network(inetnum.strip(), 4)
+            except ValueError:
+                raise ValueError(f"inetnum IS NOT STANDARD {inetnum}") from None
+        raise ValueError(f"inetnum IS NOT STANDARD {inetnum}")
+
+    def build_block(inetnum, ip_version=4, netname="Unknown", country="Unknown", descr="Unknown", mnt_by="Unknown", nettype="Unknown") -> Block:
+        """The Block of an inetnum/inet6num value and its attributes, emitted by the parsers."""
+        if ip_version == 6:
+            first_ip, last_ip, prefix, first_ip_int, last_ip_int, subnet = RIPE_PARSER.get_ip_v6_first_and_last_ip(inetnum)
         else:
-            cidr_pattern = r"^\d{1,3}(\.\d{1,3}){1,3}\/\d{1,2}$"
-            if "inetnum" in block:
-                if " - " in block["inetnum"]:  
-                    inetnum_splited = block["inetnum"].split(" - ")
-                    new_block["first_ip"] = inetnum_splited[0].strip()
-                    new_block["last_ip"] = inetnum_splited[1].strip() if len(inetnum_splited) > 1 else inetnum_splited[0].strip()
-                elif re.match(cidr_pattern, block["inetnum"]):  
-                   
-                    # inetnum 5.183.80/22
-                    
-                    [cidr,netmusk] = block["inetnum"].split("/")
-                    cidr_parts = cidr.split(".")
-                    while len(cidr_parts) < 4:
-                        cidr_parts.append("0")
+            first_ip_int, last_ip_int, subnet = RIPE_PARSER.get_ip_v4_first_and_last_ip(inetnum)
+            first_ip = format_ipv4(first_ip_int)
+            last_ip = format_ipv4(last_ip_int)
+            prefix = None
+        return Block(first_ip, last_ip, first_ip_int, last_ip_int, ip_version, subnet, prefix, netname, country, descr, mnt_by, nettype)
 
-                    cidr = ".".join(cidr_parts)
-                    
-                    ip_network = ipaddress.ip_network(f"{cidr}/{netmusk}", strict=False)
-                    new_block["first_ip"] = str(ip_network.network_address)
-                    new_block["last_ip"] = str(ip_network.broadcast_address)
-                else:
-                    raise ValueError(f"inetnum IS NOT STANDARD {block['inetnum']}")
-            else:
-                raise KeyError("Il blocco non contiene 'inetnum'.")
-            
-            firstIp = ipaddress.ip_address(new_block["first_ip"])
-            lastIp = ipaddress.ip_address(new_block["last_ip"])
-            new_block["first_ip_int"] = int(firstIp)
-            new_block["last_ip_int"] = int(lastIp)
-        new_block["netname"] = block.get("netname", "Unknown")
-        new_block["country"] = block.get("country", "Unknown")
-        new_block["descr"] = block.get("descr", "Unknown")
-        new_block["mnt-by"] = block.get("mnt-by", "Unknown")
-        new_block["ip_version"] = block.get("ipVersion", 4)
-        new_block["nettype"] = block.get("nettype", "Unknown")
-        
-        return new_block
+    def format_block(block):
+        """
+        Formats a dict of raw attributes ("inetnum", "ipVersion", "netname", ...) in a
+        dict block, kept for compatibility: the parsers emit Block tuples (build_block).
+        """
+        if "inetnum" not in block:
+            raise KeyError("Il blocco non contiene 'inetnum'.")
+        return RIPE_PARSER.build_block(
+            block["inetnum"],
+            block.get("ipVersion", 4),
+            block.get("netname", "Unknown"),
+            block.get("country", "Unknown"),
+            block.get("descr", "Unknown"),
+            block.get("mnt-by", "Unknown"),
+            block.get("nettype", "Unknown"),
+        ).to_dict()
     @staticmethod
     def normalize_ip(ip):
-        try:
-            return str(ipaddress.ip_address(".".join(str(int(octet)) for octet in ip.split("."))))
-        except ValueError:
-            return None
-    def parse_transfer_json_file(file_path,cb:Callable[[dict],None]):
-
-        with open(file_path, "r") as f:
-            arin_data = json.load(f)
-
-
-        for block in arin_data["transfers"]:
-            if not block.get("ip4nets"):
-                print(f"Skipping block because it has no ip4nets")
+        value = parse_ipv4(ip)
+        return None if value is None else format_ipv4(value)
+    def parse_transfer_json_file(file_path,cb:Callable[[Block],None]):
+        """
+        Calls `cb` with a block for every IPv4 (ip4nets) and IPv6 (ip6nets) net of
+        the ARIN transfers JSON. The transfers array is streamed one transfer at a
+        time (lib.json_stream.iter_json_array), memory doesn't grow with the file,
+        and the addresses are converted to integers directly.
+        """
+        for block in iter_json_array(file_path, "transfers"):
+            if not block.get("ip4nets") and not block.get("ip6nets"):
+                print(f"Skipping block because it has no ip4nets or ip6nets")
                 continue
 
             if not block.get("recipient_organization"):
                 print(f"Skipping block because it has no recipient_organization")
                 continue
 
-            for net in block["ip4nets"].get("transfer_set", []):
-                new_block = {}
-                raw_first_ip = net.get("start_address", "Unknown")
-                raw_last_ip = net.get("end_address", "Unknown")
+            for ip_version, nets_key in ((4, "ip4nets"), (6, "ip6nets")):
+                if not block.get(nets_key):
+                    continue
+                for net in block[nets_key].get("transfer_set", []):
+                    raw_first_ip = net.get("start_address", "Unknown")
+                    raw_last_ip = net.get("end_address", "Unknown")
 
-                new_block["first_ip"] = RIPE_PARSER.normalize_ip(raw_first_ip)
-                new_block["last_ip"] = RIPE_PARSER.normalize_ip(raw_last_ip)
+                    if ip_version == 4:
+                        first_ip_int = parse_ipv4(raw_first_ip)
+                        last_ip_int = parse_ipv4(raw_last_ip)
+                    else:
+                        first_ip_int = parse_ipv6(raw_first_ip)
+                        last_ip_int = parse_ipv6(raw_last_ip)
 
-                if not new_block["first_ip"] or not new_block["last_ip"]:
-                    print(f"Invalid IP addresses in block: {new_block}")
-                    continue
+                    if first_ip_int is None or last_ip_int is None:
+                        print(f"Invalid IP addresses in block: {net}")
+                        continue
 
-                first_ip = ipaddress.ip_address(new_block["first_ip"])
-                last_ip = ipaddress.ip_address(new_block["last_ip"])
-                new_block["first_ip_int"] = int(first_ip)
-                new_block["last_ip_int"] = int(last_ip)
+                    if ip_version == 4:
+                        # The subnet is computed by SQLiteHandler.block_to_row
+                        first_ip, last_ip, prefix, subnet = format_ipv4(first_ip_int), format_ipv4(last_ip_int), None, None
+                    else:
+                        # Same columns as the inet6num blocks of build_block
+                        first_ip = format_ipv6_exploded(first_ip_int)
+                        last_ip = format_ipv6_exploded(last_ip_int)
+                        prefix = format_ipv6(first_ip_int)
+                        subnet = range_prefix_length(first_ip_int, last_ip_int, IPV6_BITS)
 
-                new_block["netname"] = block["recipient_organization"].get("name", "Unknown")
-                new_block["country"] = block["recipient_organization"].get("country_code", "Unknown")
-                new_block["descr"] = block.get("description", "Unknown")
-                new_block["mnt-by"] = block.get("mnt-by", "Unknown")
-                new_block["ip_version"] = 4
-                cb(new_block)
+                    cb(Block(
+                        first_ip,
+                        last_ip,
+                        first_ip_int,
+                        last_ip_int,
+                        ip_version,
+                        subnet,
+                        prefix,
+                        block["recipient_organization"].get("name", "Unknown"),
+                        block["recipient_organization"].get("country_code", "Unknown"),
+                        block.get("description", "Unknown"),
+                        block.get("mnt-by", "Unknown"),
+                    ))
 
 
-    def parse_arin_file(file_path, cb: Callable[[dict], None]):
+    def parse_arin_file(file_path, cb: Callable[[Block], None]):
         """
         Legge un file di blocchi riga per riga, analizza i dati e chiama il callback `cb` 
-        con il blocco formattato compatibile con RIPE_PARSER.format_block.
+        con il Block formattato (vedi RIPE_PARSER.build_block).
+        Accetta anche file compressi (.gz, .bz2, .zst).
         """
         block_lines = []
         
@@ -166,23 +197,18 @@ class RIPE_PARSER:
                 print(f"Skipping block because it has no nethandle or v6nethandle")
                 return
 
-            formatted_block = {
-                "ipVersion": ip_version,
-                "inetnum": parsed_block["netrange"].lower(),  # Sempre lowercase
-                "netname": parsed_block.get("netname", "Unknown"),
-                "descr": "\n".join(parsed_block.get("comment", [])),
-                "country": parsed_block.get("country", "Unknown"),
-                "mnt-by": parsed_block.get("mnt-by", "Unknown"),
-                "regdate": parsed_block.get("regdate", "Unknown"),
-                "updated": parsed_block.get("updated", "Unknown"),
-                "source": parsed_block.get("source", "Unknown"),
-                "nettype": parsed_block.get("nettype", "Unknown"),
-            }
-
             # Chiama il callback con il blocco formattato
-            cb(RIPE_PARSER.format_block(formatted_block))
+            cb(RIPE_PARSER.build_block(
+                parsed_block["netrange"].lower(),  # Sempre lowercase
+                ip_version,
+                parsed_block.get("netname", "Unknown"),
+                parsed_block.get("country", "Unknown"),
+                "\n".join(parsed_block.get("comment", [])),
+                parsed_block.get("mnt-by", "Unknown"),
+                parsed_block.get("nettype", "Unknown"),
+            ))
 
-        with open(file_path, 'r') as file:
+        with io.TextIOWrapper(open_dump(file_path)) as file:
             for line in file:
                 line = line.strip()
                 if line == "":
@@ -197,52 +223,35 @@ class RIPE_PARSER:
 
 
     
-    def parse_file(file_path,cb:Callable[[dict],None], parseRoute:bool=False, arinDb:bool=False):
-        data = []
-        with open(file_path, 'r',-1,"latin-1") as file:
-            block = {}
-            for line in file:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if parseRoute and (line.startswith("route:") or line.startswith("route6:") ) :
-                    key, value = line.split(":", 1)
-                    line = f"inetnum:{value}" if key == "route" else f"inet6num:{value}" if key == "route6" else line
-                    
-                if arinDb and (line.startswith("NetHandle:") or line.startswith("V6NetHandle:") ) :
-                    key, value = line.split(":", 1)
-                    line = f"inetnum:{value}" if key == "NetHandle" else f"inet6num:{value}" if key == "V6NetHandle" else line
-                    
-                    
-                if line.startswith("inetnum:") or line.startswith("inet6num:"):
-                    if block:
-                        # data.append(RIPE_PARSER.format_block(block))
-                        if "inet6num" in block or "inetnum" in block:
-                            cb(RIPE_PARSER.format_block(block))
-                        else:
-                            print(f"Invalid block {block}")
-                        block = {}
-                    if line.startswith("inet6num:"):
-                        block["inetnum"] = line[8:]
-                if line and line.find(":") >= 0:
-                    key, value = line.split(":", 1)
-                    if key == "inet6num":
-                        block["inetnum"] = value.strip()
-                        block["ipVersion"] = 6
-                        continue
-                    elif key == "inetnum":
-                        block["inetnum"] = value.strip()
-                        block["ipVersion"] = 4
-                        continue
-                    
-                    #Note : This block is to avoid overwrite the information like mnt-by 
-                    if key in block:
-                        if key == "descr":
-                            block[key.strip()] += "\n" + value.strip()
-                    else:
-                        block[key.strip()] = value.strip()
-            if block:  
-                cb(RIPE_PARSER.format_block(block))
-                # data.append(RIPE_PARSER.format_block(block))
-        return data
-    
\ No newline at end of file
+    def parse_file(file_path,cb:Callable[[Block],None], parseRoute:bool=False, arinDb:bool=False, start:int=0, end:Optional[int]=None):
+        """
+        Parses the objects of `file_path` and calls `cb` with every formatted block.
+        `start`/`end` restrict the parsing to a byte range of the file, they must be
+        aligned on the first line of an object (see lib.shard_splitter.split_file).
+        Compressed dumps (.gz, .bz2, .zst) are read directly and can't be split in byte ranges.
+        """
+        aliases = {}
+        if parseRoute:
+            aliases.update({"route": "inetnum", "route6": "inet6num"})
+        if arinDb:
+            aliases.update({"NetHandle": "inetnum", "V6NetHandle": "inet6num"})
+
+        build_block = RIPE_PARSER.build_block
+        for inetnum, inet6num, netname, country, descr, mnt_by in read_rpsl_objects(
+            file_path, PARSER_ATTRIBUTES, aliases=aliases, start=start, end=end
+        ):
+            if inet6num is not None:
+                inetnum, ip_version = inet6num, 6
+            elif inetnum is not None:
+                ip_version = 4
+            else:
+                continue
+            cb(build_block(
+                inetnum,
+                ip_version,
+                "Unknown" if netname is None else netname,
+                "Unknown" if country is None else country,
+                "Unknown" if descr is None else descr,
+                "Unknown" if mnt_by is None else mnt_by,
+            ))
+        return []
@@ -0,0 +1,177 @@
+import re
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from lib.dump_io import is_compressed, open_dump
+
+DEFAULT_ATTRIBUTES = ("inetnum", "inet6num", "netname", "country", "descr", "mnt-by", "status")
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+_CONTINUATION = re.compile(r"\n[ \t+]")
+# Whitespace-only lines separate objects like empty lines, and so do runs of them
+_IRREGULAR_SEPARATOR = re.compile(r"\n(?:[ \t]+(?:\n|\Z)|\n\n)")
+_BLANK_LINE = re.compile(r"^[ \t]+$", re.MULTILINE)
+_EXTRA_NEWLINES = re.compile(r"\n\n\n+")
+
+
+def read_rpsl_objects(
+    file_path: str,
+    attributes: Tuple[str, ...] = DEFAULT_ATTRIBUTES,
+    multi_value: Iterable[str] = ("descr",),
+    aliases: Optional[Dict[str, str]] = None,
+    start: int = 0,
+    end: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[tuple]:
+    """
+    Streams the RPSL objects of `file_path` (objects are separated by empty or
+    whitespace-only lines).
+
+    The file is read in binary chunks of `chunk_size` bytes and only the requested
+    `attributes` are extracted: every object is yielded as a tuple with one value
+    per attribute, in the same order, None when the attribute is missing.
+    Repeated attributes keep their first value, except the `multi_value` ones whose
+    values are joined with "\\n". Continuation lines (starting with a space, a tab
+    or "+") are appended to the value of the attribute they continue.
+    `aliases` maps other attribute names to one of `attributes`
+    (e.g. {"route": "inetnum"}). `start`/`end` limit the reading to a byte range,
+    which must be aligned on object boundaries. Values are decoded as latin-1.
+    `.gz`, `.bz2` and `.zst` files are decompressed on the fly (see lib.dump_io.open_dump),
+    they can only be read whole.
+    Objects without any of the requested attributes are skipped.
+    """
+    keys = set(attributes) | set(aliases or {})
+    names_by_attribute = {name: [name] for name in attributes}
+    for alias, name in (aliases or {}).items():
+        names_by_attribute[name].append(alias)
+    # Attributes are only recognised at the start of a line, the object text is
+    # searched for "\n<name>:" which is done by str.find at C speed
+    markers = [
+        (
+            "\n" + name + ":",
+            len(name) + 2,
+            name in multi_value,
+            tuple("\n" + alias + ":" for alias in names_by_attribute[name][1:]),
+        )
+        for name in attributes
+    ]
+
+    if (start or end is not None) and is_compressed(file_path):
+        raise ValueError(f"Byte ranges can't be read from the compressed file {file_path}")
+
+    with open_dump(file_path) as file:
+        if start:
+            file.seek(start)
+        remaining = None if end is None else end - start
+        pending = b""
+        while True:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = file.read(size) if size > 0 else b""
+            if remaining is not None:
+                remaining -= len(chunk)
+
+            if chunk:
+                data = pending + chunk
+                # Replaced after joining the chunks, a "\r\n" can be split between two of them
+                if b"\r" in data:
+                    data = data.replace(b"\r\n", b"\n")
+                cut = data.rfind(b"\n\n")
+                if cut < 0:
+                    pending = data
+                    continue
+                text = data[:cut].decode("latin-1")
+                pending = data[cut + 2:]
+            else:
+                text = pending.decode("latin-1")
+
+            # Objects separated by exactly "\n\n", so the offsets of _continued_objects match the split
+            if _IRREGULAR_SEPARATOR.search(text):
+                text = _EXTRA_NEWLINES.sub("\n\n", _BLANK_LINE.sub("", text))
+            continued = _continued_objects(text)
+            offset = 0
+            for text in text.split("\n\n"):
+                if continued:
+                    object_offset = offset
+                    offset += len(text) + 2
+                    if object_offset in continued:
+                        record = _read_lines(text, attributes, names_by_attribute, multi_value)
+                        if record is not None:
+                            yield record
+                        continue
+
+                # Leading/trailing newlines: every attribute line starts after and ends with a "\n"
+                text = f"\n{text}\n"
+                values = []
+                append = values.append
+                found = False
+                find = text.find
+                for marker, size, multi, alias_markers in markers:
+                    position = find(marker)
+                    if position < 0:
+                        for marker in alias_markers:
+                            position = find(marker)
+                            if position >= 0:
+                                size = len(marker)
+                                break
+                        else:
+                            append(None)
+                            continue
+                    position += size
+                    line_end = find("\n", position)
+                    value = text[position:line_end].strip()
+                    while multi:
+                        position = find(marker, line_end)
+                        if position < 0:
+                            break
+                        position += size
+                        line_end = find("\n", position)
+                        value += "\n" + text[position:line_end].strip()
+                    append(value)
+                    found = True
+                if found:
+                    yield tuple(values)
+
+            if not chunk:
+                break
+
+
+def _continued_objects(text: str) -> set:
+    """Offsets (in `text`) of the objects that contain continuation lines."""
+    offsets = set()
+    for match in _CONTINUATION.finditer(text):
+        start = text.rfind("\n\n", 0, match.start())
+        offsets.add(start + 2 if start >= 0 else 0)
+    return offsets
+
+
+def _read_lines(text: str, attributes: tuple, names_by_attribute: dict, multi_value) -> Optional[tuple]:
+    """Line by line parsing of an object with continuation lines (starting with a space, a tab or "+")."""
+    attribute_of = {key: name for name, keys in names_by_attribute.items() for key in keys}
+    values = {}
+    current = None
+    for line in text.split("\n"):
+        if not line:
+            continue
+        first = line[0]
+        if first == " " or first == "\t" or first == "+":
+            if current is not None:
+                line = line[1:].strip()
+                if line:
+                    values[current] = f"{values[current]} {line}" if values[current] else line
+            continue
+        if first == "#" or first == "%":
+            continue
+        key, colon, value = line.partition(":")
+        name = attribute_of.get(key) if colon else None
+        if name is None:
+            current = None
+        elif name not in values:
+            values[name] = value.strip()
+            current = name
+        elif name in multi_value:
+            values[name] += "\n" + value.strip()
+            current = name
+        else:
+            current = None
+    if not values:
+        return None
+    return tuple(values.get(name) for name in attributes)
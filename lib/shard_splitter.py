@@ -0,0 +1,65 @@
+import mmap
+import os
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+from lib.dump_io import is_compressed
+
+DEFAULT_SHARD_SIZE = 64 * 1024 * 1024
+
+# A blank line, the next object starts right after it ("\r\n" dumps are read with "\n" line ends)
+_OBJECT_SEPARATOR = re.compile(rb"\n\r?\n")
+
+
+class Shard(NamedTuple):
+    """
+    A byte range of an RPSL dump that starts and ends on object boundaries, it is
+    parsed with RIPE_PARSER.parse_file(file_path, cb, start=start, end=end).
+    `end` is None for a compressed dump, which can only be read whole.
+    """
+
+    file_path: str
+    start: int
+    end: Optional[int]
+
+    def size(self) -> int:
+        return (os.path.getsize(self.file_path) if self.end is None else self.end) - self.start
+
+    def parse_kwargs(self) -> dict:
+        return {} if self.end is None else {"start": self.start, "end": self.end}
+
+
+def find_object_offsets(file_path: str, shards: int) -> List[Tuple[int, int]]:
+    """
+    Splits `file_path` in at most `shards` byte ranges of similar size. Every range
+    but the first starts right after a blank line, so no object is cut in two and
+    parsing the ranges separately gives the same blocks as parsing the whole file.
+    The file is memory mapped and the separators are searched around the targets,
+    nothing is read or copied but the pages around them.
+    """
+    size = os.path.getsize(file_path)
+    if shards <= 1 or size == 0:
+        return [(0, size)]
+
+    offsets = [0]
+    with open(file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for i in range(1, shards):
+            target = max(size * i // shards, offsets[-1] + 1)
+            match = _OBJECT_SEPARATOR.search(data, target - 1)
+            if match is None or match.end() >= size:
+                break
+            offsets.append(match.end())
+    offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+
+def split_file(file_path: str, shards: Optional[int] = None, shard_size: int = DEFAULT_SHARD_SIZE) -> List[Shard]:
+    """
+    Shard descriptors of an RPSL dump: `shards` ranges, or ranges of about
+    `shard_size` bytes when `shards` isn't given. Compressed dumps are one shard.
+    """
+    if is_compressed(file_path):
+        return [Shard(file_path, 0, None)]
+    if shards is None:
+        shards = max(1, -(-os.path.getsize(file_path) // shard_size))
+    return [Shard(file_path, start, end) for start, end in find_object_offsets(file_path, shards)]
@@ -0,0 +1,25 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.range_index import build_range_index
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Export the most specific ranges of the database as a memory mapped binary range index")
+    arg_parser.add_argument("--db", default=str(path_root / "geolocation_db.db"), help="Generated SQLite database")
+    arg_parser.add_argument("--output", default=str(path_root / "output" / "ip_ranges.idx"), help="Range index file to write")
+    arg_parser.add_argument("--flat", action="store_true", help="Export the intervals of the flattened table (sqllite_importer.py --flatten)")
+    args = arg_parser.parse_args()
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    start = time.time()
+    stats = build_range_index(args.db, args.output, flat_table=args.flat)
+    print(
+        f"Wrote {args.output} in {time.time() - start:.2f}s: {stats['v4_intervals']} IPv4 and "
+        f"{stats['v6_intervals']} IPv6 intervals, {stats['records']} records, {stats['strings']} strings"
+    )
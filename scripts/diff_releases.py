@@ -0,0 +1,34 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.release_diff import apply_changeset, diff_databases
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compute the changes between two releases of the geolocation database, or apply them to the older one")
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+    diff_parser = commands.add_parser("diff", help="Write the changeset turning OLD into NEW")
+    diff_parser.add_argument("old", help="Database of the previous release")
+    diff_parser.add_argument("new", help="Database of the new release")
+    diff_parser.add_argument("-o", "--output", default="changes.jsonl.gz", help="Changeset file (gzip compressed JSON lines)")
+    apply_parser = commands.add_parser("apply", help="Update DB in place with a changeset")
+    apply_parser.add_argument("db", help="Database of the release the changeset was computed from")
+    apply_parser.add_argument("changeset", help="Changeset written by the diff command")
+    apply_parser.add_argument("--no-verify", action="store_true", help="Skip the digest checks of the database before and after the changes")
+    args = arg_parser.parse_args()
+
+    start = time.time()
+    if args.command == "diff":
+        summary = diff_databases(args.old, args.new, args.output)
+        print(json.dumps(summary, indent=2))
+        print(f"Changeset written to {args.output} in {time.time() - start:.1f}s")
+    else:
+        counts = apply_changeset(args.db, args.changeset, verify=not args.no_verify)
+        print(json.dumps(counts, indent=2))
+        print(f"{args.db} updated in {time.time() - start:.1f}s")
@@ -0,0 +1,38 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.downloader import DEFAULT_CONCURRENCY, GEOLITE_SOURCES, REGISTRY_SOURCES, download_sources
+
+SOURCE_GROUPS = {
+    "registries": (REGISTRY_SOURCES, path_root / "db"),
+    "geolite": (GEOLITE_SOURCES, path_root / "db" / "base_mmdb"),
+}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Download the registry dumps and the GeoLite2 databases concurrently, unchanged files are skipped")
+    arg_parser.add_argument("--sources", default="registries", help=f"Comma separated groups, any of {','.join(SOURCE_GROUPS)}")
+    arg_parser.add_argument("--destination", help="Destination folder, by default db/ for the registries and db/base_mmdb/ for GeoLite2")
+    arg_parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Files downloaded at the same time")
+    arg_parser.add_argument("--force", action="store_true", help="Download the files even if they didn't change")
+    arg_parser.add_argument("--decompress", action="store_true", help="Decompress the .gz dumps while they are downloaded")
+    args = arg_parser.parse_args()
+
+    start = time.time()
+    failed = 0
+    for group in args.sources.split(","):
+        if group.strip() not in SOURCE_GROUPS:
+            raise SystemExit(f"Unknown sources {group}, use any of {','.join(SOURCE_GROUPS)}")
+        sources, destination = SOURCE_GROUPS[group.strip()]
+        results = download_sources(
+            sources, args.destination or str(destination), concurrency=args.concurrency, force=args.force, decompress=args.decompress
+        )
+        failed += sum(1 for result in results if result.status == "failed")
+    print(f"Done in {time.time() - start:.1f}s")
+    if failed:
+        sys.exit(1)
@@ -1,12 +1,3 @@
 #!/bin/sh
-set -e
-
-ASN_URL=https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-ASN.mmdb
-COUNTRY_URL=https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-Country.mmdb
-CITY_URL=https://github.com/P3TERX/GeoLite.mmdb/raw/download/GeoLite2-City.mmdb
-
-
-destination="db/base_mmdb"
-wget -P $destination -N $ASN_URL
-wget -P $destination -N $COUNTRY_URL
-wget -P $destination -N $CITY_URL
+# The GeoLite2 databases are downloaded concurrently by scripts/download_dumps.py, unchanged files are skipped
+exec python3 "$(dirname "$0")/download_dumps.py" --sources geolite "$@"
@@ -0,0 +1,81 @@
+import argparse
+import csv
+import sys
+from itertools import islice
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.lookup import STRING_FIELDS, IPLookup
+
+
+def read_chunks(reader, chunk_size):
+    while True:
+        chunk = list(islice(reader, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def enrich_lines(ip_lookup, input_file, output_file, fields, chunk_size):
+    writer = csv.writer(output_file)
+    writer.writerow(["ip", *fields])
+    lines = (line.strip() for line in input_file)
+    for chunk in read_chunks((line for line in lines if line), chunk_size):
+        result = ip_lookup.lookup_many(chunk)
+        columns = [result.values(field) for field in fields]
+        writer.writerows(zip(chunk, *columns))
+
+
+def enrich_csv(ip_lookup, input_file, output_file, fields, chunk_size, column):
+    reader = csv.reader(input_file)
+    writer = csv.writer(output_file)
+    header = next(reader, None)
+    if header is None:
+        return
+    if column.isdigit():
+        column_index = int(column)
+    elif column in header:
+        column_index = header.index(column)
+    else:
+        raise SystemExit(f"Column {column} not found in the CSV header {header}")
+    writer.writerow([*header, *fields])
+
+    for chunk in read_chunks(reader, chunk_size):
+        result = ip_lookup.lookup_many([row[column_index] if len(row) > column_index else "" for row in chunk])
+        columns = [result.values(field) for field in fields]
+        writer.writerows([*row, *values] for row, *values in zip(chunk, *columns))
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Annotate a CSV or a newline delimited list of IPs with the ip_data fields")
+    arg_parser.add_argument("input", help="Input file, - for stdin")
+    arg_parser.add_argument("--db", default=str(path_root / "geolocation_db.db"), help="Generated SQLite database")
+    arg_parser.add_argument("--output", default="-", help="Output CSV file, - for stdout")
+    arg_parser.add_argument("--format", choices=["csv", "lines"], help="Input format, guessed from the file extension when omitted")
+    arg_parser.add_argument("--column", default="ip", help="Name or index of the CSV column with the addresses")
+    arg_parser.add_argument("--fields", default="netname,country,mnt_by", help=f"Comma separated fields to add, any of {','.join(STRING_FIELDS)}")
+    arg_parser.add_argument("--chunk-size", type=int, default=100000, help="Addresses resolved per vectorized pass")
+    args = arg_parser.parse_args()
+
+    fields = [field.strip() for field in args.fields.split(",") if field.strip()]
+    for field in fields:
+        if field not in STRING_FIELDS:
+            raise SystemExit(f"Unknown field {field}, use one of {','.join(STRING_FIELDS)}")
+    input_format = args.format or ("csv" if args.input.endswith(".csv") else "lines")
+
+    ip_lookup = IPLookup.from_sqlite(args.db)
+
+    input_file = sys.stdin if args.input == "-" else open(args.input, newline="")
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    try:
+        if input_format == "csv":
+            enrich_csv(ip_lookup, input_file, output_file, fields, args.chunk_size, args.column)
+        else:
+            enrich_lines(ip_lookup, input_file, output_file, fields, args.chunk_size)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
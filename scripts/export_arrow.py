@@ -0,0 +1,32 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.arrow_export import DEFAULT_BATCH_ROWS, FORMATS, export_sqlite
+from lib.block_filter import DEFAULT_BLOCK_FILTER, BlockFilter
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Export the ip_data table to Parquet or Arrow files for analytics tools")
+    arg_parser.add_argument("--db", default=str(path_root / "geolocation_db.db"), help="SQLite database built by sqllite_importer.py")
+    arg_parser.add_argument("--output-dir", default=str(path_root / "output"), help="Directory of the ip_data_v4/ip_data_v6 files")
+    arg_parser.add_argument("--format", choices=list(FORMATS), default="parquet",
+                            help="zstd compressed Parquet, or uncompressed Arrow IPC files that can be memory mapped without copies")
+    arg_parser.add_argument("--batch-rows", type=int, default=DEFAULT_BATCH_ROWS, help="Rows per record batch (Parquet row group)")
+    arg_parser.add_argument("--compression", help="Codec overriding the default of the format (zstd, lz4, snappy, none...)")
+    arg_parser.add_argument("--filter", action="store_true", help="Leave out the rows excluded from the MMDB export")
+    arg_parser.add_argument("--filter-config", metavar="PATH", help="JSON file of the rules of --filter (see lib/block_filter.py)")
+    args = arg_parser.parse_args()
+
+    block_filter = None
+    if args.filter or args.filter_config:
+        block_filter = BlockFilter.from_json(args.filter_config) if args.filter_config else DEFAULT_BLOCK_FILTER
+    start = time.time()
+    written = export_sqlite(args.db, args.output_dir, args.format, args.batch_rows, block_filter, args.compression)
+    print(json.dumps(written, indent=2))
+    print(f"Exported to {args.output_dir} in {time.time() - start:.1f}s")
@@ -4,6 +4,7 @@ import (
 	"database/sql"
 	"fmt"
 	"log"
+	"math/big"
 	"net"
 	"os"
 
@@ -28,6 +29,37 @@ type IPData struct {
 	MntBy         sql.NullString
 }
 
+// Righe escluse dall'MMDB quando il database non è stato filtrato durante l'import
+// (sqllite_importer.py --no-filter o database precedenti), le stesse regole di lib/block_filter.py
+const exportFilter = `subnet > 0
+        AND (descr NOT LIKE '%Early registration addresses%'
+            AND netname != 'ERX-NETBLOCK'
+            AND netname != 'SBCIS-SBIS-6BLK'
+            AND descr NOT LIKE '%These addresses have been further assigned to users%'
+            AND descr NOT LIKE 'This IP address range is not registered in the%'
+            AND netname != 'SPECIAL-IPV4-LOCAL-ID-IANA-RESERVED'
+            AND netname != 'IANA-THIS-HOST-ON-THIS-NETWORK'
+            AND netname != 'SHARED-ADDRESS-SPACE-RFC6598-IANA-RESERVED'
+            AND netname != 'SPECIAL-IPV4-BENCHMARK-TESTING-IANA-RESERVED'
+            AND netname != 'LINKLOCAL-RFC3927-IANA-RESERVED'
+            AND netname != 'PRIVATE-ADDRESS-CBLK-RFC1918-IANA-RESERVED'
+            AND netname != 'SPECIAL-IPV4-REGISTRY-IANA-RESERVED'
+            AND netname != '6TO4-RELAY-ANYCAST-IANA-RESERVED'
+            AND netname != 'DS-LITE-RFC-6333-11-IANA-RESERVED'
+        )`
+
+// DEFAULT_BLOCK_FILTER.canonical() di lib/block_filter.py, salvato da record_block_filter
+// quando l'import ha applicato le regole predefinite (verificato da test/test_block_filter.py)
+const defaultFilterRules = `[{"min_prefix":1,"name":"whole-address-space"},{"equals":["ERX-NETBLOCK","SBCIS-SBIS-6BLK"],"field":"netname","name":"erx-netblocks"},{"equals":["SPECIAL-IPV4-LOCAL-ID-IANA-RESERVED","IANA-THIS-HOST-ON-THIS-NETWORK","SHARED-ADDRESS-SPACE-RFC6598-IANA-RESERVED","SPECIAL-IPV4-BENCHMARK-TESTING-IANA-RESERVED","LINKLOCAL-RFC3927-IANA-RESERVED","PRIVATE-ADDRESS-CBLK-RFC1918-IANA-RESERVED","SPECIAL-IPV4-REGISTRY-IANA-RESERVED","6TO4-RELAY-ANYCAST-IANA-RESERVED","DS-LITE-RFC-6333-11-IANA-RESERVED"],"field":"netname","name":"iana-special-purpose"},{"contains":["Early registration addresses"],"field":"descr","name":"early-registrations"},{"contains":["These addresses have been further assigned to users"],"field":"descr","name":"further-assigned"},{"field":"descr","name":"not-registered","startswith":["This IP address range is not registered in the"]},{"contains":["Country is really world wide","Worldwide"],"field":"country","name":"worldwide-country"},{"contains":["Early Registrations"],"field":"nettype","name":"early-registrations-nettype"},{"name":"reserved-ranges","ranges":["0.0.0.0/8","10.0.0.0/8","127.0.0.0/8","169.254.0.0/16","172.16.0.0/12","192.0.0.0/29","192.0.0.170/31","192.0.2.0/24","192.168.0.0/16","198.18.0.0/15","198.51.100.0/24","203.0.113.0/24","240.0.0.0/4","255.255.255.255/32","::/128","::1/128","::ffff:0:0/96","100::/64","2001::/23","2001:db8::/32","fc00::/7","fe80::/10"]}]`
+
+// Vero se l'import ha già escluso i blocchi con le regole predefinite (regole salvate in import_metadata),
+// con regole diverse (--filter-config) o senza regole si applica exportFilter
+func importFiltered(db *sql.DB) bool {
+	var rules sql.NullString
+	err := db.QueryRow("SELECT value FROM import_metadata WHERE key = 'block_filter'").Scan(&rules)
+	return err == nil && rules.Valid && rules.String == defaultFilterRules
+}
+
 func main() {
 	// Apri il database SQLite
 	sqlite_db, err := sql.Open("sqlite3", "../geolocation_db.db")
@@ -60,27 +92,14 @@ func main() {
 	defer city_db.Close()
 
 	// Esegui la query per ottenere i dati IP
-	rows, err := sqlite_db.Query(`
-        SELECT * FROM ip_data 
-        WHERE subnet > 0 
-        AND (descr NOT LIKE '%Early registration addresses%' 
-            AND netname != 'ERX-NETBLOCK' 
-            AND netname != 'SBCIS-SBIS-6BLK' 
-            AND descr NOT LIKE '%These addresses have been further assigned to users%' 
-            AND descr NOT LIKE 'This IP address range is not registered in the%' 
-            AND netname != 'SPECIAL-IPV4-LOCAL-ID-IANA-RESERVED'
-            AND netname != 'IANA-THIS-HOST-ON-THIS-NETWORK'
-            AND netname != 'SHARED-ADDRESS-SPACE-RFC6598-IANA-RESERVED'
-            AND netname != 'SPECIAL-IPV4-BENCHMARK-TESTING-IANA-RESERVED'
-            AND netname != 'LINKLOCAL-RFC3927-IANA-RESERVED'
-            AND netname != 'PRIVATE-ADDRESS-CBLK-RFC1918-IANA-RESERVED'
-            AND netname != 'SPECIAL-IPV4-REGISTRY-IANA-RESERVED'
-            AND netname != '6TO4-RELAY-ANYCAST-IANA-RESERVED'
-            AND netname != 'DS-LITE-RFC-6333-11-IANA-RESERVED'
-        ) 
-        ORDER BY CAST(first_ip_int AS UNSIGNED) ASC, subnet DESC;
-		
-		`)
+	where := ""
+	if !importFiltered(sqlite_db) {
+		where = "WHERE " + exportFilter
+	}
+	rows, err := sqlite_db.Query(fmt.Sprintf(`
+        SELECT * FROM ip_data %s
+        ORDER BY first_ip_int ASC, subnet DESC;
+		`, where))
 	if err != nil {
 		log.Fatal(err)
 	}
@@ -107,16 +126,18 @@ func main() {
 			log.Fatal(err)
 		}
 
-		// Ottieni la rete corretta
-		network, err := getNetworkFromRecord(ipData)
+		// Ottieni le reti dell'intervallo
+		networks, err := getNetworksFromRecord(ipData)
 		if err != nil {
 			log.Fatal(err)
 		}
 
 		// Inserisci il record nel writer MMDB
-		err = writer.Insert(network, record)
-		if err != nil {
-			log.Fatal(err)
+		for _, network := range networks {
+			err = writer.Insert(network, record)
+			if err != nil {
+				log.Fatal(err)
+			}
 		}
 
 		counter++
@@ -209,28 +230,41 @@ func buildMMDBRecord(ipData IPData, asnDB, cityDB *maxminddb.Reader) (mmdbtype.M
 	return record, nil
 }
 
-// getNetworkFromRecord restituisce la rete corretta
-func getNetworkFromRecord(ipData IPData) (*net.IPNet, error) {
-	// Verifica che la subnet mask sia valida
-	if ipData.Subnet < 0 || (ipData.IPVersion == 4 && ipData.Subnet > 32) || (ipData.IPVersion == 6 && ipData.Subnet > 128) {
-		return nil, fmt.Errorf("invalid subnet mask: %d for IP version: %d", ipData.Subnet, ipData.IPVersion)
+// getNetworksFromRecord restituisce le reti che coprono esattamente FirstIP - LastIP, come cidr_cover
+// di lib/ip_math.py: un intervallo che non è una sola rete non si può inserire come FirstIP/Subnet
+func getNetworksFromRecord(ipData IPData) ([]*net.IPNet, error) {
+	first := net.ParseIP(ipData.FirstIP)
+	last := net.ParseIP(ipData.LastIP)
+	if first == nil || last == nil {
+		return nil, fmt.Errorf("invalid IP range: %s - %s", ipData.FirstIP, ipData.LastIP)
 	}
-
-	// Crea la rete utilizzando la subnet mask corretta
-	ip := net.ParseIP(ipData.FirstIP)
-	if ip == nil {
-		return nil, fmt.Errorf("invalid IP address: %s", ipData.FirstIP)
+	bits := 128
+	if ipData.IPVersion == 4 {
+		first, last = first.To4(), last.To4()
+		bits = 32
+		if first == nil || last == nil {
+			return nil, fmt.Errorf("invalid IPv4 range: %s - %s", ipData.FirstIP, ipData.LastIP)
+		}
 	}
 
-	mask := net.CIDRMask(ipData.Subnet, len(ip)*8)
-	if mask == nil {
-		return nil, fmt.Errorf("invalid subnet mask: %d", ipData.Subnet)
+	start := new(big.Int).SetBytes(first)
+	end := new(big.Int).SetBytes(last)
+	if start.Cmp(end) > 0 {
+		return nil, fmt.Errorf("invalid IP range: %s - %s", ipData.FirstIP, ipData.LastIP)
 	}
-
-	network := &net.IPNet{
-		IP:   ip.Mask(mask),
-		Mask: mask,
+	var networks []*net.IPNet
+	one := big.NewInt(1)
+	for start.Cmp(end) <= 0 {
+		// Il blocco più grande allineato su start che non va oltre end
+		count := new(big.Int).Sub(end, start)
+		sizeBits := count.Add(count, one).BitLen() - 1
+		if start.Sign() != 0 && int(start.TrailingZeroBits()) < sizeBits {
+			sizeBits = int(start.TrailingZeroBits())
+		}
+		ip := make(net.IP, bits/8)
+		start.FillBytes(ip)
+		networks = append(networks, &net.IPNet{IP: ip, Mask: net.CIDRMask(bits-sizeBits, bits)})
+		start.Add(start, new(big.Int).Lsh(one, uint(sizeBits)))
 	}
-
-	return network, nil
+	return networks, nil
 }
@@ -1,12 +1,28 @@
+import argparse
 import os
 import sqlite3
+import sys
+import time
 import ipaddress
 import maxminddb
 import logging
-import gc  # For garbage collection
-from typing import Optional, Dict, Any
+import multiprocessing
+import multiprocessing.pool
+from collections import deque
+from pathlib import Path
+from typing import List, Optional, Dict, Any, Tuple
 from mmdb_writer import MMDBWriter
-from netaddr import IPSet
+from netaddr import IPNetwork, IPSet
+
+sys.path.append(str(Path(__file__).parents[1]))
+
+from lib.block_filter import DEFAULT_BLOCK_FILTER, BlockFilter
+from lib.common import ip_int_from_db
+from lib.geolite_enricher import GeoLiteEnricher
+from lib.instrumentation import PipelineStats
+from lib.ip_math import bits_of, cidr_cover, parse_ipv4, parse_ipv6
+from lib.mmdb_builder import MMDBTreeWriter
+from lib.range_flattener import FLAT_TABLE, merge_identical, most_specific_intervals
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -21,138 +37,323 @@ class IPData:
         subnet: int,
         netname: str,
         mnt_by: Optional[str],
+        range_first: Optional[int] = None,
+        range_last: Optional[int] = None,
+        range_version: Optional[int] = None,
     ):
         self.first_ip = first_ip
         self.last_ip = last_ip
         self.subnet = subnet
         self.netname = netname
         self.mnt_by = mnt_by
+        # Bounds of the flattened interval owned by this row (--flat only)
+        self.range_first = range_first
+        self.range_last = range_last
+        self.range_version = range_version
+
+
+# Rows processed by a worker per task, consecutive slices of the sorted ip_data stream
+ROWS_PER_TASK = 2000
+
+_asn_db = None
+_city_db = None
+_enricher = None
+
+
+def _init_worker(asn_db_path: str, city_db_path: str):
+    # Every worker opens its own readers, maxminddb.Reader can't be shared between processes
+    global _asn_db, _city_db, _enricher
+    _asn_db = maxminddb.open_database(asn_db_path)
+    _city_db = maxminddb.open_database(city_db_path)
+    _enricher = GeoLiteEnricher(_asn_db, _city_db)
+
+
+def process_rows(rows: List[tuple]) -> Tuple[List[Tuple[Dict[str, Any], List[Tuple[int, int, int]]]], dict, dict]:
+    """
+    Builds the MMDB records of a slice of rows (first_ip, last_ip, subnet, netname,
+    mnt_by, range_first, range_last, range_version), in the same order.
+    Networks are returned as (version, network_int, prefixlen) so they pickle cheaply.
+    Also returns the enrichment cache stats of this process so far and the
+    PipelineStats snapshot of the slice.
+    """
+    stats = PipelineStats()
+    with stats.timer("build_records"):
+        results = _build_records(rows)
+    stats.add("rows_read", len(rows))
+    stats.add("records_built", len(results))
+    stats.add("rows_skipped", len(rows) - len(results))
+    return results, _enricher.stats(), stats.snapshot()
+
+
+def _build_records(rows: List[tuple]) -> List[Tuple[Dict[str, Any], List[Tuple[int, int, int]]]]:
+    results = []
+    for first_ip, last_ip, subnet, netname, mnt_by, range_first, range_last, range_version in rows:
+        ip_data = IPData(
+            first_ip=first_ip,
+            last_ip=last_ip,
+            subnet=subnet,
+            netname=netname,
+            mnt_by=mnt_by,
+            range_first=ip_int_from_db(range_first),
+            range_last=ip_int_from_db(range_last),
+            range_version=range_version,
+        )
+
+        # Parse the address once, it's reused by the private check, the lookups and the network
+        try:
+            ip = ipaddress.ip_address(ip_data.first_ip)
+        except ValueError:
+            logger.error(f"Invalid IP address: {ip_data.first_ip}")
+            continue
+        if ip.is_private:
+            logger.info(f"FirstIP is Reserved or Invalid: {ip_data.first_ip}")
+            continue
+
+        # Build the MMDB record
+        record = build_mmdb_record(ip_data, _enricher, ip)
+        if record is None:
+            continue
+
+        # Get the correct network(s)
+        networks = get_networks(ip_data, ip)
+        if not networks:
+            continue
+
+        results.append((record, networks))
+    return results
+
+
+def read_row_slices(cursor: sqlite3.Cursor, flat: bool, stats: PipelineStats):
+    while True:
+        with stats.timer("read_rows"):
+            rows = cursor.fetchmany(ROWS_PER_TASK)
+        if not rows:
+            return
+        if flat:
+            yield [tuple(row) for row in rows]
+        else:
+            yield [(*row, None, None, None) for row in rows]
+
+
+def ordered_results(pool: multiprocessing.pool.Pool, row_slices, ahead: int):
+    """
+    Submits the slices to the pool and yields their results in submission order,
+    with at most `ahead` slices in flight so the rows are read as they are consumed
+    (Pool.imap would drain the cursor from its own thread).
+    """
+    pending = deque()
+    for rows in row_slices:
+        pending.append(pool.apply_async(process_rows, (rows,)))
+        if len(pending) >= ahead:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
 
 
 def main():
+    arg_parser = argparse.ArgumentParser(description="Generate the MMDB database from the SQLite database")
+    arg_parser.add_argument(
+        "--flat",
+        action="store_true",
+        help=f"Insert the non overlapping intervals of the {FLAT_TABLE} table (sqllite_importer.py --flatten) instead of every ip_data row",
+    )
+    arg_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes doing the GeoLite lookups and building the records, the networks are always inserted by the main process in the SQL order so the output doesn't depend on it",
+    )
+    arg_parser.add_argument(
+        "--native",
+        action="store_true",
+        help="Write the file with lib.mmdb_builder (ranges flattened then a single tree build, records deduplicated) instead of mmdb_writer",
+    )
+    arg_parser.add_argument(
+        "--filter-config",
+        metavar="PATH",
+        help="JSON file of the rules excluding rows (see lib/block_filter.py), the built in rules by default. "
+        "They are applied in SQL unless the database was imported with the same rules",
+    )
+    arg_parser.add_argument(
+        "--progress",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="Log the counters and their rates every SECONDS instead of every 100000 records",
+    )
+    arg_parser.add_argument(
+        "--stats-json",
+        default="-",
+        metavar="PATH",
+        help="Where to write the JSON summary of the stage timers and counters (default stdout)",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        default="",
+        metavar="STAGES",
+        help="Comma separated stages of the main process to run under cProfile (read_rows, insert_networks, write)",
+    )
+    arg_parser.add_argument("--profile-dir", default="profiles", help="Directory of the .prof files written by --profile")
+    args = arg_parser.parse_args()
+
+    stats = PipelineStats(
+        report_interval=args.progress,
+        profile_stages=[stage.strip() for stage in args.profile.split(",") if stage.strip()],
+        log=logger.info,
+    )
+
     # Get current directory path
     current_dir_path = os.path.dirname(os.path.abspath(__file__))
 
     # Open SQLite database
     sqlite_db = sqlite3.connect(os.path.join(current_dir_path, "../geolocation_db.db"))
-    sqlite_db.row_factory = sqlite3.Row  # Allows accessing columns as attributes
     cursor = sqlite_db.cursor()
 
-    # Open MaxMind databases
-    asn_db = maxminddb.open_database(
-        os.path.join(current_dir_path, "../db/base_mmdb/GeoLite2-ASN.mmdb")
-    )
-    city_db = maxminddb.open_database(
-        os.path.join(current_dir_path, "../db/base_mmdb/GeoLite2-City.mmdb")
-    )
+    # MaxMind databases, opened by every worker
+    asn_db_path = os.path.join(current_dir_path, "../db/base_mmdb/GeoLite2-ASN.mmdb")
+    city_db_path = os.path.join(current_dir_path, "../db/base_mmdb/GeoLite2-City.mmdb")
 
     # Create a new MMDB writer
-    writer = MMDBWriter(
-        ip_version=6,
-        ipv4_compatible=True,
-    )
+    if args.native:
+        writer = MMDBTreeWriter(ip_version=6)
+        # (first, last, insertion index) in the IPv6 space, IPv4 in ::/96, and the record handle of every index
+        native_ranges = []
+        native_handles = []
+    else:
+        writer = MMDBWriter(
+            ip_version=6,
+            ipv4_compatible=True,
+        )
+
+    # Schema version 2 stores first_ip_int as INTEGER/BLOB which sorts numerically
+    # and can use the index, older files store it as TEXT
+    schema_version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    order_by = "first_ip_int" if schema_version >= 2 else "CAST(first_ip_int AS UNSIGNED)"
 
     # Execute the query to fetch IP data
-    cursor.execute(
+    if args.flat:
+        if not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (FLAT_TABLE,)).fetchone():
+            logger.error(f"Table {FLAT_TABLE} not found, run sqllite_importer.py with --flatten first")
+            return
+        cursor.execute(
+            f"""
+            SELECT d.first_ip, d.last_ip, d.subnet, d.netname, d.mnt_by,
+                f.first_ip_int AS range_first, f.last_ip_int AS range_last, f.ip_version AS range_version
+            FROM {FLAT_TABLE} f JOIN ip_data d ON d.id = f.ip_data_id
+            ORDER BY f.ip_version, f.first_ip_int;
         """
-        SELECT first_ip, last_ip, subnet, netname, mnt_by FROM ip_data 
-        WHERE subnet > 0 
-        AND (descr NOT LIKE '%Early registration addresses%' 
-            AND netname != 'ERX-NETBLOCK' 
-            AND netname != 'SBCIS-SBIS-6BLK' 
-            AND descr NOT LIKE '%These addresses have been further assigned to users%' 
-            AND descr NOT LIKE 'This IP address range is not registered in the%' 
-            AND netname != 'SPECIAL-IPV4-LOCAL-ID-IANA-RESERVED'
-            AND netname != 'IANA-THIS-HOST-ON-THIS-NETWORK'
-            AND netname != 'SHARED-ADDRESS-SPACE-RFC6598-IANA-RESERVED'
-            AND netname != 'SPECIAL-IPV4-BENCHMARK-TESTING-IANA-RESERVED'
-            AND netname != 'LINKLOCAL-RFC3927-IANA-RESERVED'
-            AND netname != 'PRIVATE-ADDRESS-CBLK-RFC1918-IANA-RESERVED'
-            AND netname != 'SPECIAL-IPV4-REGISTRY-IANA-RESERVED'
-            AND netname != '6TO4-RELAY-ANYCAST-IANA-RESERVED'
-            AND netname != 'DS-LITE-RFC-6333-11-IANA-RESERVED'
-        ) 
-        ORDER BY CAST(first_ip_int AS UNSIGNED) ASC, subnet DESC;
-    """
-    )
+        )
+    else:
+        block_filter = BlockFilter.from_json(args.filter_config) if args.filter_config else DEFAULT_BLOCK_FILTER
+        where = block_filter.export_where(sqlite_db)
+        if where is None:
+            logger.info("The rows were filtered by the import, no WHERE clause")
+        cursor.execute(
+            """
+            SELECT first_ip, last_ip, subnet, netname, mnt_by FROM ip_data
+            {where}
+            ORDER BY {order_by} ASC, subnet DESC;
+        """.format(where=f"WHERE {where}" if where else "", order_by=order_by)
+        )
+
+    row_slices = read_row_slices(cursor, args.flat, stats)
+    if args.workers > 1:
+        pool = multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(asn_db_path, city_db_path))
+        # Results are consumed in order: later rows must be inserted after earlier ones
+        results = ordered_results(pool, row_slices, ahead=args.workers * 4)
+    else:
+        pool = None
+        _init_worker(asn_db_path, city_db_path)
+        results = map(process_rows, row_slices)
 
     counter = 0
-    batch_size = 1000  # Process rows in batches of 1000
-
-    while True:
-        # Fetch rows in batches
-        rows = cursor.fetchmany(batch_size)
-        if not rows:
-            break  # Exit loop if no more rows
-
-        for row in rows:
-            ip_data = IPData(
-                first_ip=row["first_ip"],
-                last_ip=row["last_ip"],
-                subnet=row["subnet"],
-                netname=row["netname"],
-                mnt_by=row["mnt_by"],
+    log_every = 100000
+    started = time.monotonic()
+    # Latest enrichment stats of every process (keyed by pid)
+    enrichment_stats = {}
+    for slice_results, slice_enrichment_stats, slice_stats in results:
+        stats.merge(slice_stats)
+        with stats.timer("insert_networks"):
+            for record, networks in slice_results:
+                stats.add("networks_written", len(networks))
+                # Insert the record into the MMDB writer
+                if args.native:
+                    handle = writer.add_record(record)
+                    for version, value, prefixlen in networks:
+                        host_bits = (32 if version == 4 else 128) - prefixlen
+                        native_ranges.append((value, value + (1 << host_bits) - 1, len(native_handles)))
+                        native_handles.append(handle)
+                else:
+                    for version, value, prefixlen in networks:
+                        writer.insert_network(IPSet([IPNetwork((value, prefixlen), version)]), record)
+
+                counter += 1
+                if not args.progress and counter % log_every == 0:
+                    logger.info(f"Processed {counter} records ({counter / (time.monotonic() - started):.0f} records/s)")
+        stats.progress()
+        enrichment_stats[slice_enrichment_stats["pid"]] = slice_enrichment_stats
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    logger.info(f"Processed {counter} records in {time.monotonic() - started:.1f}s")
+    for name in ("asn", "city"):
+        lookups = sum(process_stats[name]["lookups"] for process_stats in enrichment_stats.values())
+        reader_calls = sum(process_stats[name]["reader_calls"] for process_stats in enrichment_stats.values())
+        if lookups:
+            logger.info(
+                f"GeoLite {name}: {lookups} lookups, {reader_calls} reader calls, "
+                f"cache hit rate {(lookups - reader_calls) / lookups:.1%}"
             )
-
-            # Check if the IP is private or reserved
-            try:
-                check_ip = ipaddress.ip_address(ip_data.first_ip)
-                if check_ip.is_private:
-                    logger.info(f"FirstIP is Reserved or Invalid: {ip_data.first_ip}")
-                    continue
-            except ValueError:
-                logger.error(f"Invalid IP address: {ip_data.first_ip}")
-                continue
-
-            # Build the MMDB record
-            record = build_mmdb_record(ip_data, asn_db, city_db)
-            if record is None:
-                continue
-
-            # Get the correct network
-            network = get_network_from_record(ip_data)
-            if network is None:
-                continue
-
-            # Insert the record into the MMDB writer
-            writer.insert_network(IPSet([str(network)]), record)
-
-            counter += 1
-            if counter % batch_size == 0:
-                logger.info(f"Processed {counter} records")
-                # gc.collect()  # Force garbage collection after each batch
+        stats.add(f"geolite_lookups:{name}", lookups)
+        stats.add(f"geolite_reader_calls:{name}", reader_calls)
 
     # Close databases
-    asn_db.close()
-    city_db.close()
+    if _asn_db is not None:
+        _asn_db.close()
+        _city_db.close()
     sqlite_db.close()
 
     # Write the MMDB database to file
-    writer.to_db_file(os.path.join(current_dir_path, "../output/ASN_COUNTRY_AND_CITY.mmdb"))
+    output_path = os.path.join(current_dir_path, "../output/ASN_COUNTRY_AND_CITY.mmdb")
+    with stats.timer("write"):
+        if args.native:
+            # Later networks override earlier ones, like the mmdb_writer inserts
+            intervals = merge_identical(most_specific_intervals(native_ranges, by_size=False), native_handles.__getitem__)
+            del native_ranges
+            write_stats = writer.write(output_path, ((first, last, native_handles[index]) for first, last, index in intervals))
+            writer.close()
+            logger.info(f"Native writer: {write_stats}")
+        else:
+            writer.to_db_file(output_path)
 
     logger.info(
         f"Database generated in {os.path.join(current_dir_path, '../output/ASN_COUNTRY_AND_CITY.mmdb')}"
     )
+    stats.write_summary(args.stats_json)
+    if stats.profile_stages:
+        logger.info(f"Profiles written: {stats.dump_profiles(args.profile_dir)}")
 
 
 def build_mmdb_record(
-    ip_data: IPData, asn_db: maxminddb.Reader, city_db: maxminddb.Reader
+    ip_data: IPData,
+    enricher: GeoLiteEnricher,
+    ip: Optional[ipaddress.IPv4Address | ipaddress.IPv6Address] = None,
 ) -> Optional[Dict[str, Any]]:
     record = {}
 
-    try:
-        ip = ipaddress.ip_address(ip_data.first_ip)
-    except ValueError:
-        logger.error(f"Invalid IP address: {ip_data.first_ip}")
-        return None
+    if ip is None:
+        try:
+            ip = ipaddress.ip_address(ip_data.first_ip)
+        except ValueError:
+            logger.error(f"Invalid IP address: {ip_data.first_ip}")
+            return None
+
+    # ASN and city fragments, cached per GeoLite network
+    asn_items, city_items = enricher.lookup(ip)
 
-    # Get ASN data
-    asn_record = asn_db.get(ip)
-    if asn_record:
-        if "autonomous_system_number" in asn_record:
-            record["asn_number"] = asn_record["autonomous_system_number"]
-        if "autonomous_system_organization" in asn_record:
-            record["asn_name"] = asn_record["autonomous_system_organization"]
+    # Add ASN data
+    record.update(asn_items)
 
     # Add mnt_by field
     record["mnt_by"] = ip_data.mnt_by if ip_data.mnt_by else "Unknown"
@@ -163,41 +364,34 @@ def build_mmdb_record(
     # Add correct subnet
     record["subnet"] = f"{ip_data.first_ip}/{ip_data.subnet}"
 
-    # Get city data
-    city_record = city_db.get(ip)
-    if city_record:
-        if "city" in city_record and "names" in city_record["city"] and "en" in city_record["city"]["names"]:
-            record["city_name"] = city_record["city"]["names"]["en"]
-        if "country" in city_record:
-            if "names" in city_record["country"] and "en" in city_record["country"]["names"]:
-                record["country_name"] = city_record["country"]["names"]["en"]
-            if "iso_code" in city_record["country"]:
-                record["iso_code"] = city_record["country"]["iso_code"]
+    # Add city data
+    record.update(city_items)
 
     return record
 
 
-def get_network_from_record(
+def get_networks(
     ip_data: IPData,
-) -> Optional[ipaddress.IPv4Network | ipaddress.IPv6Network]:
-    try:
-        ip = ipaddress.ip_address(ip_data.first_ip)
-    except ValueError:
-        logger.error(f"Invalid IP address: {ip_data.first_ip}")
-        return None
-
-    # Validate subnet mask
-    if ip_data.subnet < 0 or (ip.version == 4 and ip_data.subnet > 32) or (ip.version == 6 and ip_data.subnet > 128):
-        logger.error(f"Invalid subnet mask: {ip_data.subnet} for IP version: {ip.version}")
-        return None
-
-    # Create the network
-    try:
-        network = ipaddress.ip_network(f"{ip_data.first_ip}/{ip_data.subnet}", strict=False)
-        return network
-    except ValueError as e:
-        logger.error(f"Failed to create network: {e}")
-        return None
+    ip: ipaddress.IPv4Address | ipaddress.IPv6Address,
+) -> List[Tuple[int, int, int]]:
+    """
+    (version, network_int, prefixlen) of the exact CIDR cover of the row: its
+    flattened interval with --flat, otherwise first_ip..last_ip. A range that is
+    not one network is inserted as several networks instead of the single one of
+    its `subnet`, which doesn't match its bounds.
+    """
+    if ip_data.range_first is not None:
+        version, first, last = ip_data.range_version, ip_data.range_first, ip_data.range_last
+    else:
+        version, first = ip.version, int(ip)
+        last = parse_ipv6(ip_data.last_ip) if version == 6 else parse_ipv4(ip_data.last_ip)
+        if last is None:
+            logger.error(f"Invalid IP address: {ip_data.last_ip}")
+            return []
+    networks = [(version, network, prefix_len) for network, prefix_len in cidr_cover(first, last, bits_of(version))]
+    if not networks:
+        logger.error(f"Invalid range: {ip_data.first_ip} - {ip_data.last_ip}")
+    return networks
 
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.lookup_service import DEFAULT_CACHE_SIZE, DEFAULT_MAX_BATCH, LookupService
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Serve the IP lookups of a geolocation database over HTTP")
+    arg_parser.add_argument("--db", default=str(path_root / "geolocation_db.db"), help="SQLite database built by sqllite_importer.py")
+    arg_parser.add_argument("--flat", action="store_true", help="Load the precomputed ip_ranges_flat table")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8080)
+    arg_parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE, help="Addresses kept in the LRU cache, 0 disables it")
+    arg_parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="Addresses accepted by a POST /lookup")
+    arg_parser.add_argument("--watch-interval", type=float, default=5.0, help="Seconds between checks of the database file for a new version, 0 disables it")
+    args = arg_parser.parse_args()
+
+    service = LookupService(args.db, flat_table=args.flat, cache_size=args.cache_size, max_batch=args.max_batch)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port, watch_interval=args.watch_interval))
+    except KeyboardInterrupt:
+        pass
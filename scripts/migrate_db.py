@@ -0,0 +1,25 @@
+import os
+import sys
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.db import SCHEMA_VERSION, SQLiteHandler
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else str(path_root / "geolocation_db.db")
+    if not os.path.exists(db_path):
+        print(f"Database {db_path} not found")
+        sys.exit(1)
+
+    db_handler = SQLiteHandler(db_path)
+    current_version = db_handler.schema_version()
+    if current_version >= SCHEMA_VERSION:
+        print(f"{db_path} is already at schema version {current_version}")
+        sys.exit(0)
+
+    print(f"Migrating {db_path} from schema version {current_version} to {SCHEMA_VERSION}...")
+    db_handler.migrate()
+    print("Migration complete.")
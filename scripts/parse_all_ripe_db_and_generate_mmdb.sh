@@ -1,13 +1,8 @@
 #!/bin/sh
 set -e
 
-# Download RIPE data
-echo "Downloading RIPE data..."
-./scripts/download-ripe-data.sh
-echo "Download RIPE data complete."
-
-echo "Start Parsing..."
-python3 sqllite_importer.py
+echo "Downloading and parsing RIPE data..."
+python3 sqllite_importer.py --download --workers "$(nproc)"
 echo "Parsing complete."
 
 
@@ -0,0 +1,30 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+
+from lib.shard_splitter import DEFAULT_SHARD_SIZE, split_file
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Split an RPSL dump in object aligned byte ranges (shards), without copying it")
+    arg_parser.add_argument("file", nargs="?", default=str(path_root / "db" / "ripe.db.inetnum"), help="RPSL dump to split")
+    arg_parser.add_argument("--shards", type=int, help="Number of shards, by default the file is split every --shard-size MB")
+    arg_parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE // (1024 * 1024), help="Shard size in MB")
+    arg_parser.add_argument("--output", help="Write the shard descriptors as JSON to this file")
+    args = arg_parser.parse_args()
+
+    start = time.time()
+    shards = split_file(args.file, shards=args.shards, shard_size=args.shard_size * 1024 * 1024)
+    elapsed = time.time() - start
+    for shard in shards:
+        print(f"{shard.file_path} {shard.start} {shard.end if shard.end is not None else ''} ({shard.size() / (1024 * 1024):.1f} MB)")
+    print(f"{len(shards)} shards in {elapsed * 1000:.1f}ms")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump([shard._asdict() for shard in shards], file, indent=2)
+        print(f"Shard descriptors written to {args.output}")
@@ -1,70 +1,173 @@
-
-
+import argparse
 import os
 from pathlib import Path
 import time
+from lib.arrow_export import ArrowExportWriter
+from lib.block_filter import DEFAULT_BLOCK_FILTER, BlockFilter, record_block_filter
 from lib.db import SQLiteHandler
-from lib.ripe_parser import RIPE_PARSER
+from lib.downloader import REGISTRY_SOURCES, download_sources
+from lib.dump_io import is_compressed, resolve_dump_path
+from lib.incremental_import import IncrementalImporter
+from lib.instrumentation import PipelineStats
+from lib.parallel_importer import ImportTask, run_import_tasks, shard_task
+from lib.range_flattener import build_flat_table
 
-blocks = []
 total_blocks_processed= 0
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Parse the registry dumps and import them into SQLite")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="Number of parser processes, every registry file (and every shard of the RIPE file) is parsed in its own worker")
+    arg_parser.add_argument("--flatten", action="store_true",
+                            help="Precompute the non overlapping most specific intervals in the ip_ranges_flat table after the import")
+    arg_parser.add_argument("--incremental", action="store_true",
+                            help="Diff the dumps against the existing database and only write the added/changed/removed blocks")
+    arg_parser.add_argument("--normalize", action="store_true",
+                            help="Store netname/country/descr/mnt_by once in lookup tables, ip_data becomes a view joining them")
+    arg_parser.add_argument("--download", action="store_true",
+                            help="Download the registry dumps first (concurrently, unchanged files are kept) and import the downloaded files")
+    arg_parser.add_argument("--filter-config", metavar="PATH",
+                            help="JSON file of the rules excluding blocks while parsing (see lib/block_filter.py), the built in rules by default")
+    arg_parser.add_argument("--no-filter", action="store_true",
+                            help="Import every block, the MMDB export then applies the rules in SQL")
+    arg_parser.add_argument("--export-arrow", metavar="DIR",
+                            help="Also write the parsed blocks to ip_data_v4/ip_data_v6 columnar files in DIR (requires pyarrow)")
+    arg_parser.add_argument("--export-format", choices=["parquet", "arrow"], default="parquet",
+                            help="Format of --export-arrow: zstd Parquet, or uncompressed Arrow IPC files that can be memory mapped")
+    arg_parser.add_argument("--progress", type=float, default=0, metavar="SECONDS",
+                            help="Print the counters and their rates every SECONDS instead of the running block total")
+    arg_parser.add_argument("--stats-json", default="-", metavar="PATH",
+                            help="Where to write the JSON summary of the stage timers and counters (default stdout)")
+    arg_parser.add_argument("--profile", default="", metavar="STAGES",
+                            help="Comma separated stages to run under cProfile (parse, insert, diff, apply, create_indexes, flatten), parse is only profiled with --workers 1")
+    arg_parser.add_argument("--profile-dir", default="profiles", help="Directory of the .prof files written by --profile")
+    args = arg_parser.parse_args()
+
     db_name = 'geolocation_db.db'
 
 
-    default_ripeV4_data = str(Path.joinpath(Path(__file__).parents[0],'db/ripe.db.inetnum'))
-    default_ripeV6_data = str(Path.joinpath(Path(__file__).parents[0],'db/ripe.db.inet6num'))
-    apnic_ripeV4_data = str(Path.joinpath(Path(__file__).parents[0], 'db/apnic.db.inetnum'))
-    apnic_ripeV6_data = str(Path.joinpath(Path(__file__).parents[0], 'db/apnic.db.inet6num'))
-    afrinic_data = str(Path.joinpath(Path(__file__).parents[0], 'db/afrinic.db'))
-    latine_data = str(Path.joinpath(Path(__file__).parents[0], 'db/lacnic.db'))
-    arin_data = str(Path.joinpath(Path(__file__).parents[0], 'db/arin.db'))
-    arin_transfers_data_json = str(Path.joinpath(Path(__file__).parents[0], 'db/transfers_latest.json'))
-    arin_private_db_path = str(Path.joinpath(Path(__file__).parents[0], 'db/arin_db.txt'))
-    
-    os.remove(db_name) if os.path.exists(db_name) else None
+    stats = PipelineStats(
+        report_interval=args.progress,
+        profile_stages=[stage.strip() for stage in args.profile.split(",") if stage.strip()],
+    )
+
+    db_folder = str(Path.joinpath(Path(__file__).parents[0], 'db'))
+    # Paths of the files written (or kept) by the download stage, by dump name
+    downloaded = {}
+    if args.download:
+        with stats.timer("download"):
+            # Compressed dumps can't be split in shards, the RIPE inetnum dump is stored decompressed for --workers
+            decompress = {"ripe.db.inetnum.gz"} if args.workers > 1 else False
+            for result in download_sources(REGISTRY_SOURCES, db_folder, decompress=decompress):
+                stats.add("bytes_downloaded", result.size)
+                stats.add(f"files_{result.status}", 1)
+                if result.path:
+                    downloaded[result.source.file_name.removesuffix(".gz")] = result.path
+
+    def dump_path(name):
+        return downloaded.get(name) or resolve_dump_path(os.path.join(db_folder, name))
+
+    default_ripeV4_data = dump_path('ripe.db.inetnum')
+    default_ripeV6_data = dump_path('ripe.db.inet6num')
+    apnic_ripeV4_data = dump_path('apnic.db.inetnum')
+    apnic_ripeV6_data = dump_path('apnic.db.inet6num')
+    afrinic_data = dump_path('afrinic.db')
+    latine_data = dump_path('lacnic.db')
+    arin_data = dump_path('arin.db')
+    arin_transfers_data_json = dump_path('transfers_latest.json')
+    arin_private_db_path = dump_path('arin_db.txt')
+
     db_handler = SQLiteHandler(db_name)
-    db_handler.create_table()
-
-    def on_single_block_process(block):
-        global blocks,total_blocks_processed
-        
-        
-        # Country is really world wide
-        
-        if (
-            ("country" not in block or 
-            ("Country is really world wide" not in block["country"] and "Worldwide" not in block["country"])) and 
-            ( "nettype" not in block or 
-            "Early Registrations" not in block["nettype"])
-        ):
-            blocks.append(block)
+    incremental = args.incremental and db_handler.has_fingerprints()
+    if args.incremental and not incremental:
+        print(f"{db_name} has no fingerprints of a previous import, running a full import")
+
+    if incremental:
+        incremental_importer = IncrementalImporter(db_name)
+    else:
+        os.remove(db_name) if os.path.exists(db_name) else None
+        db_handler.create_table(normalized=args.normalize)
+        db_writer = db_handler.bulk_writer()
+
+    # Applied by the parsing tasks, the excluded blocks never reach SQLite
+    if args.no_filter:
+        block_filter = None
+    else:
+        block_filter = BlockFilter.from_json(args.filter_config) if args.filter_config else DEFAULT_BLOCK_FILTER
+    arrow_writer = ArrowExportWriter(args.export_arrow, args.export_format) if args.export_arrow else None
+
+    def on_blocks(task, blocks):
+        global total_blocks_processed
+        stats.add(f"blocks_parsed:{task.name}", len(blocks))
+        # Rows are fingerprinted by task name, the shards of a file share the name of the file task
+        if incremental:
+            with stats.timer("diff"):
+                incremental_importer.add_blocks(task.name, blocks)
+        else:
+            with stats.timer("insert"):
+                db_writer.write_many(blocks, registry=task.name)
+            stats.add("rows_inserted", len(blocks))
+        if arrow_writer is not None:
+            with stats.timer("export_arrow"):
+                arrow_writer.write_many(blocks, registry=task.name)
+        total_blocks_processed += len(blocks)
+        if args.progress:
+            stats.progress()
         else:
-            print(f"Ignoring block {block.get('first_ip')}, ${block}")
-        
-        if len(blocks) >= 5000:
-            
-            db_handler.insert_data(blocks)
-            total_blocks_processed += len(blocks)
-            blocks = []
             print(f"Total blocks processed: {total_blocks_processed}")
-    
-
-    RIPE_PARSER.parse_file(default_ripeV4_data,on_single_block_process)
-    print(f"Processing Apnic Db")
-    RIPE_PARSER.parse_file(apnic_ripeV4_data, on_single_block_process)
-    RIPE_PARSER.parse_file(default_ripeV6_data,on_single_block_process)
-    RIPE_PARSER.parse_file(apnic_ripeV6_data,on_single_block_process)
-    RIPE_PARSER.parse_file(arin_data,on_single_block_process,True)
-    RIPE_PARSER.parse_file(latine_data, on_single_block_process)
-    RIPE_PARSER.parse_file(afrinic_data, on_single_block_process)
+
+    tasks = [
+        ImportTask("ripe-inetnum", "parse_file", default_ripeV4_data),
+        ImportTask("apnic-inetnum", "parse_file", apnic_ripeV4_data),
+        ImportTask("ripe-inet6num", "parse_file", default_ripeV6_data),
+        ImportTask("apnic-inet6num", "parse_file", apnic_ripeV6_data),
+        ImportTask("arin-route", "parse_file", arin_data, {"parseRoute": True}),
+        ImportTask("lacnic", "parse_file", latine_data),
+        ImportTask("afrinic", "parse_file", afrinic_data),
+    ]
     if os.path.exists(arin_private_db_path):
-        RIPE_PARSER.parse_arin_file(arin_private_db_path, on_single_block_process)
+        tasks.append(ImportTask("arin-bulk", "parse_arin_file", arin_private_db_path))
     else:
         print(f"File {arin_private_db_path} not found, You need to ask to access to ARIN BULK data from https://www.arin.net/")
         time.sleep(5)
-        RIPE_PARSER.parse_transfer_json_file(arin_transfers_data_json,on_single_block_process)
+        tasks.append(ImportTask("arin-transfers", "parse_transfer_json_file", arin_transfers_data_json))
+
+    if args.workers > 1:
+        # The RIPE inetnum dump is by far the largest one, split it so it doesn't bound the run time
+        if is_compressed(tasks[0].file_path):
+            print(f"WARNING: {tasks[0].file_path} is compressed and can't be split in shards, it is parsed by a single worker. "
+                  f"Decompress it (or use --download, which stores it decompressed with --workers) to parse it in parallel")
+        tasks = shard_task(tasks[0], args.workers) + tasks[1:]
+
+    print(f"Processing {len(tasks)} tasks with {args.workers} worker(s)")
+    run_import_tasks(tasks, on_blocks, workers=args.workers, stats=stats, block_filter=block_filter)
+    if incremental:
+        with stats.timer("apply"):
+            changes = incremental_importer.apply()
+        print(changes)
+        for name, value in changes.items():
+            stats.add(f"rows_{name}", value)
+        incremental_importer.close()
+    else:
+        with stats.timer("insert"):
+            db_writer.close()
+        print("Building indexes")
+        with stats.timer("create_indexes"):
+            db_handler.create_indexes()
+    if arrow_writer is not None:
+        with stats.timer("export_arrow"):
+            print(f"Columnar export written to {args.export_arrow}: {arrow_writer.close()}")
+    # The export skips its WHERE when the rows were filtered with the same rules
+    record_block_filter(db_name, block_filter)
+    if args.flatten:
+        print("Flattening ranges")
+        with stats.timer("flatten"):
+            print(build_flat_table(db_name, block_filter or DEFAULT_BLOCK_FILTER))
+
+    stats.progress(force=True)
+    stats.write_summary(args.stats_json)
+    if stats.profile_stages:
+        print(f"Profiles written: {stats.dump_profiles(args.profile_dir)}")
 
 
 
-    print("Done")
\ No newline at end of file
+    print("Done")
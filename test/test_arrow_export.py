@@ -0,0 +1,107 @@
+from pathlib import Path
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    print("pyarrow is not installed, Arrow export not tested")
+    sys.exit(0)
+
+from benchmarks.fixtures import write_rpsl_v4, write_rpsl_v6
+from lib.arrow_export import ArrowExportWriter, export_sqlite
+from lib.block_filter import DEFAULT_BLOCK_FILTER
+from lib.common import ip_int_from_db
+from lib.db import SQLiteHandler
+from lib.ripe_parser import RIPE_PARSER
+
+COLUMNS = "id, first_ip, last_ip, first_ip_int, last_ip_int, subnet, network_prefix, netname, country, descr, mnt_by"
+
+
+def read_table(path: str):
+    if path.endswith(".parquet"):
+        return pa.parquet.read_table(path)
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def table_rows(table) -> list:
+    return sorted((tuple(row.values()) for row in table.to_pylist()), key=repr)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    blocks = []
+    for name, write in (("inetnum.db", write_rpsl_v4), ("inet6num.db", write_rpsl_v6)):
+        write(os.path.join(directory, name), 500, random.Random(9))
+        RIPE_PARSER.parse_file(os.path.join(directory, name), blocks.append)
+    blocks.append(RIPE_PARSER.build_block("0.0.0.0/0", ip_version=4, netname="IANA-BLK", country="EU # Country is really world wide"))
+    db_path = os.path.join(directory, "geolocation_db.db")
+    db_handler = SQLiteHandler(db_path)
+    db_handler.create_table()
+    with db_handler.bulk_writer() as writer:
+        writer.write_many(blocks, registry="ripe")
+    db_handler.create_indexes()
+    conn = sqlite3.connect(db_path)
+
+    for file_format in ("parquet", "arrow"):
+        # Small batches: several row groups and dictionary deltas
+        output_dir = os.path.join(directory, file_format)
+        written = export_sqlite(db_path, output_dir, file_format, batch_rows=100)
+        for version in (4, 6):
+            path = os.path.join(output_dir, f"ip_data_v{version}.{file_format}")
+            table = read_table(path)
+            expected = [row + ("ripe",) for row in conn.execute(f"SELECT {COLUMNS} FROM ip_data WHERE ip_version = ?", (version,))]
+            assert written[os.path.basename(path)] == table.num_rows == len(expected) > 100, (path, table.num_rows)
+            assert table_rows(table) == sorted(expected, key=repr), path
+            assert table.schema.field("first_ip_int").type == (pa.uint32() if version == 4 else pa.binary(16))
+            assert pa.types.is_dictionary(table.schema.field("netname").type) and table.schema.metadata[b"ip_version"] == str(version).encode()
+            # Sorted by range start, the dictionaries hold every distinct string once
+            starts = [ip_int_from_db(value) for value in table.column("first_ip_int").to_pylist()]
+            assert starts == sorted(starts)
+            netnames = table.column("netname").combine_chunks().dictionary.to_pylist()
+            assert len(netnames) == len(set(netnames)) == len({row[7] for row in expected})
+        assert not [name for name in os.listdir(output_dir) if name.endswith(".part")]
+
+    # The Arrow files are memory mapped: only the dictionary deltas of the batches are concatenated by the reader
+    table = None
+    allocated = pa.total_allocated_bytes()
+    with pa.memory_map(os.path.join(directory, "arrow", "ip_data_v4.arrow")) as source:
+        table = pa.ipc.open_file(source).read_all()
+        dictionaries = sum(table.column(column).chunk(0).dictionary.nbytes for column in ("netname", "country", "descr", "mnt_by", "registry"))
+        print(f"Allocated {pa.total_allocated_bytes() - allocated} bytes reading {table.nbytes} bytes, dictionaries {dictionaries} bytes")
+        # Allocations are padded to 64 bytes, 2 buffers (offsets and data) per dictionary
+        assert pa.total_allocated_bytes() - allocated <= dictionaries + 5 * 2 * 64 and dictionaries < table.nbytes // 4
+
+    # Written straight from the parser callbacks: the same rows, without the ids
+    output_dir = os.path.join(directory, "parsed")
+    with ArrowExportWriter(output_dir, batch_rows=64) as writer:
+        for position in range(0, len(blocks), 50):
+            writer.write_many(blocks[position:position + 50], registry="ripe")
+    for version in (4, 6):
+        parsed = table_rows(read_table(os.path.join(output_dir, f"ip_data_v{version}.parquet")))
+        exported = table_rows(read_table(os.path.join(directory, "parquet", f"ip_data_v{version}.parquet")))
+        assert sorted((row[1:] for row in parsed), key=repr) == sorted((row[1:] for row in exported), key=repr)
+        assert {row[0] for row in parsed} == {None}
+
+    # Filtered like the MMDB export, a failed export leaves no file behind
+    written = export_sqlite(db_path, os.path.join(directory, "filtered"), block_filter=DEFAULT_BLOCK_FILTER)
+    assert written["ip_data_v4.parquet"] == conn.execute(
+        f"SELECT COUNT(*) FROM ip_data WHERE ip_version = 4 AND {DEFAULT_BLOCK_FILTER.export_where(conn)}").fetchone()[0]
+    output_dir = os.path.join(directory, "failed")
+    try:
+        with ArrowExportWriter(output_dir) as writer:
+            writer.write_many(blocks[:10])
+            raise RuntimeError("parser failure")
+    except RuntimeError:
+        pass
+    assert os.listdir(output_dir) == []
+    conn.close()
+print("Arrow export OK")
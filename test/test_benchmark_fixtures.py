@@ -0,0 +1,54 @@
+from pathlib import Path
+import hashlib
+import os
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+import maxminddb
+
+from benchmarks.fixtures import generate_fixtures
+from lib.ripe_parser import RIPE_PARSER
+
+
+def digest(directory):
+    sha = hashlib.sha256()
+    for name in ("ripe.db.inetnum", "ripe.db.inet6num", "arin_db.txt", "transfers_latest.json"):
+        with open(os.path.join(directory, name), "rb") as file:
+            sha.update(file.read())
+    return sha.hexdigest()
+
+
+with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+    manifest = generate_fixtures(first, 3000)
+    assert generate_fixtures(second, 3000) == manifest
+    assert digest(first) == digest(second), "The fixtures must be deterministic"
+    print(manifest)
+
+    # Every generated object is parsed
+    blocks = []
+    for name in ("ripe.db.inetnum", "ripe.db.inet6num"):
+        RIPE_PARSER.parse_file(os.path.join(first, name), blocks.append)
+    assert len(blocks) == manifest["objects"]["ripe.db.inetnum"] + manifest["objects"]["ripe.db.inet6num"]
+    assert any("\n" in block.descr for block in blocks)
+
+    arin_blocks = []
+    RIPE_PARSER.parse_arin_file(os.path.join(first, "arin_db.txt"), arin_blocks.append)
+    assert len(arin_blocks) == manifest["objects"]["arin_db.txt"]
+    assert {block.ip_version for block in arin_blocks} == {4, 6}
+
+    transfer_blocks = []
+    RIPE_PARSER.parse_transfer_json_file(os.path.join(first, "transfers_latest.json"), transfer_blocks.append)
+    assert len(transfer_blocks) == manifest["objects"]["transfers_latest.json"]
+
+    with maxminddb.open_database(os.path.join(first, "base_mmdb", "GeoLite2-City.mmdb")) as reader:
+        assert reader.get("10.1.2.3")["country"]["iso_code"]
+        assert reader.get("2a00::1")["city"]["names"]["en"]
+
+    # Unchanged parameters reuse the files
+    modified = os.path.getmtime(os.path.join(first, "ripe.db.inetnum"))
+    assert generate_fixtures(first, 3000) == manifest
+    assert os.path.getmtime(os.path.join(first, "ripe.db.inetnum")) == modified
+print("Benchmark fixtures OK")
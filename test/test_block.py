@@ -0,0 +1,31 @@
+from pathlib import Path
+import sys
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from lib.block import Block, dict_callback
+from lib.db import SQLiteHandler, block_fingerprint
+from lib.ripe_parser import RIPE_PARSER
+
+v4 = RIPE_PARSER.build_block("10.0.0.0 - 10.0.2.255", netname="NET", country="IT", descr="a\nb", mnt_by="MNT")
+v6 = RIPE_PARSER.build_block("2a00:1:2::/48", ip_version=6, netname="NET6", nettype="ALLOCATED-BY-RIR")
+assert type(v4) is Block and (v4.first_ip, v4.last_ip, v4.subnet, v4.network_prefix) == ("10.0.0.0", "10.0.2.255", 23, None)
+assert (v6.subnet, v6.network_prefix, v6.nettype) == (48, "2a00:1:2::", "ALLOCATED-BY-RIR")
+
+# The dict format of the previous versions
+assert v4.to_dict() == RIPE_PARSER.format_block({
+    "inetnum": "10.0.0.0 - 10.0.2.255", "ipVersion": 4, "netname": "NET", "country": "IT", "descr": "a\nb", "mnt-by": "MNT",
+})
+assert "network_prefix" not in v4.to_dict() and v6.to_dict()["network_prefix"] == "2a00:1:2::"
+assert v4.to_dict()["mnt-by"] == "MNT"
+received = []
+dict_callback(received.append)(v6)
+assert received == [v6.to_dict()]
+
+# Blocks and dicts give the same rows and fingerprints
+for block in (v4, v6, v4._replace(subnet=None), v6._replace(subnet=None)):
+    assert SQLiteHandler.block_to_row(block) == SQLiteHandler.block_to_row(block.to_dict())
+    assert block_fingerprint("ripe", block) == block_fingerprint("ripe", block.to_dict())
+assert SQLiteHandler.block_to_row(v4._replace(subnet=None))[5] == 23
+print("Block OK")
@@ -0,0 +1,140 @@
+from pathlib import Path
+import json
+import os
+import pickle
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from lib.block_filter import DEFAULT_BLOCK_FILTER, BlockFilter, record_block_filter
+from lib.db import SQLiteHandler
+from lib.instrumentation import PipelineStats
+from lib.parallel_importer import ImportTask, run_import_tasks
+from lib.range_flattener import build_flat_table
+from lib.ripe_parser import RIPE_PARSER
+
+rng = random.Random(11)
+DESCRIPTIONS = [
+    "Customer network", "EARLY REGISTRATION ADDRESSES of ARIN", "x These addresses have been further assigned to users",
+    "This IP address range is not registered in the RIPE database", "see This IP address range is not registered in the",
+    "100% _wildcards_ \\ here", "Città",
+]
+NETNAMES = ["NET-1", "ERX-NETBLOCK", "erx-netblock", "LINKLOCAL-RFC3927-IANA-RESERVED", "NET-%"]
+COUNTRIES = ["IT", "EU # Country is really world wide", "worldwide", "US"]
+NETWORKS = [
+    "0.0.0.0/0", "10.1.0.0/16", "9.0.0.0/7", "193.0.0.0/21", "172.16.0.0/12", "192.0.0.0/24", "255.255.255.255/32",
+    "::/0", "2001:db8:1::/48", "2001:db8::/31", "2a00::/12", "fe80::/64", "::1/128",
+]
+
+
+def reference_exclude(rules, block):
+    """The rules applied one by one, without the compiled checks."""
+    for rule in rules:
+        value = getattr(block, rule.get("field", "first_ip")) or ""
+        if "equals" in rule and value in rule["equals"]:
+            return rule["name"]
+        if "contains" in rule and any(needle.lower() in value.lower() for needle in rule["contains"]):
+            return rule["name"]
+        if "startswith" in rule and any(value.lower().startswith(prefix.lower()) for prefix in rule["startswith"]):
+            return rule["name"]
+        if "min_prefix" in rule and block.subnet < rule["min_prefix"]:
+            return rule["name"]
+        if "ranges" in rule:
+            for network in rule["ranges"]:
+                other = RIPE_PARSER.build_block(network, ip_version=6 if ":" in network else 4)
+                if other.ip_version == block.ip_version and other.first_ip_int <= block.first_ip_int and block.last_ip_int <= other.last_ip_int:
+                    return rule["name"]
+    return None
+
+
+blocks = [
+    RIPE_PARSER.build_block(
+        network, ip_version=6 if ":" in network else 4, netname=rng.choice(NETNAMES), country=rng.choice(COUNTRIES),
+        descr=rng.choice(DESCRIPTIONS), nettype=rng.choice(["ASSIGNED PA", "Early Registrations, Transferred to RIPE NCC"]),
+    )
+    for network in NETWORKS for _ in range(40)
+]
+hits = {}
+for block in blocks:
+    rule = DEFAULT_BLOCK_FILTER.exclude(block)
+    assert rule == reference_exclude(DEFAULT_BLOCK_FILTER.rules, block), (block, rule)
+    hits[rule] = hits.get(rule, 0) + 1
+print(hits)
+assert set(hits) == {None} | set(DEFAULT_BLOCK_FILTER.names)
+
+# Picklable for the workers, rules from JSON, invalid rules are refused
+assert [pickle.loads(pickle.dumps(DEFAULT_BLOCK_FILTER)).exclude(block) for block in blocks] == [DEFAULT_BLOCK_FILTER.exclude(block) for block in blocks]
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "rules.json")
+    with open(path, "w") as file:
+        json.dump({"rules": [{"name": "wildcards", "field": "descr", "contains": ["100%"]}]}, file)
+    custom = BlockFilter.from_json(path)
+    assert {block.descr for block in blocks if custom.exclude(block)} == {"100% _wildcards_ \\ here"}
+for rules in ([{"field": "descr", "contains": ["x"]}], [{"name": "a", "field": "descr"}], [{"name": "a", "field": "nope", "equals": ["x"]}],
+              [{"name": "a", "field": "descr", "contains": "x"}], [{"name": "a", "min_prefix": 1, "ranges": ["::/0"]}]):
+    try:
+        BlockFilter(rules)
+    except ValueError:
+        continue
+    raise AssertionError(rules)
+
+with tempfile.TemporaryDirectory() as directory:
+    # The WHERE clause keeps the same rows as the Python filter (nettype isn't stored)
+    db_path = os.path.join(directory, "geolocation_db.db")
+    db_handler = SQLiteHandler(db_path)
+    db_handler.create_table()
+    db_handler.insert_data(blocks)
+    conn = sqlite3.connect(db_path)
+    sql_kept = [row[0] for row in conn.execute(f"SELECT id FROM ip_data WHERE {DEFAULT_BLOCK_FILTER.export_where(conn)} ORDER BY id")]
+    python_kept = [
+        position + 1 for position, block in enumerate(blocks)
+        if DEFAULT_BLOCK_FILTER.exclude(block._replace(nettype="Unknown")) is None
+    ]
+    assert sql_kept == python_kept and 0 < len(sql_kept) < len(blocks), (len(sql_kept), len(python_kept))
+    for where in (custom.sql_where(), BlockFilter([]).sql_where()):
+        assert len(conn.execute(f"SELECT id FROM ip_data WHERE {where}").fetchall()) == sum(
+            1 for block in blocks if (custom if where != "1" else BlockFilter([])).exclude(block) is None
+        )
+
+    # A database imported with the rules needs no WHERE clause, also for the flattening
+    conn.close()
+    record_block_filter(db_path, DEFAULT_BLOCK_FILTER)
+    conn = sqlite3.connect(db_path)
+    assert DEFAULT_BLOCK_FILTER.export_where(conn) is None and custom.export_where(conn) == custom.sql_where()
+    assert build_flat_table(db_path)["rows"] == len(blocks)
+    record_block_filter(db_path, None)
+    assert DEFAULT_BLOCK_FILTER.export_where(conn) is not None
+    # generate_mmdb.go skips its WHERE clause only for the stored default rules
+    go_source = (path_root / "scripts" / "generate_mmdb.go").read_text()
+    assert re.search(r"const defaultFilterRules = `([^`]*)`", go_source).group(1) == DEFAULT_BLOCK_FILTER.canonical()
+    assert build_flat_table(db_path)["rows"] == len(python_kept)
+    conn.close()
+
+    # Applied while parsing, also in the workers, with the hit count of every rule
+    dump_path = os.path.join(directory, "ripe.db.inetnum")
+    with open(dump_path, "w") as file:
+        for block in blocks:
+            if block.ip_version == 4:
+                file.write(f"inetnum: {block.first_ip} - {block.last_ip}\nnetname: {block.netname}\ncountry: {block.country}\n"
+                           f"descr: {block.descr}\nstatus: {block.nettype}\n\n")
+    parsed = []
+    RIPE_PARSER.parse_file(dump_path, parsed.append)
+    expected = [block for block in parsed if DEFAULT_BLOCK_FILTER.exclude(block) is None]
+    for workers in (1, 2):
+        stats = PipelineStats()
+        received = []
+        tasks = [ImportTask("ripe", "parse_file", dump_path, {"start": 0, "end": os.path.getsize(dump_path) // 2}),
+                 ImportTask("ripe", "parse_file", dump_path, {"start": os.path.getsize(dump_path) // 2})]
+        tasks = [ImportTask("ripe", "parse_file", dump_path)] if workers == 1 else tasks
+        run_import_tasks(tasks, lambda task, batch: received.extend(batch), workers=workers, stats=stats, block_filter=DEFAULT_BLOCK_FILTER)
+        counters = stats.summary()["counters"]
+        print(workers, counters)
+        assert sorted(received) == sorted(expected)
+        assert counters["blocks_parsed"] == len(expected) and counters["blocks_filtered"] == len(parsed) - len(expected)
+        assert sum(value for name, value in counters.items() if name.startswith("blocks_filtered:")) == counters["blocks_filtered"]
+print("Block filter OK")
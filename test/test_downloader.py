@@ -0,0 +1,170 @@
+from pathlib import Path
+import email.utils
+import gzip
+import http.server
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from lib.downloader import Source, download_sources
+
+LAST_MODIFIED = email.utils.formatdate(time.time() - 3600, usegmt=True)
+
+
+class Server:
+    """Local stand-in of the dump servers, `files` maps a path to (data, send the validators)."""
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server.lock:
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                try:
+                    time.sleep(0.1)
+                    self.respond()
+                finally:
+                    with server.lock:
+                        server.active -= 1
+
+            def respond(self):
+                if self.path not in server.files:
+                    server.requests.append((self.path, 404))
+                    self.send_error(404)
+                    return
+                data, validators = server.files[self.path]
+                etag = f'"{hash(data) & 0xFFFFFFFF:x}"'
+                if validators and (self.headers.get("If-None-Match") == etag or (
+                    self.headers.get("If-None-Match") is None and self.headers.get("If-Modified-Since") == LAST_MODIFIED
+                )):
+                    server.requests.append((self.path, 304))
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                server.requests.append((self.path, 200))
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(data)))
+                if validators:
+                    self.send_header("ETag", etag)
+                    self.send_header("Last-Modified", LAST_MODIFIED)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def statuses(self):
+        statuses = dict(self.requests)
+        self.requests.clear()
+        return statuses
+
+
+server = Server()
+inetnum = b"inetnum: 10.0.0.0 - 10.0.0.255\nnetname: NET\n\n" * 20000
+# Two gzip members, like concatenated dumps
+server.files["/ripe.db.inetnum.gz"] = (gzip.compress(inetnum[:500000]) + gzip.compress(inetnum[500000:]), True)
+server.files["/lacnic.db.gz"] = (gzip.compress(b"inetnum: 1.0.0.0 - 1.0.0.255\n\n"), True)
+server.files["/transfers_latest.json"] = (b'{"transfers": []}', False)
+server.files["/arin.db.gz"] = (gzip.compress(b"route: 2.0.0.0/8\n\n"), True)
+sources = [Source(name.strip("/"), server.url + name, name.strip("/")) for name in server.files]
+
+with tempfile.TemporaryDirectory() as directory:
+    # Everything is downloaded, at most 2 at a time
+    results = download_sources(sources, directory, concurrency=2)
+    assert [result.status for result in results] == ["downloaded"] * 4
+    assert server.max_active == 2, server.max_active
+    assert gzip.decompress(open(results[0].path, "rb").read()) == inetnum
+    assert results[0].size == len(server.files["/ripe.db.inetnum.gz"][0])
+    assert os.path.getmtime(results[0].path) == email.utils.parsedate_to_datetime(LAST_MODIFIED).timestamp()
+    server.statuses()
+
+    # Nothing changed: 304 with the validators, same checksum without them
+    results = download_sources(sources, directory, concurrency=4)
+    assert {result.source.file_name: result.status for result in results} == {
+        "ripe.db.inetnum.gz": "not_modified", "lacnic.db.gz": "not_modified",
+        "transfers_latest.json": "unchanged", "arin.db.gz": "not_modified",
+    }
+    assert all(result.path and os.path.exists(result.path) for result in results)
+    assert set(server.statuses().values()) == {304, 200}
+
+    # A changed file is downloaded again, --force downloads everything
+    server.files["/transfers_latest.json"] = (b'{"transfers": [{}]}', False)
+    server.files["/lacnic.db.gz"] = (gzip.compress(b"inetnum: 1.0.0.0 - 1.0.1.255\n\n"), True)
+    results = download_sources(sources, directory)
+    assert [result.status for result in results] == ["not_modified", "downloaded", "downloaded", "not_modified"]
+    assert open(results[2].path, "rb").read() == b'{"transfers": [{}]}'
+    assert [result.status for result in download_sources(sources, directory, force=True)] == ["downloaded"] * 4
+
+    server.statuses()
+
+    # Only the listed dumps are decompressed (the one split in shards by the importer), the
+    # validators are kept by URL so the .gz file already there is decompressed without downloading it again
+    results = download_sources(sources, directory, decompress={"ripe.db.inetnum.gz"})
+    assert [result.status for result in results] == ["not_modified", "not_modified", "unchanged", "not_modified"]
+    assert results[0].path == os.path.join(directory, "ripe.db.inetnum") and open(results[0].path, "rb").read() == inetnum
+    assert not os.path.exists(os.path.join(directory, "ripe.db.inetnum.gz"))
+    assert os.path.getmtime(results[0].path) == email.utils.parsedate_to_datetime(LAST_MODIFIED).timestamp()
+    assert results[1].path == os.path.join(directory, "lacnic.db.gz") and results[1].status == "not_modified"
+    assert server.statuses()["/ripe.db.inetnum.gz"] == 304
+
+    # Decompressed while downloading, the .gz file is replaced by the decompressed one
+    server.files["/arin.db.gz"] = (gzip.compress(b"route: 3.0.0.0/8\n\n"), True)
+    results = download_sources(sources, directory, decompress=True)
+    assert [result.status for result in results] == ["not_modified", "not_modified", "unchanged", "downloaded"]
+    assert results[0].path == os.path.join(directory, "ripe.db.inetnum")
+    assert open(results[0].path, "rb").read() == inetnum
+    assert results[1].path == os.path.join(directory, "lacnic.db") and results[3].path == os.path.join(directory, "arin.db")
+    assert open(results[3].path, "rb").read() == b"route: 3.0.0.0/8\n\n"
+    assert not [name for name in os.listdir(directory) if name.endswith(".gz")]
+    assert [result.status for result in download_sources(sources, directory, decompress=True)][:2] == ["not_modified", "not_modified"]
+
+    # The decompressed files are kept when the .gz files are requested
+    server.statuses()
+    results = download_sources(sources, directory)
+    assert [result.status for result in results] == ["not_modified", "not_modified", "unchanged", "not_modified"]
+    assert results[0].path == os.path.join(directory, "ripe.db.inetnum")
+    assert 200 not in [status for path, status in server.statuses().items() if path.endswith(".gz")]
+
+    # The state of older versions, keyed by file name, is still used
+    state_path = os.path.join(directory, ".download_state.json")
+    with open(state_path) as file:
+        state = json.load(file)
+    assert set(state) == {source.url for source in sources}
+    with open(state_path, "w") as file:
+        json.dump({entry["url"].rsplit("/", 1)[1]: entry for entry in state.values()}, file)
+    results = download_sources(sources, directory, decompress=True)
+    assert [result.status for result in results] == ["not_modified", "not_modified", "unchanged", "not_modified"]
+    with open(state_path) as file:
+        assert json.load(file) == state
+
+    # Files of an older run without the state file are requested with If-Modified-Since
+    os.remove(os.path.join(directory, ".download_state.json"))
+    results = download_sources(sources, directory, decompress=True)
+    assert results[0].status == "not_modified" and results[2].status == "downloaded"
+
+    # A failed download keeps the previous file and doesn't stop the others
+    del server.files["/lacnic.db.gz"]
+    results = download_sources(sources, directory, decompress=True)
+    assert results[1].status == "failed" and results[1].path == os.path.join(directory, "lacnic.db"), results[1]
+    assert results[0].status == "not_modified"
+    assert not [name for name in os.listdir(directory) if name.endswith(".part")]
+
+server.httpd.shutdown()
+print("Downloader OK")
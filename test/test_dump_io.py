@@ -0,0 +1,97 @@
+from pathlib import Path
+import bz2
+import gzip
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from benchmarks.fixtures import write_rpsl_v4
+from lib.dump_io import ThreadedReader, is_compressed, open_dump, resolve_dump_path
+from lib.ripe_parser import RIPE_PARSER
+from lib.rpsl_reader import read_rpsl_objects
+
+
+class FailingSource(io.BytesIO):
+    def read(self, size=-1):
+        if self.tell() >= 100:
+            raise OSError("truncated dump")
+        return super().read(min(size, 50))
+
+
+with tempfile.TemporaryDirectory() as directory:
+    plain_path = os.path.join(directory, "ripe.db.inetnum")
+    write_rpsl_v4(plain_path, 2000, random.Random(8))
+    with open(plain_path, "rb") as file:
+        data = file.read()
+
+    paths = [plain_path]
+    with open(plain_path, "rb") as source, gzip.open(plain_path + ".gz", "wb") as target:
+        shutil.copyfileobj(source, target)
+    paths.append(plain_path + ".gz")
+    with open(plain_path, "rb") as source, bz2.open(plain_path + ".bz2", "wb") as target:
+        shutil.copyfileobj(source, target)
+    paths.append(plain_path + ".bz2")
+    try:
+        import zstandard
+    except ImportError:
+        print("zstandard isn't installed, .zst not tested")
+    else:
+        with open(plain_path, "rb") as source, open(plain_path + ".zst", "wb") as target:
+            zstandard.ZstdCompressor().copy_stream(source, target)
+        paths.append(plain_path + ".zst")
+
+    expected = []
+    RIPE_PARSER.parse_file(plain_path, expected.append)
+    assert len(expected) > 1000
+    for path in paths:
+        assert is_compressed(path) == (path != plain_path)
+        for threaded in (True, False):
+            with open_dump(path, threaded=threaded) as file:
+                assert file.read() == data, (path, threaded)
+        blocks = []
+        RIPE_PARSER.parse_file(path, blocks.append)
+        assert blocks == expected, path
+        # Small chunks split the objects across the reads of the decompressor
+        assert list(read_rpsl_objects(path, chunk_size=1000)) == list(read_rpsl_objects(plain_path)), path
+
+    # Byte ranges need a seekable plain file
+    for path in paths[1:]:
+        for start, end in ((10, None), (0, 1000)):
+            ranged = []
+            try:
+                RIPE_PARSER.parse_file(path, ranged.append, start=start, end=end)
+            except ValueError as error:
+                assert path in str(error) and not ranged
+            else:
+                raise AssertionError(f"read a byte range of {path}")
+
+    # A missing plain dump resolves to its compressed variant
+    os.remove(plain_path)
+    assert resolve_dump_path(plain_path) == plain_path + ".gz"
+    assert resolve_dump_path(os.path.join(directory, "missing")) == os.path.join(directory, "missing")
+
+# The background reader hands over the data in order, stops when closed early and re-raises the read errors
+payload = bytes(random.Random(1).getrandbits(8) for _ in range(100000))
+reader = io.BufferedReader(ThreadedReader(io.BytesIO(payload), chunk_size=777, max_chunks=1), buffer_size=1000)
+assert reader.read(10) == payload[:10] and reader.read() == payload[10:] and reader.read() == b""
+reader.close()
+reader = ThreadedReader(io.BytesIO(payload), chunk_size=100, max_chunks=1)
+assert reader.read(5) == payload[:5]
+reader.close()
+assert reader.closed and not reader._thread.is_alive()
+reader = ThreadedReader(FailingSource(payload), chunk_size=50)
+try:
+    while reader.read(64):
+        pass
+except OSError as error:
+    assert "truncated dump" in str(error)
+else:
+    raise AssertionError("the read error was lost")
+reader.close()
+print("Dump IO OK")
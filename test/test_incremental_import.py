@@ -0,0 +1,111 @@
+from pathlib import Path
+import ipaddress
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from benchmarks.fixtures import write_rpsl_v4, write_rpsl_v6
+from lib.db import FINGERPRINTS_TABLE, SQLiteHandler
+from lib.incremental_import import IncrementalImporter
+from lib.ripe_parser import RIPE_PARSER
+
+
+def full_import(db_path: str, dumps: dict):
+    db_handler = SQLiteHandler(db_path)
+    db_handler.create_table()
+    with db_handler.bulk_writer() as writer:
+        for registry, blocks in dumps.items():
+            # A generator: the blocks are read for the rows and for the fingerprints
+            writer.write_many((block for block in blocks), registry=registry)
+    db_handler.create_indexes()
+
+
+def incremental_import(db_path: str, dumps: dict) -> dict:
+    importer = IncrementalImporter(db_path)
+    for registry, blocks in dumps.items():
+        # In batches, like the parser callbacks
+        for position in range(0, len(blocks), 100):
+            importer.add_blocks(registry, blocks[position:position + 100])
+    changes = importer.apply()
+    importer.close()
+    return changes
+
+
+def contents(db_path: str):
+    """The rows with their fingerprint, without the ids."""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        f'''SELECT d.first_ip, d.last_ip, d.first_ip_int, d.last_ip_int, d.ip_version, d.subnet, d.network_prefix,
+           d.netname, d.country, d.descr, d.mnt_by, f.registry, f.fingerprint
+           FROM ip_data d LEFT JOIN {FINGERPRINTS_TABLE} f ON f.ip_data_id = d.id'''
+    ).fetchall()
+    orphans = conn.execute(f"SELECT COUNT(*) FROM {FINGERPRINTS_TABLE} WHERE ip_data_id NOT IN (SELECT id FROM ip_data)").fetchone()[0]
+    conn.close()
+    assert orphans == 0
+    return sorted(rows, key=repr)
+
+
+rng = random.Random(8)
+with tempfile.TemporaryDirectory() as directory:
+    dumps = {}
+    for registry, write in (("ripe-inetnum", write_rpsl_v4), ("ripe-inet6num", write_rpsl_v6)):
+        path = os.path.join(directory, registry)
+        write(path, 800, random.Random(registry))
+        dumps[registry] = []
+        RIPE_PARSER.parse_file(path, dumps[registry].append)
+    db_path = os.path.join(directory, "geolocation_db.db")
+    full_import(db_path, dumps)
+
+    # The next release of the dumps
+    expected = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    new_dumps = {}
+    for registry, blocks in dumps.items():
+        new_blocks = []
+        for block in blocks:
+            draw = rng.random()
+            if draw < 0.05:
+                expected["removed"] += 1
+                continue
+            if draw < 0.10:
+                # Same range, other values: updated in place
+                block = block._replace(country="NL", descr=f"{block.descr} (updated)")
+                expected["changed"] += 1
+            elif draw < 0.13:
+                # Another range: the old row is removed and the new one added
+                block = RIPE_PARSER.build_block(
+                    f"{ipaddress.ip_address(block.first_ip_int)}/{block.subnet + 1}", ip_version=block.ip_version,
+                    netname=block.netname, country=block.country, descr=block.descr, mnt_by=block.mnt_by,
+                )
+                expected["removed"] += 1
+                expected["added"] += 1
+            else:
+                expected["unchanged"] += 1
+            new_blocks.append(block)
+        rng.shuffle(new_blocks)
+        new_dumps[registry] = new_blocks
+    # New blocks, one of them twice
+    added = [RIPE_PARSER.build_block("198.51.100.0/24", ip_version=4, netname="NEW-NET", country="IT")] * 2
+    added.append(RIPE_PARSER.build_block("2001:db8:ffff::/48", ip_version=6, netname="NEW-NET6", country="DE"))
+    new_dumps["ripe-inetnum"] += added[:2]
+    new_dumps["ripe-inet6num"] += added[2:]
+    expected["added"] += len(added)
+
+    changes = incremental_import(db_path, new_dumps)
+    print(changes)
+    assert changes == expected, (changes, expected)
+
+    # Same rows and fingerprints as a full import of the new release
+    fresh_path = os.path.join(directory, "fresh.db")
+    full_import(fresh_path, new_dumps)
+    assert contents(db_path) == contents(fresh_path)
+
+    # Nothing changed: nothing written
+    total = sum(len(blocks) for blocks in new_dumps.values())
+    assert incremental_import(db_path, new_dumps) == {"added": 0, "changed": 0, "removed": 0, "unchanged": total}
+    assert contents(db_path) == contents(fresh_path)
+print("Incremental import OK")
@@ -0,0 +1,59 @@
+from pathlib import Path
+import json
+import os
+import sys
+import tempfile
+import time
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from lib.instrumentation import LatencyHistogram, PipelineStats
+
+lines = []
+stats = PipelineStats(report_interval=0.01, profile_stages=["parse"], log=lines.append)
+
+# Nested stages are exclusive: the outer timer doesn't count the inner one
+with stats.timer("parse:ripe"):
+    time.sleep(0.05)
+    with stats.timer("insert"):
+        time.sleep(0.1)
+    stats.add("blocks_parsed", 10)
+    stats.add("blocks_parsed:ripe", 10)
+time.sleep(0.02)
+stats.progress()
+print(stats.timers)
+assert 0.05 <= stats.timers["parse:ripe"] < 0.1
+assert stats.timers["insert"] >= 0.1
+assert len(lines) == 1 and "blocks_parsed=10" in lines[0] and "blocks_parsed:ripe" not in lines[0]
+
+# Worker snapshots are added to the main instance
+worker = PipelineStats()
+with worker.timer("parse:ripe"):
+    worker.add("blocks_parsed", 5)
+stats.merge(worker.snapshot())
+assert stats.counters["blocks_parsed"] == 15
+
+summary_path = str(Path(tempfile.gettempdir()) / "test_instrumentation.json")
+stats.write_summary(summary_path)
+with open(summary_path) as file:
+    summary = json.load(file)
+print(summary)
+assert summary["counters"] == {"blocks_parsed": 15, "blocks_parsed:ripe": 10}
+assert set(summary["timers"]) == {"parse:ripe", "insert"}
+assert set(summary["rates"]) == {"blocks_parsed"}
+
+paths = stats.dump_profiles(str(Path(tempfile.gettempdir()) / "test_instrumentation_profiles"))
+assert [os.path.basename(path) for path in paths] == ["parse_ripe.prof"]
+
+# Latencies are counted in buckets, quantiles are bucket upper bounds
+histogram = LatencyHistogram()
+for _ in range(98):
+    histogram.observe(0.0003)
+histogram.observe(0.02)
+histogram.observe(12.0)
+summary = histogram.summary()
+assert (summary["count"], summary["max"], summary["p50"], summary["p99"]) == (100, 12.0, 0.0005, 0.025), summary
+assert histogram.quantile(1.0) == 12.0 and LatencyHistogram().quantile(0.5) == 0.0
+assert summary["buckets"]["0.00025"] == 0 and summary["buckets"]["0.0005"] == 98 and summary["buckets"]["+Inf"] == 100
+json.dumps(summary)
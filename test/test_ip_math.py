@@ -0,0 +1,85 @@
+from pathlib import Path
+import ipaddress
+import random
+import sys
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from lib import ip_math
+from lib.db import SQLiteHandler
+from lib.ripe_parser import RIPE_PARSER
+
+rng = random.Random(7)
+
+# Same values and text as ipaddress
+for _ in range(20000):
+    value = rng.getrandbits(32)
+    assert ip_math.format_ipv4(value) == str(ipaddress.IPv4Address(value))
+    assert ip_math.parse_ipv4(ip_math.format_ipv4(value)) == value
+
+    value = rng.getrandbits(128)
+    # Runs of zero groups exercise the "::" compression
+    for shift in range(0, 128, 16):
+        if rng.random() < 0.5:
+            value &= ~(0xFFFF << shift)
+    address = ipaddress.IPv6Address(value)
+    assert ip_math.format_ipv6(value) == str(address), (ip_math.format_ipv6(value), str(address))
+    assert ip_math.format_ipv6_exploded(value) == address.exploded
+    assert ip_math.parse_ipv6(str(address)) == value
+    assert ip_math.parse_ipv6(address.exploded.upper()) == value
+
+for text in ["::", "::1", "1::", "::ffff:1.2.3.4", "1:2:3:4:5:6:1.2.3.4", "1::2::3", "1:::2", "12345::", "g::",
+             "1:2:3:4:5:6:7", "1:2:3:4:5:6:7:8:9", "1:2:3:4:5:6:7::8", "1.2.3.4::", "::1.2.3", " ::1", ""]:
+    try:
+        expected = int(ipaddress.IPv6Address(text))
+    except ValueError:
+        expected = None
+    assert ip_math.parse_ipv6(text) == expected, text
+
+assert ip_math.parse_ipv4("012.000.001.000") == (12 << 24) | 256
+for text in ["1.2.3", "1.2.3.4.5", "256.1.1.1", "1..2.3", "1.2.3.4 ", "-1.2.3.4", "1.2.3.١"]:
+    assert ip_math.parse_ipv4(text) is None, text
+assert ip_math.parse_ipv4("5.183.80", short=True) == ip_math.parse_ipv4("5.183.80.0")
+assert ip_math.parse_network("5.183.80/22", 4) == (ip_math.parse_ipv4("5.183.80.0"), ip_math.parse_ipv4("5.183.83.255"), 22)
+assert ip_math.parse_network("2001:db8::1/32", 6)[:2] == (0x20010DB8 << 96, (0x20010DB8 << 96) | (2**96 - 1))
+
+# The CIDR cover is the one of summarize_address_range
+for _ in range(5000):
+    for bits, address_class in ((32, ipaddress.IPv4Address), (128, ipaddress.IPv6Address)):
+        first = rng.getrandbits(bits)
+        last = min(first + rng.getrandbits(rng.randint(0, bits - 1)), 2**bits - 1)
+        expected = [(int(network.network_address), network.prefixlen)
+                    for network in ipaddress.summarize_address_range(address_class(first), address_class(last))]
+        assert ip_math.cidr_cover(first, last, bits) == expected
+        assert ip_math.prefix_length(first, last, bits) == (expected[0][1] if len(expected) == 1 else None)
+        assert ip_math.range_prefix_length(first, last, bits) == expected[0][1]
+assert ip_math.cidr_cover(0, 2**32 - 1, 32) == [(0, 0)]
+assert ip_math.cidr_cover(2, 1, 32) == [] and ip_math.range_prefix_length(2, 1, 32) is None
+
+# format_block: a range that is not one network gets the prefix of the first network of its cover
+# (the bit length of its size gave a /22 here, 1024 addresses for a range of 768)
+block = RIPE_PARSER.format_block({"inetnum": "10.0.0.0 - 10.0.2.255", "netname": "NET"})
+assert (block["first_ip"], block["last_ip"], block["subnet"]) == ("10.0.0.0", "10.0.2.255", 23)
+assert SQLiteHandler.block_to_row(block)[5] == 23
+block = RIPE_PARSER.format_block({"inetnum": "10.0.0.128 - 10.0.1.127"})
+assert block["subnet"] == 25
+# The /23 of 10.0.1.0 - 10.0.3.255 is 10.0.2.0/23, first_ip/subnet is the /24 starting at 10.0.1.0
+block = RIPE_PARSER.format_block({"inetnum": "10.0.1.0 - 10.0.3.255"})
+assert block["subnet"] == 24
+assert ipaddress.ip_network(f"{block['first_ip']}/{block['subnet']}").network_address == ipaddress.ip_address(block["first_ip"])
+block = RIPE_PARSER.format_block({"inetnum": "5.183.80/22"})
+assert (block["first_ip"], block["last_ip"], block["subnet"]) == ("5.183.80.0", "5.183.83.255", 22)
+block = RIPE_PARSER.format_block({"inetnum": "2a00:1:2::/48", "ipVersion": 6})
+assert (block["first_ip"], block["network_prefix"], block["subnet"]) == ("2a00:0001:0002:0000:0000:0000:0000:0000", "2a00:1:2::", 48)
+block = RIPE_PARSER.format_block({"inetnum": "2a00:1:2:: - 2a00:1:2:0:ffff:ffff:ffff:fffe", "ipVersion": 6})
+assert block["subnet"] == 65
+# The old path didn't set a subnet on these blocks, block_to_row computes it
+assert SQLiteHandler.block_to_row({"first_ip": "10.0.0.0", "last_ip": "10.0.0.255", "ip_version": 4, "country": "IT"})[5] == 24
+for inetnum in ["10.0.0.0 - 10.0.300.0", "10.0.0.0/33", "10.0.0.0"]:
+    try:
+        RIPE_PARSER.format_block({"inetnum": inetnum})
+        raise AssertionError(f"{inetnum} must be rejected")
+    except ValueError:
+        pass
+print("IP math OK")
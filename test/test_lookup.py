@@ -0,0 +1,95 @@
+from pathlib import Path
+import ipaddress
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+import numpy as np
+
+from benchmarks.fixtures import write_rpsl_v4, write_rpsl_v6
+from lib.common import ip_int_from_db, ip_int_to_db
+from lib.db import SQLiteHandler
+from lib.lookup import IPLookup
+from lib.ripe_parser import RIPE_PARSER
+
+
+def sql_lookup(conn, ip):
+    """Reference answer: the smallest range containing ip, ties go to the last inserted row."""
+    address = ipaddress.ip_address(ip)
+    value = ip_int_to_db(int(address), address.version)
+    rows = conn.execute(
+        "SELECT id, first_ip_int, last_ip_int FROM ip_data WHERE ip_version = ? AND first_ip_int <= ? AND last_ip_int >= ?",
+        (address.version, value, value),
+    ).fetchall()
+    if not rows:
+        return None
+    return min(rows, key=lambda row: (ip_int_from_db(row[2]) - ip_int_from_db(row[1]), -row[0]))[0]
+
+
+rng = random.Random(4)
+with tempfile.TemporaryDirectory() as directory:
+    # Synthetic RIPE dumps, IPv4 and IPv6 allocations with nested assignments
+    blocks = []
+    for name, write in (("inetnum.db", write_rpsl_v4), ("inet6num.db", write_rpsl_v6)):
+        write(os.path.join(directory, name), 1500, random.Random(2))
+        RIPE_PARSER.parse_file(os.path.join(directory, name), blocks.append)
+    db_path = os.path.join(directory, "geolocation_db.db")
+    db_handler = SQLiteHandler(db_path)
+    db_handler.create_table()
+    db_handler.insert_data(blocks)
+    db_handler.create_indexes()
+
+    # A missing database is an error, not a new empty file
+    missing_path = os.path.join(directory, "missing.db")
+    try:
+        IPLookup.from_sqlite(missing_path)
+    except FileNotFoundError:
+        assert not os.path.exists(missing_path)
+    else:
+        raise AssertionError("loaded a missing database")
+
+    start = time.time()
+    ip_lookup = IPLookup.from_sqlite(db_path)
+    print(f"Loaded {len(ip_lookup.records)} ranges in {time.time() - start:.2f}s")
+
+    conn = sqlite3.connect(db_path)
+    samples = [str(ipaddress.ip_address(row[0])) for row in conn.execute("SELECT first_ip FROM ip_data")]
+    samples = rng.sample(samples, min(2000, len(samples)))
+    samples += [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(2000)]
+    samples += [str(ipaddress.ip_address(int(ipaddress.ip_address(ip)) + 1)) for ip in samples[:500]]
+
+    mismatches = 0
+    for ip in samples:
+        record = ip_lookup.lookup(ip)
+        expected = sql_lookup(conn, ip)
+        if (record["id"] if record else None) != expected:
+            mismatches += 1
+            print(f"Mismatch for {ip}: lookup={record} sql={expected}")
+    print(f"Checked {len(samples)} addresses, {mismatches} mismatches")
+    assert mismatches == 0
+
+    # Integer arrays: the values outside 0..2**32-1 are misses, not wrapped around to valid addresses
+    hits = [int(ipaddress.IPv4Address(ip)) for ip in samples if ":" not in ip and ip_lookup.lookup_index(ip) >= 0][:100]
+    assert hits
+    expected = [ip_lookup.lookup_index(str(ipaddress.IPv4Address(value))) for value in hits]
+    for values in (np.array(hits, dtype=np.uint32), np.array(hits, dtype=np.int64), np.array(hits, dtype=np.uint64)):
+        assert ip_lookup.lookup_many(values).record_indexes.tolist() == expected
+    out_of_range = [value + (1 << 32) for value in hits] + [value - (1 << 32) for value in hits] + [-1]
+    for values in (np.array(hits + out_of_range, dtype=np.int64), np.array(hits + out_of_range[:len(hits)], dtype=np.uint64)):
+        indexes = ip_lookup.lookup_many(values).record_indexes.tolist()
+        assert indexes == expected + [-1] * (len(values) - len(hits)), indexes
+    assert ip_lookup.lookup_many(np.array([-1, -5], dtype=np.int32)).record_indexes.tolist() == [-1, -1]
+
+    start = time.time()
+    for ip in samples * 100:
+        ip_lookup.lookup_index(ip)
+    elapsed = time.time() - start
+    print(f"{len(samples) * 100 / elapsed:.0f} lookups/sec")
+    conn.close()
+print("Lookup OK")
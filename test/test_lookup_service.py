@@ -0,0 +1,156 @@
+from pathlib import Path
+import asyncio
+import http.client
+import ipaddress
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from benchmarks.fixtures import write_rpsl_v4, write_rpsl_v6
+from lib.db import SQLiteHandler
+from lib.lookup import IPLookup
+from lib.lookup_service import LookupService
+from lib.ripe_parser import RIPE_PARSER
+
+
+def build_db(directory: str, db_path: str, seed: int):
+    """Fixture database of synthetic RIPE dumps, written next to db_path and moved over it like a new build."""
+    blocks = []
+    for name, write in (("inetnum.db", write_rpsl_v4), ("inet6num.db", write_rpsl_v6)):
+        write(os.path.join(directory, name), 400, random.Random(seed))
+        RIPE_PARSER.parse_file(os.path.join(directory, name), blocks.append)
+    build_path = db_path + ".build"
+    db_handler = SQLiteHandler(build_path)
+    db_handler.create_table()
+    db_handler.insert_data(blocks)
+    os.replace(build_path, db_path)
+    return IPLookup.from_sqlite(db_path)
+
+
+def samples(reference: IPLookup, rng: random.Random) -> list:
+    ips = [record[1] for record in rng.sample(reference.records, 200)]
+    ips += [str(ipaddress.ip_address(record[1]) + 1) for record in rng.sample(reference.records, 100)]
+    ips += [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(100)]
+    return [str(ipaddress.ip_address(ip)) for ip in ips]
+
+
+def request(conn: http.client.HTTPConnection, method: str, path: str, body=None):
+    conn.request(method, path, body=None if body is None else json.dumps(body), headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+rng = random.Random(5)
+with tempfile.TemporaryDirectory() as directory:
+    db_path = os.path.join(directory, "geolocation_db.db")
+    reference = build_db(directory, db_path, 1)
+
+    service = LookupService(db_path, cache_size=300, max_batch=1000)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server = asyncio.run_coroutine_threadsafe(service.start("127.0.0.1", 0), loop).result()
+    watcher = asyncio.run_coroutine_threadsafe(service.watch(0.05), loop)
+    port = server.sockets[0].getsockname()[1]
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+
+    # Single lookups over one keep-alive connection, same answers as IPLookup
+    ips = samples(reference, rng)
+    for ip in ips + ips[-50:]:
+        status, payload = request(conn, "GET", f"/ip/{ip}")
+        expected = reference.lookup(ip)
+        assert (status, payload) == ((200, expected) if expected else (404, {"ip": ip, "error": "not found"})), ip
+    assert request(conn, "GET", "/ip/300.1.1.1") == (400, {"ip": "300.1.1.1", "error": "invalid address"})
+    cache = service.metrics()["cache"]
+    assert cache["hits"] >= 50 and cache["size"] == 300 and cache["evictions"] > 0, cache
+
+    # Batches keep the input order, unknown and invalid addresses are null
+    status, payload = request(conn, "POST", "/lookup", ips + ["nope", "::1"])
+    assert status == 200 and payload["results"] == [reference.lookup(ip) for ip in ips] + [None, None]
+    assert request(conn, "POST", "/lookup", {"ips": ips[:3]})[1]["results"] == [reference.lookup(ip) for ip in ips[:3]]
+    assert request(conn, "POST", "/lookup", ["1.1.1.1"] * 1001)[0] == 413
+    assert request(conn, "POST", "/lookup", [1, 2])[0] == 400
+    assert request(conn, "GET", "/lookup")[0] == 405
+    assert request(conn, "GET", "/nothing")[0] == 404
+
+    # Expect: 100-continue and a request split in small writes
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        body = json.dumps(ips[:2]).encode()
+        client.sendall(b"POST /lookup HTTP/1.1\r\nHost: x\r\nExpect: 100-continue\r\nConnection: close\r\n")
+        client.sendall(f"Content-Length: {len(body)}\r\n\r\n".encode())
+        assert client.recv(1024).startswith(b"HTTP/1.1 100 Continue")
+        for position in range(0, len(body), 7):
+            client.sendall(body[position:position + 7])
+        data = b""
+        while chunk := client.recv(65536):
+            data += chunk
+    assert data.startswith(b"HTTP/1.1 200 OK") and json.loads(data.split(b"\r\n\r\n", 1)[1])["results"][1] == reference.lookup(ips[1])
+
+    # A new database replaces the file while clients keep sending requests: nothing fails
+    errors = []
+    answered = []
+    stop = threading.Event()
+
+    def client_loop():
+        client = http.client.HTTPConnection("127.0.0.1", port)
+        count = 0
+        while not stop.is_set():
+            try:
+                status, _ = request(client, "GET", f"/ip/{ips[count % len(ips)]}")
+                if status not in (200, 404):
+                    errors.append(status)
+            except Exception as error:
+                errors.append(error)
+            count += 1
+        answered.append(count)
+
+    threads = [threading.Thread(target=client_loop) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    new_reference = build_db(directory, db_path, 2)
+    deadline = time.time() + 30
+    while service.generation < 2 and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.2)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print(f"Answered {sum(answered)} requests during the reload, errors: {errors}")
+    assert service.generation == 2 and not errors and min(answered) > 0
+    for ip in ips:
+        status, payload = request(conn, "GET", f"/ip/{ip}")
+        assert payload == new_reference.lookup(ip) or (status == 404 and new_reference.lookup(ip) is None), ip
+
+    # A broken file is not loaded, the previous generation keeps answering
+    with open(db_path + ".build", "wb") as file:
+        file.write(b"not a database" * 100)
+    os.replace(db_path + ".build", db_path)
+    deadline = time.time() + 10
+    while not service.reload_errors and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.3)
+    assert service.reload_errors == 1 and service.generation == 2
+    assert request(conn, "GET", f"/ip/{ips[0]}")[1] == new_reference.lookup(ips[0])
+
+    status, metrics = request(conn, "GET", "/metrics")
+    print(json.dumps({key: metrics[key] for key in ("generation", "ranges", "cache", "requests")}))
+    assert metrics["ranges"] == len(new_reference.records)
+    for route, count in metrics["requests"].items():
+        latency = metrics["latency"][route]
+        assert latency["count"] == latency["buckets"]["+Inf"] == count, route
+    assert metrics["latency"]["GET /ip"]["p50"] <= metrics["latency"]["GET /ip"]["p99"]
+    assert request(conn, "GET", "/health")[1]["generation"] == 2
+
+    conn.close()
+    watcher.cancel()
+    server.close()
+    asyncio.run_coroutine_threadsafe(server.wait_closed(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+print("Lookup service OK")
@@ -0,0 +1,62 @@
+from pathlib import Path
+import bisect
+import ipaddress
+import random
+import sys
+import tempfile
+import time
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+import maxminddb
+
+from lib.mmdb_builder import write_mmdb
+
+random.seed(42)
+
+# Sorted non overlapping ranges: IPv4 in ::/96 followed by IPv6 ranges
+bounds = sorted(set(random.getrandbits(32) for _ in range(20000)))
+bounds += sorted(set((0x2000 << 112) | random.getrandbits(112) for _ in range(20000)))
+records = [
+    {"netname": f"NET-{i}", "asn_number": i * 977, "country_name": "Italy", "subnet": f"10.0.{i}.0/24"}
+    for i in range(50)
+]
+records.append({"netname": "X" * 400, "big": 2 ** 100, "negative": -7, "ratio": 0.5, "flags": [True, False]})
+ranges = [(first, last, random.choice(records)) for first, last in zip(bounds[::2], bounds[1::2])]
+
+output_path = str(Path(tempfile.gettempdir()) / "test_mmdb_builder.mmdb")
+start = time.time()
+stats = write_mmdb(output_path, ranges, ip_version=6)
+print(f"Wrote {len(ranges)} ranges in {time.time() - start:.2f}s: {stats}")
+assert stats["unique_records"] == len({repr(record) for _, _, record in ranges})
+
+starts = [first for first, _, _ in ranges]
+
+
+def expected(value):
+    position = bisect.bisect_right(starts, value) - 1
+    if position >= 0 and ranges[position][1] >= value:
+        return ranges[position][2]
+    return None
+
+
+reader = maxminddb.open_database(output_path)
+mismatches = 0
+checked = 0
+for first, last, _ in ranges:
+    for value in (first - 1, first, (first + last) // 2, last, last + 1):
+        if value < 0:
+            continue
+        checked += 1
+        if reader.get(ipaddress.IPv6Address(value)) != expected(value):
+            mismatches += 1
+            print(f"Mismatch for {ipaddress.IPv6Address(value)}")
+        if value < 2 ** 32:
+            checked += 1
+            if reader.get(ipaddress.IPv4Address(value)) != expected(value):
+                mismatches += 1
+                print(f"Mismatch for {ipaddress.IPv4Address(value)}")
+reader.close()
+print(f"Checked {checked} addresses, {mismatches} mismatches")
+assert mismatches == 0
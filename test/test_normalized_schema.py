@@ -0,0 +1,75 @@
+from pathlib import Path
+import os
+import sqlite3
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from lib.db import IP_DATA_COLUMNS, IP_RANGES_TABLE, STRING_TABLES, SQLiteHandler
+
+blocks = [
+    {
+        "first_ip": f"10.0.{i}.0", "last_ip": f"10.0.{i}.255", "first_ip_int": (10 << 24) | (i << 8),
+        "last_ip_int": (10 << 24) | (i << 8) | 255, "ip_version": 4, "netname": f"NET-{i % 10}",
+        "country": "IT" if i % 2 else "Unknown", "descr": None if i % 3 else "Some description",
+        "mnt-by": "RIPE-NCC-HM-MNT",
+    }
+    for i in range(200)
+]
+blocks.append({
+    "first_ip": "2001:db8::", "last_ip": "2001:db8::ffff", "first_ip_int": (0x20010db8 << 96),
+    "last_ip_int": (0x20010db8 << 96) | 0xFFFF, "ip_version": 6, "subnet": 112, "netname": "NET-1",
+    "country": "IT", "descr": "Città", "mnt-by": None,
+})
+
+rows = {}
+for normalized in (False, True):
+    db_name = str(Path(tempfile.gettempdir()) / f"test_normalized_schema_{normalized}.db")
+    if os.path.exists(db_name):
+        os.remove(db_name)
+    db_handler = SQLiteHandler(db_name)
+    db_handler.create_table(normalized=normalized)
+    with db_handler.bulk_writer() as writer:
+        writer.write_many(blocks[:100], registry="ripe-inetnum")
+        writer.write_many(blocks[100:], registry="ripe-inetnum")
+    db_handler.create_indexes()
+    conn = sqlite3.connect(db_name)
+    rows[normalized] = conn.execute(f"SELECT id, {', '.join(IP_DATA_COLUMNS)} FROM ip_data ORDER BY id").fetchall()
+    if normalized:
+        counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in STRING_TABLES.values()}
+        print(f"Lookup tables: {counts}")
+        assert counts == {"netnames": 10, "countries": 2, "descriptions": 2, "maintainers": 1}
+    conn.close()
+
+assert len(rows[True]) == len(blocks)
+assert rows[False] == rows[True]
+
+# Writes through the view (incremental import) are interned by its triggers
+conn = sqlite3.connect(db_name)
+conn.execute("UPDATE ip_data SET netname = ?, mnt_by = ? WHERE id = 1", ("RENAMED", "NEW-MNT"))
+conn.execute(f"INSERT INTO ip_data (id, {', '.join(IP_DATA_COLUMNS)}) VALUES (1000, {', '.join('?' * len(IP_DATA_COLUMNS))})", rows[True][1][1:])
+conn.execute("DELETE FROM ip_data WHERE id = 3")
+assert conn.execute("SELECT netname, mnt_by FROM ip_data WHERE id = 1").fetchone() == ("RENAMED", "NEW-MNT")
+assert conn.execute("SELECT * FROM ip_data WHERE id = 1000").fetchone()[1:] == rows[True][1][1:]
+assert conn.execute(f"SELECT COUNT(*) FROM {IP_RANGES_TABLE} WHERE id = 3").fetchone()[0] == 0
+assert conn.execute("SELECT COUNT(*) FROM maintainers").fetchone()[0] == 2
+conn.close()
+
+# commit_bytes counts the strings before they're replaced with their ids
+batch = blocks[:50]
+batch_bytes = sum(len(value) for block in batch for value in SQLiteHandler.block_to_row(block) if isinstance(value, str))
+for normalized in (False, True):
+    db_name = str(Path(tempfile.gettempdir()) / f"test_normalized_schema_commit_{normalized}.db")
+    if os.path.exists(db_name):
+        os.remove(db_name)
+    db_handler = SQLiteHandler(db_name)
+    db_handler.create_table(normalized=normalized)
+    with db_handler.bulk_writer(journal_mode="DELETE", exclusive=False, commit_rows=10 ** 9, commit_bytes=batch_bytes) as writer:
+        writer.write_many(batch)
+        reader = sqlite3.connect(db_name)
+        assert reader.execute("SELECT COUNT(*) FROM ip_data").fetchone()[0] == len(batch), normalized
+        reader.close()
+    os.remove(db_name)
+print("Normalized schema OK")
@@ -0,0 +1,69 @@
+from pathlib import Path
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from benchmarks.fixtures import write_rpsl_v4, write_rpsl_v6
+from lib.db import SQLiteHandler
+from lib.parallel_importer import ImportTask, run_import_tasks, shard_task
+
+
+class CrashingTask(ImportTask):
+    """A worker killed while parsing, like the OOM killer does."""
+
+    def run(self, cb):
+        os._exit(137)
+
+
+class FailingTask(ImportTask):
+    def run(self, cb):
+        raise ValueError("broken dump")
+
+
+def import_rows(db_path: str, tasks: list, workers: int) -> list:
+    db_handler = SQLiteHandler(db_path)
+    db_handler.create_table()
+    with db_handler.bulk_writer() as writer:
+        run_import_tasks(tasks, lambda task, blocks: writer.write_many(blocks, registry=task.name), workers=workers, batch_size=200)
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT first_ip, last_ip, first_ip_int, last_ip_int, ip_version, subnet, network_prefix, netname, country, descr, mnt_by, "
+        "registry, fingerprint FROM ip_data JOIN ip_data_fingerprints ON ip_data_id = id"
+    ).fetchall()
+    conn.close()
+    return sorted(rows, key=repr)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    v4_path = os.path.join(directory, "ripe.db.inetnum")
+    v6_path = os.path.join(directory, "ripe.db.inet6num")
+    write_rpsl_v4(v4_path, 3000, random.Random(1))
+    write_rpsl_v6(v6_path, 1000, random.Random(2))
+    tasks = [ImportTask("ripe-inetnum", "parse_file", v4_path), ImportTask("ripe-inet6num", "parse_file", v6_path)]
+
+    # The rows don't depend on the workers nor on the shards
+    serial = import_rows(os.path.join(directory, "serial.db"), tasks, workers=1)
+    sharded = shard_task(tasks[0], 4) + tasks[1:]
+    assert len(sharded) > 2
+    parallel = import_rows(os.path.join(directory, "parallel.db"), sharded, workers=3)
+    print(f"{len(serial)} rows, {len(sharded)} tasks")
+    assert len(serial) == 4000 and parallel == serial
+
+    # A failing task and a dead worker stop the import instead of hanging it
+    for bad_task in (FailingTask("broken", "parse_file", v4_path), CrashingTask("killed", "parse_file", v4_path)):
+        start = time.time()
+        try:
+            run_import_tasks(tasks + [bad_task], lambda task, blocks: None, workers=2)
+        except RuntimeError as error:
+            print(f"{type(bad_task).__name__}: {str(error).splitlines()[0]}")
+            assert bad_task.name in str(error)
+        else:
+            raise AssertionError(f"{bad_task.name} task didn't fail the import")
+        assert time.time() - start < 30
+print("Parallel importer OK")
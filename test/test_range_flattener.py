@@ -0,0 +1,112 @@
+from pathlib import Path
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from lib.block_filter import DEFAULT_BLOCK_FILTER
+from lib.common import ip_int_from_db
+from lib.db import SQLiteHandler
+from lib.range_flattener import FLAT_TABLE, build_flat_table, merge_identical, most_specific_intervals
+from lib.ripe_parser import RIPE_PARSER
+
+
+def owners(intervals: list) -> dict:
+    """Address -> record index of the flattened intervals, which must be sorted and disjoint."""
+    result = {}
+    for (first, last, record_index), following in zip(intervals, intervals[1:] + [None]):
+        assert first <= last and (following is None or last < following[0]), (first, last, following)
+        for address in range(first, last + 1):
+            result[address] = record_index
+    return result
+
+
+def reference_owners(ranges: list, by_size: bool = True) -> dict:
+    """The smallest range containing every address (the last one on ties), or the last one without by_size."""
+    result = {}
+    for first, last, record_index in ranges:
+        for address in range(first, last + 1):
+            current = result.get(address)
+            size = last - first
+            if current is None or ((size, -record_index) < current[:2] if by_size else record_index > current[2]):
+                result[address] = (size, -record_index, record_index)
+    return {address: owner[2] for address, owner in result.items()}
+
+
+# Nested, overlapping, adjacent and duplicated ranges
+ranges = [(0, 99, 0), (10, 19, 1), (15, 29, 2), (30, 39, 3), (100, 109, 4), (10, 19, 5), (50, 50, 6), (51, 52, 7)]
+intervals = most_specific_intervals(ranges)
+assert intervals == [(0, 9, 0), (10, 19, 5), (20, 29, 2), (30, 39, 3), (40, 49, 0), (50, 50, 6), (51, 52, 7), (53, 99, 0), (100, 109, 4)], intervals
+assert most_specific_intervals(ranges, by_size=False) == [(0, 9, 0), (10, 19, 5), (20, 29, 2), (30, 39, 3), (40, 49, 0), (50, 50, 6), (51, 52, 7), (53, 99, 0), (100, 109, 4)]
+assert most_specific_intervals([(0, 99, 1), (10, 19, 0)], by_size=False) == [(0, 99, 1)]
+assert most_specific_intervals([]) == [] and most_specific_intervals([(5, 4, 0)]) == []
+
+rng = random.Random(6)
+for _ in range(200):
+    ranges = []
+    for record_index in range(rng.randint(1, 30)):
+        first = rng.randrange(500)
+        ranges.append((first, min(first + rng.choice((0, 1, 3, 15, 63, 255)), 511), record_index))
+    for by_size in (True, False):
+        intervals = most_specific_intervals(ranges, by_size)
+        assert owners(intervals) == reference_owners(ranges, by_size), (ranges, by_size)
+        # Adjacent parts of the same owner are a single interval
+        assert all(not (a[2] == b[2] and a[1] + 1 == b[0]) for a, b in zip(intervals, intervals[1:]))
+
+    # Neighbours with the same attributes are merged, the first owner is kept
+    keys = [rng.choice("AB") for _ in ranges]
+    intervals = most_specific_intervals(ranges)
+    merged = merge_identical(intervals, keys.__getitem__)
+    merged_owners = owners(merged)
+    assert set(merged_owners) == set(owners(intervals))
+    assert all(keys[merged_owners[address]] == keys[owner] for address, owner in owners(intervals).items())
+    assert all(not (keys[a[2]] == keys[b[2]] and a[1] + 1 == b[0]) for a, b in zip(merged, merged[1:]))
+    assert {first for first, _, _ in merged} <= {first for first, _, _ in intervals}
+
+with tempfile.TemporaryDirectory() as directory:
+    db_path = os.path.join(directory, "geolocation_db.db")
+    blocks = [
+        RIPE_PARSER.build_block("81.0.0.0/8", netname="PARENT", country="IT"),
+        RIPE_PARSER.build_block("81.1.0.0/16", netname="CHILD", country="IT"),
+        RIPE_PARSER.build_block("81.2.0.0/16", netname="PARENT", country="IT"),
+        RIPE_PARSER.build_block("11.0.0.0/8", netname="ERX-NETBLOCK", country="US"),
+        RIPE_PARSER.build_block("2a02:1::/32", ip_version=6, netname="V6", country="DE"),
+        RIPE_PARSER.build_block("2a02:1:1::/48", ip_version=6, netname="V6-CHILD", country="DE"),
+    ]
+    db_handler = SQLiteHandler(db_path)
+    db_handler.create_table()
+    db_handler.insert_data(blocks)
+
+    def flat_rows():
+        conn = sqlite3.connect(db_path)
+        rows = [
+            (ip_version, ip_int_from_db(first), ip_int_from_db(last), netname)
+            for ip_version, first, last, netname in conn.execute(
+                f"SELECT f.ip_version, f.first_ip_int, f.last_ip_int, d.netname FROM {FLAT_TABLE} f "
+                "JOIN ip_data d ON d.id = f.ip_data_id ORDER BY f.ip_version, f.first_ip_int"
+            )
+        ]
+        conn.close()
+        return rows
+
+    v4 = lambda value: sum(int(part) << shift for part, shift in zip(value.split("."), (24, 16, 8, 0)))
+    v6 = 0x2A020001 << 96
+    # 81.2.0.0/16 has the attributes of its parent: merged with the rest of 81.0.0.0/8
+    assert build_flat_table(db_path, None) == {"rows": 6, "v4_intervals": 4, "v6_intervals": 3}
+    assert flat_rows() == [
+        (4, v4("11.0.0.0"), v4("11.255.255.255"), "ERX-NETBLOCK"),
+        (4, v4("81.0.0.0"), v4("81.0.255.255"), "PARENT"),
+        (4, v4("81.1.0.0"), v4("81.1.255.255"), "CHILD"),
+        (4, v4("81.2.0.0"), v4("81.255.255.255"), "PARENT"),
+        (6, v6, v6 + (1 << 80) - 1, "V6"),
+        (6, v6 + (1 << 80), v6 + (2 << 80) - 1, "V6-CHILD"),
+        (6, v6 + (2 << 80), v6 + (1 << 96) - 1, "V6"),
+    ]
+    # The rows excluded by the filter are left out
+    assert build_flat_table(db_path, DEFAULT_BLOCK_FILTER)["v4_intervals"] == 3
+    assert "ERX-NETBLOCK" not in {row[3] for row in flat_rows()}
+print("Range flattener OK")
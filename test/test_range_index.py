@@ -0,0 +1,88 @@
+from pathlib import Path
+import ipaddress
+import random
+import sys
+import tempfile
+import time
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+import numpy as np
+
+from lib.lookup import IPLookup
+from lib.range_flattener import most_specific_intervals
+from lib.range_index import INDEX_FIELDS, RangeIndex, write_range_index
+
+random.seed(7)
+
+# Nested and overlapping ranges, the flattening keeps the most specific one
+records = []
+v4_ranges = []
+v6_ranges = []
+for i in range(5000):
+    version = random.choice((4, 6))
+    bits = 32 if version == 4 else 128
+    size = 1 << random.randint(0, 24 if version == 4 else 80)
+    first = random.getrandbits(bits - 1) if version == 4 else (0x2000 << 112) | random.getrandbits(112)
+    last = min(first + size - 1, (1 << bits) - 1)
+    (v4_ranges if version == 4 else v6_ranges).append((first, last, len(records)))
+    records.append((
+        i + 1, None, None, version, None,
+        f"NET-{i % 300}", random.choice(("IT", "DE", "US", None)),
+        random.choice(("Some description", "Città", None)), f"MNT-{i % 40}",
+    ))
+
+ip_lookup = IPLookup(records, most_specific_intervals(v4_ranges), most_specific_intervals(v6_ranges))
+output_path = str(Path(tempfile.gettempdir()) / "test_range_index.idx")
+stats = write_range_index(output_path, ip_lookup)
+print(f"Wrote {output_path}: {stats}")
+assert stats["strings"] < stats["records"]
+
+start = time.time()
+index = RangeIndex(output_path)
+print(f"Opened the index in {(time.time() - start) * 1000:.2f}ms")
+
+
+def expected(ip):
+    result = ip_lookup.lookup(ip)
+    if result is None:
+        return None
+    return {field: result[field] for field in INDEX_FIELDS}
+
+
+addresses = []
+for first, last, _ in v4_ranges:
+    addresses += [str(ipaddress.IPv4Address(value)) for value in (first - 1, first, last, last + 1) if 0 <= value < 2 ** 32]
+for first, last, _ in v6_ranges:
+    addresses += [str(ipaddress.IPv6Address(value)) for value in (first - 1, first, last, last + 1) if 0 <= value < 2 ** 128]
+addresses += ["0.0.0.0", "255.255.255.255", "::", "::1", "ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff"]
+
+mismatches = 0
+for ip in addresses:
+    if index.lookup(ip) != expected(ip):
+        mismatches += 1
+        print(f"Mismatch for {ip}: {index.lookup(ip)} != {expected(ip)}")
+print(f"Checked {len(addresses)} addresses, {mismatches} mismatches")
+assert mismatches == 0
+
+v4_values = np.array([int(ipaddress.IPv4Address(ip)) for ip in addresses if ":" not in ip], dtype=np.uint32)
+offsets = index.lookup_many_v4(v4_values)
+for value, offset in zip(v4_values, offsets):
+    assert offset == index.lookup_offset(str(ipaddress.IPv4Address(int(value))))
+# The integers outside 0..2**32-1 are misses, not wrapped around to valid addresses
+hits = [int(value) for value, offset in zip(v4_values, offsets) if offset >= 0][:100]
+assert hits
+expected_offsets = index.lookup_many_v4(np.array(hits, dtype=np.uint32)).tolist()
+out_of_range = [value + (1 << 32) for value in hits] + [value - (1 << 32) for value in hits] + [-1]
+assert index.lookup_many_v4(np.array(hits + out_of_range, dtype=np.int64)).tolist() == expected_offsets + [-1] * len(out_of_range)
+assert index.lookup_many_v4(np.array(hits + out_of_range[:len(hits)], dtype=np.uint64)).tolist() == expected_offsets + [-1] * len(hits)
+assert index.lookup_many_v4(hits + out_of_range).tolist() == expected_offsets + [-1] * len(out_of_range)
+assert index.lookup_many_v4(np.array([-1, -5], dtype=np.int32)).tolist() == [-1, -1]
+
+try:
+    index.lookup("not an ip")
+    raise AssertionError("Invalid addresses must raise ValueError")
+except ValueError:
+    pass
+index.close()
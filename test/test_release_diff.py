@@ -0,0 +1,139 @@
+from pathlib import Path
+import gzip
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from benchmarks.fixtures import write_rpsl_v4, write_rpsl_v6
+from lib.db import FINGERPRINTS_TABLE, SQLiteHandler, set_metadata
+from lib.range_flattener import FLAT_TABLE, build_flat_table
+from lib.release_diff import apply_changeset, database_digest, diff_databases, read_changeset
+from lib.ripe_parser import RIPE_PARSER
+
+
+def build_db(db_path: str, blocks: list, normalized: bool = False, release: str = ""):
+    db_handler = SQLiteHandler(db_path)
+    db_handler.create_table(normalized)
+    with db_handler.bulk_writer() as writer:
+        writer.write_many(blocks, registry="ripe")
+    db_handler.create_indexes()
+    conn = sqlite3.connect(db_path)
+    set_metadata(conn, "release", release)
+    conn.commit()
+    conn.close()
+
+
+def contents(db_path: str):
+    """The rows without their ids, the fingerprints and the metadata, in a comparable form."""
+    conn = sqlite3.connect(db_path)
+    rows = sorted(conn.execute(
+        "SELECT ip_version, first_ip_int, last_ip_int, first_ip, last_ip, subnet, network_prefix, netname, country, descr, mnt_by FROM ip_data"
+    ), key=repr)
+    fingerprints = sorted(conn.execute(
+        f"SELECT d.first_ip_int, d.netname, f.registry, f.fingerprint FROM ip_data d JOIN {FINGERPRINTS_TABLE} f ON f.ip_data_id = d.id"
+    ), key=repr)
+    metadata = conn.execute("SELECT value FROM import_metadata WHERE key = 'release'").fetchone()
+    flat = conn.execute(f"SELECT COUNT(*) FROM {FLAT_TABLE}").fetchone()[0] if conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (FLAT_TABLE,)).fetchone() else None
+    conn.close()
+    return rows, fingerprints, metadata, flat
+
+
+rng = random.Random(3)
+with tempfile.TemporaryDirectory() as directory:
+    blocks = []
+    for name, write in (("inetnum.db", write_rpsl_v4), ("inet6num.db", write_rpsl_v6)):
+        write(os.path.join(directory, name), 600, random.Random(7))
+        RIPE_PARSER.parse_file(os.path.join(directory, name), blocks.append)
+    # The new release: reassigned ranges, removed and added blocks, duplicated ranges
+    new_blocks = []
+    for block in blocks:
+        draw = rng.random()
+        if draw < 0.05:
+            continue
+        if draw < 0.10:
+            block = block._replace(country="NL")
+        elif draw < 0.13:
+            block = block._replace(netname=block.netname + "-NEW", mnt_by=None)
+        elif draw < 0.15:
+            new_blocks.append(block._replace(descr="Second object of the range"))
+        new_blocks.append(block)
+    new_blocks += [
+        RIPE_PARSER.build_block("198.51.100.0/24", ip_version=4, netname="ADDED", country="IT"),
+        RIPE_PARSER.build_block("2001:db8:ffff::/48", ip_version=6, netname="ADDED6", country="DE", descr="Città"),
+    ]
+    rng.shuffle(new_blocks)
+
+    old_path = os.path.join(directory, "old.db")
+    new_path = os.path.join(directory, "new.db")
+    changes_path = os.path.join(directory, "changes.jsonl.gz")
+    build_db(old_path, blocks, release="1")
+    build_db(new_path, new_blocks, release="2")
+
+    summary = diff_databases(old_path, new_path, changes_path)
+    print(summary)
+    counts = summary["counts"]
+    operations = list(read_changeset(changes_path))[1:-1]
+    assert {operation["op"] for operation in operations} == {"+", "-", "~"}
+    assert len(operations) == counts["added"] + counts["removed"] + counts["reassigned"]
+    assert counts["unchanged"] + counts["reassigned"] + counts["added"] == len(new_blocks)
+    assert counts["unchanged"] + counts["reassigned"] + counts["removed"] == len(blocks)
+    assert summary["changed_columns"]["country"] > 0 and summary["changed_columns"]["netname"] > 0
+    assert all(set(operation["old"]) <= {"netname", "country", "descr", "mnt_by"} for operation in operations if operation["op"] == "~")
+    assert any(operation["ip_version"] == 6 and operation["first_ip_int"] > 2 ** 64 for operation in operations)
+
+    # Applied to a copy of the old release, with or without the normalized schema and the flat table
+    for normalized in (False, True):
+        base_path = os.path.join(directory, f"base_{normalized}.db")
+        build_db(base_path, blocks, normalized=normalized, release="1")
+        build_flat_table(base_path)
+        assert database_digest(sqlite3.connect(base_path)) == summary["old_digest"]
+        assert apply_changeset(base_path, changes_path) == counts
+        build_flat_table(new_path)
+        assert contents(base_path) == contents(new_path), normalized
+        # The changeset is for the old release only
+        try:
+            apply_changeset(base_path, changes_path)
+        except ValueError as error:
+            print(error)
+        else:
+            raise AssertionError("applied twice")
+
+    # Without the checks a wrong base is refused as well, and left untouched
+    wrong_path = os.path.join(directory, "wrong.db")
+    build_db(wrong_path, blocks[10:], release="1")
+    before = contents(wrong_path)
+    try:
+        apply_changeset(wrong_path, changes_path, verify=False)
+    except ValueError as error:
+        print(error)
+    else:
+        raise AssertionError("applied to the wrong release")
+    assert contents(wrong_path) == before
+
+    # Same rows in another order (other ids): nothing changes
+    shuffled_path = os.path.join(directory, "shuffled.db")
+    build_db(shuffled_path, rng.sample(blocks, len(blocks)), release="1")
+    summary = diff_databases(old_path, shuffled_path, changes_path)
+    assert summary["counts"]["unchanged"] == len(blocks) and summary["old_digest"] == summary["new_digest"]
+    assert len(list(read_changeset(changes_path))) == 2
+
+    # A truncated changeset is refused
+    with gzip.open(changes_path, "rt") as file:
+        header = file.readline()
+    with gzip.open(changes_path, "wt") as file:
+        file.write(header)
+    shutil.copy(old_path, wrong_path)
+    try:
+        apply_changeset(wrong_path, changes_path)
+    except ValueError as error:
+        print(error)
+    else:
+        raise AssertionError("truncated changeset")
+print("Release diff OK")
@@ -0,0 +1,60 @@
+from pathlib import Path
+import os
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from lib.rpsl_reader import read_rpsl_objects
+
+OBJECTS = """% RIPE dump header
+
+inetnum:        81.0.0.0 - 81.0.255.255
+netname:        NET-ONE
+descr:          First line
+descr:          Second line
+country:        IT
+mnt-by:         MNT-ONE
+status:         ASSIGNED PA
+
+inetnum:        81.1.0.0 - 81.1.255.255
+netname:        NET-TWO
+descr:          Continued
++               value
+country:        DE
+
+inet6num:       2a02:1::/32
+netname:        NET-SIX
+country:        FR
+"""
+EXPECTED = [
+    ("81.0.0.0 - 81.0.255.255", None, "NET-ONE", "IT", "First line\nSecond line", "MNT-ONE", "ASSIGNED PA"),
+    ("81.1.0.0 - 81.1.255.255", None, "NET-TWO", "DE", "Continued value", None, None),
+    (None, "2a02:1::/32", "NET-SIX", "FR", None, None, None),
+]
+
+with tempfile.TemporaryDirectory() as directory:
+    lf_path = os.path.join(directory, "ripe.db.inetnum")
+    crlf_path = os.path.join(directory, "ripe.db.inetnum.crlf")
+    # Several blank lines, or whitespace-only lines, between the objects
+    blank_path = os.path.join(directory, "ripe.db.inetnum.blank")
+    whitespace_path = os.path.join(directory, "ripe.db.inetnum.whitespace")
+    variants = {
+        lf_path: OBJECTS,
+        crlf_path: OBJECTS.replace("\n", "\r\n"),
+        blank_path: OBJECTS.replace("\n\n", "\n\n\n").replace("DE\n\n", "DE\n\n\n\n"),
+        whitespace_path: " \n" + OBJECTS.replace("\n\n", "\n   \n").replace("DE\n   \n", "DE\n\t\n\n \n"),
+    }
+    for path, content in variants.items():
+        with open(path, "wb") as file:
+            file.write(content.encode("latin-1"))
+
+    for path in variants:
+        assert list(read_rpsl_objects(path)) == EXPECTED, (path, list(read_rpsl_objects(path)))
+    # Every chunk size splits some "\r\n" between two chunks
+    for chunk_size in range(1, 64):
+        for path in variants:
+            objects = list(read_rpsl_objects(path, chunk_size=chunk_size))
+            assert objects == EXPECTED, (path, chunk_size, objects)
+print("RPSL reader OK")
@@ -0,0 +1,118 @@
+from pathlib import Path
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from benchmarks.fixtures import write_rpsl_v4, write_rpsl_v6
+from lib.common import ip_int_from_db
+from lib.db import IP_DATA_COLUMNS, SCHEMA_VERSION, SQLiteHandler
+from lib.ripe_parser import RIPE_PARSER
+
+# ip_data as created before schema version 2, with the integers as TEXT and no user_version
+CREATE_V1_QUERIES = (
+    '''CREATE TABLE ip_data
+                    (id INTEGER PRIMARY KEY,
+                    first_ip TEXT,
+                    last_ip TEXT,
+                    first_ip_int TEXT,
+                    last_ip_int TEXT,
+                    ip_version INTEGER,
+                    subnet INTEGER,
+                    network_prefix TEXT,
+                    netname TEXT,
+                    country TEXT,
+                    descr TEXT,
+                    mnt_by TEXT)''',
+    "CREATE INDEX idx_first_ip_int ON ip_data (first_ip_int)",
+    "CREATE INDEX idx_last_ip_int ON ip_data (last_ip_int)",
+    "CREATE INDEX idx_ip_version ON ip_data (ip_version)",
+    "CREATE INDEX idx_network_prefix ON ip_data (network_prefix)",
+)
+
+
+def ip_data_rows(db_path: str) -> list:
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(f"SELECT id, {', '.join(IP_DATA_COLUMNS)} FROM ip_data ORDER BY id").fetchall()
+    conn.close()
+    return rows
+
+
+with tempfile.TemporaryDirectory() as directory:
+    blocks = []
+    for name, write in (("inetnum.db", write_rpsl_v4), ("inet6num.db", write_rpsl_v6)):
+        write(os.path.join(directory, name), 800, random.Random(3))
+        RIPE_PARSER.parse_file(os.path.join(directory, name), blocks.append)
+    assert {block.ip_version for block in blocks} == {4, 6}
+
+    v1_path = os.path.join(directory, "v1.db")
+    conn = sqlite3.connect(v1_path)
+    for query in CREATE_V1_QUERIES:
+        conn.execute(query)
+    conn.executemany(
+        f"INSERT INTO ip_data ({', '.join(IP_DATA_COLUMNS)}) VALUES ({', '.join('?' * len(IP_DATA_COLUMNS))})",
+        [
+            (row[0], row[1], str(block.first_ip_int), str(block.last_ip_int), *row[4:])
+            for block, row in ((block, SQLiteHandler.block_to_row(block)) for block in blocks)
+        ],
+    )
+    conn.commit()
+    conn.close()
+    assert SQLiteHandler(v1_path).schema_version() == 1
+
+    # Direct imports at schema version 2, with insert_data and with the bulk writer
+    insert_path = os.path.join(directory, "insert.db")
+    db_handler = SQLiteHandler(insert_path)
+    db_handler.create_table()
+    db_handler.insert_data(blocks)
+    db_handler.create_indexes()
+
+    bulk_path = os.path.join(directory, "bulk.db")
+    db_handler = SQLiteHandler(bulk_path)
+    db_handler.create_table()
+    # Small commits, a generator and a batch with fingerprints
+    with db_handler.bulk_writer(commit_rows=100) as writer:
+        writer.write_many(block for block in blocks[:500])
+        writer.write_many(blocks[500:], registry="ripe-inetnum")
+        assert writer.rows_written == len(blocks)
+    db_handler.create_indexes()
+    conn = sqlite3.connect(bulk_path)
+    assert conn.execute("SELECT MIN(ip_data_id), COUNT(*) FROM ip_data_fingerprints").fetchone() == (501, len(blocks) - 500)
+    conn.close()
+
+    result = subprocess.run(
+        [sys.executable, str(path_root / "scripts" / "migrate_db.py"), v1_path], capture_output=True, text=True, check=True
+    )
+    assert "Migration complete." in result.stdout, result.stdout
+    result = subprocess.run(
+        [sys.executable, str(path_root / "scripts" / "migrate_db.py"), v1_path], capture_output=True, text=True, check=True
+    )
+    assert f"already at schema version {SCHEMA_VERSION}" in result.stdout, result.stdout
+
+    expected = ip_data_rows(insert_path)
+    assert len(expected) == len(blocks)
+    for db_path in (v1_path, bulk_path):
+        assert ip_data_rows(db_path) == expected, db_path
+
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        types = conn.execute(
+            "SELECT ip_version, typeof(first_ip_int), typeof(last_ip_int), length(first_ip_int), COUNT(*) FROM ip_data "
+            "GROUP BY 1, 2, 3, 4"
+        ).fetchall()
+        assert sorted(row[:3] for row in types) == [(4, "integer", "integer"), (6, "blob", "blob")], types
+        assert [row[3] for row in types if row[0] == 6] == [16]
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'ip_data'")}
+        assert {"idx_first_ip_int", "idx_last_ip_int", "idx_ip_version", "idx_network_prefix"} <= indexes, indexes
+        # INTEGER before BLOB and BLOBs compared bytewise: the index order is the numeric one
+        plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN SELECT id FROM ip_data ORDER BY first_ip_int"))
+        assert "idx_first_ip_int" in plan, plan
+        ordered = [(version, ip_int_from_db(value)) for version, value in conn.execute("SELECT ip_version, first_ip_int FROM ip_data ORDER BY first_ip_int")]
+        assert ordered == sorted(ordered)
+        conn.close()
+print("Schema migration OK")
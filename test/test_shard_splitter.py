@@ -0,0 +1,71 @@
+from pathlib import Path
+import gzip
+import os
+import random
+import shutil
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from benchmarks.fixtures import write_rpsl_v4, write_rpsl_v6
+from lib.ip_data_processor import explore_folder
+from lib.ripe_parser import RIPE_PARSER
+from lib.shard_splitter import find_object_offsets, split_file
+
+
+def parse(shard):
+    blocks = []
+    RIPE_PARSER.parse_file(shard.file_path, blocks.append, **shard.parse_kwargs())
+    return blocks
+
+
+def key(block):
+    return (block.first_ip, block.last_ip, block.netname, block.descr)
+
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "ripe.db.inetnum")
+    objects = write_rpsl_v4(path, 2000, random.Random(3))
+    with open(path, "rb") as file:
+        data = file.read()
+    whole = []
+    RIPE_PARSER.parse_file(path, whole.append)
+    assert len(whole) == objects
+
+    # Any number of shards gives the same blocks, every shard starts after a blank line
+    for shards in (1, 2, 7, 64, 5000):
+        ranges = find_object_offsets(path, shards)
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(data) and len(ranges) <= shards
+        assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+        assert all(data[start - 2:start] == b"\n\n" for start, _ in ranges[1:])
+        blocks = [block for shard in split_file(path, shards) for block in parse(shard)]
+        assert blocks == whole, shards
+    assert len(split_file(path, shard_size=len(data) // 4)) in (4, 5)
+
+    # "\r\n" line ends
+    crlf_path = os.path.join(directory, "crlf.db")
+    with open(crlf_path, "wb") as file:
+        file.write(data.replace(b"\n", b"\r\n"))
+    assert [key(block) for shard in split_file(crlf_path, 9) for block in parse(shard)] == [key(block) for block in whole]
+
+    # Compressed dumps are a single shard
+    with gzip.open(path + ".gz", "wb") as file:
+        file.write(data)
+    assert [shard.end for shard in split_file(path + ".gz", 8)] == [None]
+
+    # explore_folder walks the ".db" files of a folder and parses their shards in parallel
+    folder = os.path.join(directory, "chunks")
+    os.makedirs(os.path.join(folder, "0"))
+    shutil.copy(path, os.path.join(folder, "0", "0.db"))
+    v6_objects = write_rpsl_v6(os.path.join(folder, "0", "1.db"), 500, random.Random(4))
+    expected = []
+    for name in ("0.db", "1.db"):
+        RIPE_PARSER.parse_file(os.path.join(folder, "0", name), expected.append)
+    for workers in (1, 3):
+        received = []
+        explore_folder(folder, received.append, workers=workers, shard_size=len(data) // 5)
+        assert len(received) == objects + v6_objects
+        assert sorted(map(key, received)) == sorted(map(key, expected)), workers
+print("Shard splitter OK")
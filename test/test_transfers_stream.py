@@ -0,0 +1,71 @@
+from pathlib import Path
+import gzip
+import json
+import os
+import sys
+import tempfile
+path_root = Path(__file__).parents[1]
+sys.path.append(str(path_root))
+print(sys.path)
+
+from lib.json_stream import iter_json_array
+from lib.ripe_parser import RIPE_PARSER
+
+transfers = [
+    {
+        "description": "Transfer 0",
+        "recipient_organization": {"name": "ORG-0", "country_code": "US"},
+        "ip4nets": {"transfer_set": [
+            {"start_address": "012.000.001.000", "end_address": "12.0.1.255"},
+            {"start_address": "300.0.0.0", "end_address": "300.0.0.255"},
+        ]},
+        "ip6nets": {"transfer_set": [{"start_address": "2620:0:9::", "end_address": "2620:0:9:ffff:ffff:ffff:ffff:ffff"}]},
+    },
+    {"description": "No nets", "recipient_organization": {"name": "ORG-1"}},
+    {"description": "No organization", "ip4nets": {"transfer_set": [{"start_address": "1.0.0.0", "end_address": "1.0.0.255"}]}},
+    {
+        "description": "Città è \"quoted\" ]}",
+        "recipient_organization": {"name": "ORG-2", "country_code": "CA"},
+        "ip6nets": {"transfer_set": [{"start_address": "2620:1::", "end_address": "2620:1::5"}]},
+    },
+]
+document = {"version": 1.5, "transfers": transfers, "generated": [1, 2, {"a": "transfers"}]}
+
+with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, "transfers_latest.json")
+    for indent in (None, 2):
+        with open(path, "w") as file:
+            json.dump(document, file, indent=indent, ensure_ascii=False)
+        # Tiny chunks split the values everywhere
+        for chunk_size in (1, 3, 7, 64, 1 << 20):
+            assert list(iter_json_array(path, "transfers", chunk_size=chunk_size)) == transfers, (indent, chunk_size)
+        assert list(iter_json_array(path, "missing")) == []
+
+    with open(path, "w") as file:
+        file.write('{"transfers": [ ]}')
+    assert list(iter_json_array(path, "transfers")) == []
+
+    with open(path, "w") as file:
+        file.write('{"transfers": [{"description": "truncated"')
+    try:
+        list(iter_json_array(path, "transfers"))
+        raise AssertionError("A truncated file must raise")
+    except ValueError:
+        pass
+
+    gz_path = path + ".gz"
+    with gzip.open(gz_path, "wt", encoding="utf-8") as file:
+        json.dump(document, file)
+    blocks = []
+    RIPE_PARSER.parse_transfer_json_file(gz_path, blocks.append)
+
+for block in blocks:
+    print(block)
+assert [(block.ip_version, block.first_ip, block.last_ip, block.subnet) for block in blocks] == [
+    (4, "12.0.1.0", "12.0.1.255", None),
+    (6, "2620:0000:0009:0000:0000:0000:0000:0000", "2620:0000:0009:ffff:ffff:ffff:ffff:ffff", 48),
+    (6, "2620:0001:0000:0000:0000:0000:0000:0000", "2620:0001:0000:0000:0000:0000:0000:0005", 126),
+]
+assert blocks[0].first_ip_int == (12 << 24) | 256 and blocks[0].netname == "ORG-0"
+assert blocks[2].descr == transfers[3]["description"]
+print("Transfers stream OK")